@@ -1,9 +1,11 @@
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
 from decouple import Csv
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,23 +52,64 @@ for name in os.listdir(PROJECT_ROOT + "/.."):
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "django_grp_core.timing.server_timing_middleware",
+    "django_grp_core.metrics.metrics_middleware",
+    "django_grp_core.db_router.replica_routing_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django_grp_core.profiling.profiling_middleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "x_forwarded_for.middleware.XForwardedForMiddleware",
-    "django.middleware.gzip.GZipMiddleware",
-    "django_auto_logout.middleware.auto_logout",
+    "django_grp_core.middleware.CompressionMiddleware",
+    "django_grp_core.middleware.IdleTimeoutMiddleware",
 ]
 
+# Idle logout of session users (see django_grp_core.middleware.IdleTimeoutMiddleware).
 AUTO_LOGOUT = {
     "IDLE_TIME": timedelta(hours=1),
+    "ACTIVITY_GRANULARITY": timedelta(
+        seconds=config("AUTO_LOGOUT_ACTIVITY_GRANULARITY", default=60, cast=int)
+    ),
     "MESSAGE": "Your session has expired. Please log in again",
-    "REDIRECT_TO_LOGIN_IMMEDIATELY": True,
+}
+
+# Request timing (see django_grp_core.timing): staff users get a Server-Timing
+# header, requests above these thresholds are logged.
+REQUEST_TIMING = {
+    "SLOW_MS": config("REQUEST_TIMING_SLOW_MS", default=1000, cast=int),
+    "MAX_QUERIES": config("REQUEST_TIMING_MAX_QUERIES", default=50, cast=int),
+}
+
+# Opt-in cProfile profiling of staff requests (see django_grp_core.profiling).
+PROFILER = {
+    "DIR": config(
+        "PROFILER_DIR",
+        default=os.path.join(tempfile.gettempdir(), "group-protocol-profiles"),
+        cast=str,
+    ),
+    "MAX_FILES": config("PROFILER_MAX_FILES", default=50, cast=int),
+    "MAX_BYTES": config("PROFILER_MAX_BYTES", default=50 * 1024 * 1024, cast=int),
+}
+
+# Prometheus metrics (see django_grp_core.metrics). Workers share their
+# counters through METRICS_DIR; scrapers authenticate with METRICS_TOKEN.
+METRICS = {
+    "DIR": config("METRICS_DIR", default=None),
+    "FLUSH_INTERVAL": config("METRICS_FLUSH_INTERVAL", default=5, cast=int),
+    "TOKEN": config("METRICS_TOKEN", default=""),
+}
+
+# Response compression (see django_grp_core.middleware.CompressionMiddleware).
+# brotli and zstd are used when the "brotli"/"zstandard" packages are installed.
+COMPRESSION = {
+    "MIN_LENGTH": 200,
+    "CACHE_MIN_LENGTH": config("COMPRESSION_CACHE_MIN_LENGTH", default=8192, cast=int),
+    "CACHE_TIMEOUT": config("COMPRESSION_CACHE_TIMEOUT", default=3600, cast=int),
 }
 
 ROOT_URLCONF = "django_group_protocol.urls"
@@ -112,10 +155,134 @@ DATABASES = {
         "PASSWORD": MAIN_DATABASE_PASSWD,
         "HOST": MAIN_DATABASE_HOST,
         "PORT": MAIN_DATABASE_PORT,
-        "OPTIONS": {"init_command": "SET sql_mode='STRICT_TRANS_TABLES'"},
+        "OPTIONS": (
+            {"init_command": "SET sql_mode='STRICT_TRANS_TABLES'"}
+            if "mysql" in MAIN_DATABASE_ENGINE
+            else {}
+        ),
     },
 }
 
+# Read replicas. Each comma-separated host and/or name adds a "replica_N"
+# connection with the primary's settings; safe requests read from a random
+# replica unless the client wrote within REPLICA_STICKY_SECONDS (see
+# django_grp_core.db_router). That pin is kept in the cache, so replicas need
+# REDIS_URL. Two SQLite files work for local testing, e.g.
+# MAIN_DATABASE_NAME=primary.sqlite3 REPLICA_DATABASE_NAMES=replica.sqlite3.
+REPLICA_DATABASE_HOSTS = config("REPLICA_DATABASE_HOSTS", default="", cast=Csv())
+REPLICA_DATABASE_NAMES = config("REPLICA_DATABASE_NAMES", default="", cast=Csv())
+REPLICA_DATABASE_USER = config(
+    "REPLICA_DATABASE_USER", default=MAIN_DATABASE_USER, cast=str
+)
+REPLICA_DATABASE_PASSWD = config(
+    "REPLICA_DATABASE_PASSWD", default=MAIN_DATABASE_PASSWD, cast=str
+)
+REPLICA_DATABASE_PORT = config(
+    "REPLICA_DATABASE_PORT", default=MAIN_DATABASE_PORT, cast=str
+)
+REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", default=5, cast=int)
+REPLICA_PIN_CACHE_ALIAS = "default"
+
+for index in range(max(len(REPLICA_DATABASE_HOSTS), len(REPLICA_DATABASE_NAMES))):
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "NAME": (
+            REPLICA_DATABASE_NAMES[index]
+            if index < len(REPLICA_DATABASE_NAMES)
+            else MAIN_DATABASE_NAME
+        ),
+        "HOST": (
+            REPLICA_DATABASE_HOSTS[index]
+            if index < len(REPLICA_DATABASE_HOSTS)
+            else MAIN_DATABASE_HOST
+        ),
+        "USER": REPLICA_DATABASE_USER,
+        "PASSWORD": REPLICA_DATABASE_PASSWD,
+        "PORT": REPLICA_DATABASE_PORT,
+        # Tests run against the primary only.
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["django_grp_core.db_router.PrimaryReplicaRouter"]
+
+REDIS_URL = config("REDIS_URL", default="", cast=str)
+
+# Redis when available (shared by all workers), process-local memory otherwise.
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+        },
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+
+# Whether the default cache is shared by all workers. Process-local caches
+# only see invalidations of their own worker, so data that must change
+# everywhere at once (permission matrices, cached responses, sessions) is
+# cached long-term only when this is set.
+SHARED_CACHE = bool(REDIS_URL)
+
+# A pin in a process-local cache is missed by the other workers, whose reads
+# would then not see the client's own writes.
+if DATABASE_REPLICAS and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        "Read replicas need a cache shared by all workers, set REDIS_URL."
+    )
+
+# With a shared cache sessions are read from it and only hit the database
+# when saved; a process-local one would keep serving logged-out sessions in
+# the other workers.
+if SHARED_CACHE:
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+else:
+    SESSION_ENGINE = "django.contrib.sessions.backends.db"
+
+# Per-user cache of group, resident and protocol responses
+# (see django_grp_api.cache), only with a cache shared by all workers.
+RESPONSE_CACHE = {
+    "ENABLED": SHARED_CACHE,
+    "TIMEOUT": config("RESPONSE_CACHE_TIMEOUT", default=300, cast=int),
+}
+
+# Exported protocols older than AFTER_DAYS are moved to the archive tables
+# by "manage.py archive_protocols" (see django_grp_backend.archive).
+ARCHIVE = {
+    "AFTER_DAYS": config("ARCHIVE_AFTER_DAYS", default=365, cast=int),
+    "BATCH_SIZE": config("ARCHIVE_BATCH_SIZE", default=500, cast=int),
+}
+
+# Images (resident pictures) with more pixels than this are rejected from
+# their header, before any decoding (see django_grp_backend.functions).
+IMAGES = {
+    "MAX_PIXELS": config("IMAGE_MAX_PIXELS", default=50_000_000, cast=int),
+}
+
+# Resumable chunked uploads under /api/v1/upload/ (see django_grp_api.uploads).
+UPLOADS = {
+    "MAX_SIZE": config("UPLOAD_MAX_SIZE", default=100 * 1024 * 1024, cast=int),
+    "MAX_CHUNK_SIZE": config(
+        "UPLOAD_MAX_CHUNK_SIZE", default=8 * 1024 * 1024, cast=int
+    ),
+    "EXPIRE_AFTER": config("UPLOAD_EXPIRE_AFTER", default=24 * 60 * 60, cast=int),
+    "TEMP_DIR": config("UPLOAD_TEMP_DIR", default="") or None,
+}
+
+# Live protocol events (Server-Sent Events). Use
+# "django_grp_api.events.RedisBroker" when running more than one worker.
+PROTOCOL_EVENTS = {
+    "BROKER": config(
+        "PROTOCOL_EVENTS_BROKER",
+        default="django_grp_api.events.InProcessBroker",
+        cast=str,
+    ),
+    "KEEPALIVE": config("PROTOCOL_EVENTS_KEEPALIVE", default=15, cast=int),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -140,7 +307,12 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.BasicAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
-        "rest_framework.permissions.IsAuthenticated",
+        "django_grp_api.permissions.GroupResourcePermission",
+    ],
+    # The JSON renderer records the "serialize" phase of request timings.
+    "DEFAULT_RENDERER_CLASSES": [
+        "django_grp_core.timing.TimedJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
     ],
 }
 
@@ -0,0 +1,15 @@
+"""
+Settings for ``manage.py test``: the regular settings plus what only tests use.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, MAIN_DATABASE_ENGINE
+
+# A second SQLite database standing in for a lagging replica (see
+# django_grp_core.tests.ReplicaReadTestCase). It is not in DATABASE_REPLICAS,
+# so nothing reads from it unless a test routes there.
+if "sqlite3" in MAIN_DATABASE_ENGINE:
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "test-replica.sqlite3",
+    }
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ApiConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "django_grp_api"
+
+    def ready(self):
+        # Connect the response cache and permission invalidation signals.
+        from django_grp_api import cache, permissions  # noqa: F401
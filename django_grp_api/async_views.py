@@ -0,0 +1,81 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of DRF's ``APIView`` for I/O-bound endpoints.
+
+    DRF views are sync-only, so under ASGI every request hops to a worker
+    thread for its whole lifetime. Subclasses implement ``async def
+    get/post/...`` handlers and use Django's async ORM; only authentication,
+    permission checks and body parsing (DRF's configured authenticators,
+    permission classes and parsers) run in a single thread hop before the
+    handler is awaited. Object permissions are up to the handlers.
+
+    Handlers receive a DRF ``Request`` (``request.user``, ``request.data``,
+    ``request.FILES``, ...) and return plain Django responses.
+    """
+
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Token/basic authenticated API, same as APIView.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None)
+        if method not in self.http_method_names or handler is None:
+            return HttpResponseNotAllowed(self._allowed_methods())
+
+        api_request = Request(
+            request,
+            parsers=[parser() for parser in self.parser_classes],
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            await sync_to_async(self.initial)(api_request)
+        except exceptions.APIException as exc:
+            return self.handle_exception(api_request, exc)
+
+        return await handler(api_request, *args, **kwargs)
+
+    def initial(self, request):
+        """
+        Authenticate, check permissions and parse the body (runs in a worker
+        thread, so permission classes may query the database).
+        """
+        if not request.user or not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        for permission in self.permission_classes:
+            if not permission().has_permission(request, self):
+                raise exceptions.PermissionDenied()
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            # Parse the body here so handlers never touch the blocking stream.
+            request.data  # noqa: B018
+
+    def handle_exception(self, request, exc):
+        """Render DRF exceptions the way ``APIView.handle_exception`` does."""
+        response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+        if isinstance(exc, exceptions.NotAuthenticated):
+            authenticators = request.authenticators
+            header = (
+                authenticators[0].authenticate_header(request)
+                if authenticators
+                else None
+            )
+            if header:
+                response["WWW-Authenticate"] = header
+            else:
+                response.status_code = status.HTTP_403_FORBIDDEN
+        return response
@@ -0,0 +1,712 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks never touch the configured database: they run against a
+throwaway test database created the same way ``manage.py test`` does.
+
+``seed_dataset`` bulk-loads a synthetic dataset (also used by ``seed_load``
+to fill a real database), ``create_fixtures`` adds the users and objects the
+requests act on, and ``build_scenarios`` describes one or more requests for
+every route in ``django_grp_api/urls.py``.
+"""
+
+import contextlib
+import cProfile
+import hashlib
+import io
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from django_grp_api.uploads import append_chunk, receive_chunk, start_session
+from django_grp_backend.archive import archive_protocols
+from django_grp_backend.models import (
+    Group,
+    Protocol,
+    ProtocolItem,
+    ProtocolPresence,
+    ProtocolTodo,
+    RandomizedFileName,
+    Resident,
+    UploadSession,
+    UserPermission,
+)
+from django_grp_core.profiling import get_profiler_setting
+
+
+@contextlib.contextmanager
+def benchmark_environment(keepdb=False, verbosity=0):
+    """Create test databases and a temporary MEDIA_ROOT for the duration."""
+    old_config = setup_databases(verbosity=verbosity, interactive=False, keepdb=keepdb)
+    try:
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                PROFILER={"DIR": os.path.join(media_root, "profiles")},
+                UPLOADS={"TEMP_DIR": os.path.join(media_root, "uploads")},
+                ALLOWED_HOSTS=["*"],
+            ):
+                yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity, keepdb=keepdb)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0 < pct <= 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed=None):
+    """Latency percentiles in milliseconds, plus throughput if ``elapsed`` is given."""
+    summary = {
+        "count": len(latencies),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+    if elapsed is not None:
+        summary["requests_per_second"] = (
+            round(len(latencies) / elapsed, 1) if elapsed else 0.0
+        )
+    return summary
+
+
+# ============ DATASET ============
+
+# Production-sized volumes; the commands scale them down with --scale.
+# Memberships are user/group pairs; every protocol gets a presence row for
+# each member of its group, as ``create_protocol_presence`` would create.
+DEFAULT_VOLUMES = {
+    "groups": 500,
+    "users": 2_000,
+    "memberships": 4_000,
+    "residents": 20_000,
+    "pictures": 2_000,
+    "protocols": 200_000,
+    "items": 2_000_000,
+    "todos": 400_000,
+}
+
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hans"]
+LAST_NAMES = ["Schmidt", "Müller", "Meyer", "Weber", "Wagner", "Becker", "Hoffmann"]
+ITEM_NAMES = ["Anwesenheit", "Tagesordnung", "Berichte", "Finanzen", "Sonstiges"]
+TODO_TEXTS = ["Einkauf planen", "Termin vereinbaren", "Antrag stellen", "Putzplan"]
+
+
+def _bulk_create(model, objects, batch_size):
+    """bulk_create an iterable in chunks without materializing all of it."""
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch, batch_size=batch_size)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch, batch_size=batch_size)
+
+
+def _max_id(model):
+    return model.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+
+
+def _ids(model, after=0):
+    # bulk_create doesn't return primary keys on every backend (MySQL).
+    return list(
+        model.objects.filter(id__gt=after).order_by("id").values_list("id", flat=True)
+    )
+
+
+def _spread(total, keys):
+    """Yield ``(key, position)`` for ``total`` rows spread evenly over ``keys``."""
+    if not keys:
+        return
+    per_key, remainder = divmod(total, len(keys))
+    for index, key in enumerate(keys):
+        for position in range(per_key + (index < remainder)):
+            yield key, position
+
+
+def _store_picture(rng):
+    """Save a generated PNG (no larger than Resident.save's 800px limit)."""
+    size = (rng.randrange(64, 320), rng.randrange(64, 320))
+    color = "#{:06x}".format(rng.randrange(0x1000000))
+    name = RandomizedFileName()(None, "seed.png")
+    return default_storage.save(name, ContentFile(_png(size, color)))
+
+
+def seed_dataset(
+    groups,
+    residents,
+    protocols,
+    items,
+    users=0,
+    memberships=0,
+    pictures=0,
+    todos=0,
+    seed=0,
+    batch_size=5000,
+    password=None,
+    log=None,
+):
+    """
+    Bulk-load a deterministic synthetic dataset.
+
+    Residents and protocols are spread round-robin over the groups, items and
+    todos evenly over the protocols; the first ``pictures`` residents get a
+    generated picture. Without groups no residents and protocols are created.
+    Users are named ``load-{seed}-{n}`` and share ``password`` (unusable if
+    None). ``Model.save()`` and signals are bypassed, rows created before are
+    left alone. Returns the created counts.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    start_date = date(2015, 1, 1)
+
+    log(f"Seeding {groups} groups")
+    after = _max_id(Group)
+    _bulk_create(
+        Group,
+        (
+            Group(
+                name=f"Gruppe {i}",
+                address=f"Hauptstraße {i}",
+                postalcode=f"{10000 + i % 90000}",
+                city="Berlin",
+            )
+            for i in range(groups)
+        ),
+        batch_size,
+    )
+    group_ids = _ids(Group, after)
+    if not group_ids:
+        # Residents and protocols (and with them items, todos and presence
+        # entries) belong to a group.
+        residents = protocols = 0
+
+    log(f"Seeding {users} users")
+    after = _max_id(User)
+    password_hash = make_password(password)
+    _bulk_create(
+        User,
+        (
+            User(
+                username=f"load-{seed}-{i}",
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                email=f"load-{seed}-{i}@example.com",
+                password=password_hash,
+            )
+            for i in range(users)
+        ),
+        batch_size,
+    )
+    user_ids = _ids(User, after)
+
+    # User n joins groups n, n+1, ... so every pair is unique.
+    memberships = min(memberships, len(user_ids) * len(group_ids))
+    log(f"Seeding {memberships} memberships")
+    members = {group_id: [] for group_id in group_ids}
+    for index in range(memberships):
+        user_index, offset = index % len(user_ids), index // len(user_ids)
+        group_id = group_ids[(user_index + offset) % len(group_ids)]
+        members[group_id].append(user_ids[user_index])
+    _bulk_create(
+        Group.group_members.through,
+        (
+            Group.group_members.through(group_id=group_id, user_id=user_id)
+            for group_id, user_ids_of_group in members.items()
+            for user_id in user_ids_of_group
+        ),
+        batch_size,
+    )
+
+    log(f"Seeding {residents} residents ({min(pictures, residents)} pictures)")
+    _bulk_create(
+        Resident,
+        (
+            Resident(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                moved_in_since=start_date + timedelta(days=rng.randrange(3650)),
+                group_id=group_ids[i % len(group_ids)],
+                picture=_store_picture(rng) if i < pictures else None,
+            )
+            for i in range(residents)
+        ),
+        batch_size,
+    )
+
+    log(f"Seeding {protocols} protocols")
+    after = _max_id(Protocol)
+    _bulk_create(
+        Protocol,
+        (
+            Protocol(
+                protocol_date=start_date + timedelta(days=i // len(group_ids)),
+                group_id=group_ids[i % len(group_ids)],
+                status="exported" if rng.random() < 0.8 else "draft",
+            )
+            for i in range(protocols)
+        ),
+        batch_size,
+    )
+    protocol_rows = list(
+        Protocol.objects.filter(id__gt=after)
+        .order_by("id")
+        .values_list("id", "group_id", "protocol_date")
+    )
+    protocol_ids = [protocol_id for protocol_id, _, _ in protocol_rows]
+
+    log(f"Seeding {items} items")
+    _bulk_create(
+        ProtocolItem,
+        (
+            ProtocolItem(
+                protocol_id=protocol_id,
+                name=ITEM_NAMES[position % len(ITEM_NAMES)],
+                position=position,
+                value="Lorem ipsum dolor sit amet. " * rng.randrange(1, 20),
+            )
+            for protocol_id, position in _spread(items, protocol_ids)
+        ),
+        batch_size,
+    )
+
+    log(f"Seeding {todos} todos")
+    protocol_dates = {protocol_id: day for protocol_id, _, day in protocol_rows}
+    _bulk_create(
+        ProtocolTodo,
+        (
+            ProtocolTodo(
+                protocol_id=protocol_id,
+                what=rng.choice(TODO_TEXTS),
+                who=rng.choice(FIRST_NAMES),
+                when=timezone.make_aware(
+                    datetime.combine(
+                        protocol_dates[protocol_id]
+                        + timedelta(days=rng.randrange(1, 30)),
+                        datetime.min.time(),
+                    )
+                ),
+                position=position,
+            )
+            for protocol_id, position in _spread(todos, protocol_ids)
+        ),
+        batch_size,
+    )
+
+    presence = sum(len(members[group_id]) for _, group_id, _ in protocol_rows)
+    log(f"Seeding {presence} presence entries")
+    _bulk_create(
+        ProtocolPresence,
+        (
+            ProtocolPresence(
+                protocol_id=protocol_id,
+                user_id=user_id,
+                was_present=rng.random() < 0.7,
+            )
+            for protocol_id, group_id, _ in protocol_rows
+            for user_id in members[group_id]
+        ),
+        batch_size,
+    )
+
+    return {
+        "groups": len(group_ids),
+        "users": len(user_ids),
+        "memberships": memberships,
+        "residents": residents,
+        "pictures": min(pictures, residents),
+        "protocols": len(protocol_ids),
+        "items": items if protocol_ids else 0,
+        "todos": todos if protocol_ids else 0,
+        "presence": presence,
+    }
+
+
+def _png(size=(64, 64), color="#3366aa"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def create_fixtures():
+    """
+    Create the actors and objects the benchmark requests act on.
+
+    ``member`` belongs to the first group; ``staff`` is a staff user. The hot
+    protocol is the newest draft of the first group, with a todo, a presence
+    entry and an exported file; the hot resident has a picture.
+    """
+    member = User.objects.create_user(
+        username="bench-member", password="bench", first_name="Bench"
+    )
+    staff = User.objects.create_user(
+        username="bench-staff", password="bench", is_staff=True
+    )
+    User.objects.create_user(username="bench-logout", password="bench")
+
+    group = Group.objects.order_by("id").first() or Group.objects.create(
+        name="Gruppe 0", address="-", postalcode="-", city="-"
+    )
+    other_group = Group.objects.exclude(id=group.id).order_by("id").first() or (
+        Group.objects.create(name="Gruppe 1", address="-", postalcode="-", city="-")
+    )
+    group.group_members.add(member)
+
+    protocol = Protocol.objects.create(protocol_date=date.today(), group=group)
+    protocol.exported_file.save("bench.pdf", ContentFile(b"%PDF-1.4\n" * 1024))
+    ProtocolItem.objects.bulk_create(
+        ProtocolItem(protocol=protocol, name=name, position=position, value="Text")
+        for position, name in enumerate(ITEM_NAMES)
+    )
+    ProtocolPresence.objects.get_or_create(protocol=protocol, user=member)
+    todo = ProtocolTodo.objects.create(
+        protocol=protocol, what="Bench todo", who="Bench", when=timezone.now()
+    )
+
+    resident = Resident.objects.create(
+        first_name="Bench",
+        last_name="Resident",
+        moved_in_since=date(2020, 1, 1),
+        group=group,
+    )
+    resident.picture.save("bench.png", ContentFile(_png()))
+
+    return {
+        "member": member,
+        "staff": staff,
+        "tokens": {
+            "member": Token.objects.create(user=member).key,
+            "staff": Token.objects.create(user=staff).key,
+        },
+        "group": group,
+        "other_group": other_group,
+        "protocol": protocol,
+        "item": protocol.items.first(),
+        "todo": todo,
+        "resident": resident,
+    }
+
+
+# ============ SCENARIOS ============
+
+
+def api_route_names():
+    """Names of all routes in ``django_grp_api/urls.py``, in declaration order."""
+    from django_grp_api import urls
+
+    names = []
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name and pattern.name not in names:
+                names.append(pattern.name)
+
+    walk(urls.urlpatterns)
+    return names
+
+
+def _logout_token(fixtures):
+    user = User.objects.get(username="bench-logout")
+    token, _ = Token.objects.get_or_create(user=user)
+    return {"token": token.key}
+
+
+def _add_membership(fixtures):
+    fixtures["other_group"].group_members.add(fixtures["member"])
+    return {}
+
+
+def _remove_membership(fixtures):
+    fixtures["other_group"].group_members.remove(fixtures["member"])
+    return {}
+
+
+def _create_permission(fixtures):
+    permission, _ = UserPermission.objects.get_or_create(
+        user=fixtures["member"],
+        group=fixtures["group"],
+        resource="protocol",
+        permission="delete",
+    )
+    return {
+        "kwargs": {"user_id": fixtures["member"].id, "permission_id": permission.id}
+    }
+
+
+def _store_profile(fixtures):
+    directory = get_profiler_setting("DIR")
+    os.makedirs(directory, exist_ok=True)
+    cProfile.Profile().dump_stats(os.path.join(directory, "bench.prof"))
+    return {"kwargs": {"name": "bench.prof"}}
+
+
+def _archived_protocol(fixtures):
+    if "archived_protocol" not in fixtures:
+        protocol = Protocol.objects.create(
+            protocol_date=date(2000, 1, 1),
+            group=fixtures["group"],
+            status="exported",
+            exported=True,
+        )
+        ProtocolItem.objects.create(protocol=protocol, name="Archived", position=0)
+        archive_protocols(date(2000, 1, 2))
+        fixtures["archived_protocol"] = protocol.id
+    return {"kwargs": {"pk": fixtures["archived_protocol"]}}
+
+
+def _clear_pdf_template(fixtures):
+    # Measure storing a new template rather than re-uploading the current one.
+    group = Group.objects.get(id=fixtures["group"].id)
+    group.pdf_template = ""
+    group.save(update_fields=["pdf_template"])
+
+
+def _pdf_upload(fixtures):
+    _clear_pdf_template(fixtures)
+    return {
+        "data": {
+            "pdf_template": SimpleUploadedFile(
+                "template.pdf", b"%PDF-1.4\n" * 256, "application/pdf"
+            )
+        },
+        "format": "multipart",
+    }
+
+
+UPLOAD_CONTENT = b"%PDF-1.4\n" * 256
+
+
+def _upload_session(fixtures, offset=0):
+    session = UploadSession.objects.create(
+        user=fixtures["member"],
+        target="pdf_template",
+        object_id=fixtures["group"].id,
+        filename="template.pdf",
+        size=len(UPLOAD_CONTENT),
+        checksum=hashlib.sha256(UPLOAD_CONTENT).hexdigest(),
+        offset=offset,
+    )
+    start_session(session)
+    return session
+
+
+def _upload_chunk(fixtures):
+    session = _upload_session(fixtures)
+    return {
+        "kwargs": {"pk": session.id},
+        "data": UPLOAD_CONTENT,
+        "content_type": "application/octet-stream",
+        "headers": {
+            "content-range": f"bytes 0-{len(UPLOAD_CONTENT) - 1}/{len(UPLOAD_CONTENT)}"
+        },
+    }
+
+
+def _complete_upload(fixtures):
+    _clear_pdf_template(fixtures)
+    session = _upload_session(fixtures, offset=len(UPLOAD_CONTENT))
+    chunk = receive_chunk(session, io.BytesIO(UPLOAD_CONTENT), len(UPLOAD_CONTENT))
+    with chunk as (path, _):
+        append_chunk(session, path, 0)
+    return {"kwargs": {"pk": session.id}}
+
+
+def build_scenarios(fixtures):
+    """
+    Requests to benchmark, as dicts with ``route`` (URL name), ``method``,
+    ``user`` ("member", "staff" or None), ``kwargs`` for reversing the URL,
+    ``query``, ``data`` (with ``content_type`` and ``headers`` for raw
+    bodies) and optionally ``prepare`` - a callable run (untimed)
+    before every request that returns overrides for these keys - or ``skip``
+    with a reason.
+    """
+    group = fixtures["group"]
+    protocol = fixtures["protocol"]
+    resident = fixtures["resident"]
+    member = fixtures["member"]
+
+    def scenario(route, method="GET", user="member", **extra):
+        return {"route": route, "method": method, "user": user, **extra}
+
+    return [
+        scenario(
+            "auth-login",
+            "POST",
+            None,
+            data={"username": "bench-member", "password": "bench"},
+        ),
+        scenario("auth-logout", "POST", None, prepare=_logout_token),
+        scenario("user-profile"),
+        scenario("user-me"),
+        scenario("api-root"),
+        scenario("protocol-list"),
+        scenario("protocol-detail", kwargs={"pk": protocol.id}),
+        scenario("group-list"),
+        scenario("group-detail", kwargs={"pk": group.id}),
+        scenario("resident-list"),
+        scenario("resident-detail", kwargs={"pk": resident.id}),
+        scenario("protocol-todo-list", kwargs={"protocol_pk": protocol.id}),
+        scenario(
+            "protocol-todo-detail",
+            kwargs={"protocol_pk": protocol.id, "pk": fixtures["todo"].id},
+        ),
+        scenario("resident-picture", kwargs={"resident_id": resident.id}),
+        scenario(
+            "group-pdf-template",
+            "POST",
+            kwargs={"group_id": group.id},
+            prepare=_pdf_upload,
+        ),
+        scenario(
+            "upload-session-list",
+            "POST",
+            data={
+                "target": "pdf_template",
+                "object_id": group.id,
+                "filename": "template.pdf",
+                "size": len(UPLOAD_CONTENT),
+                "checksum": hashlib.sha256(UPLOAD_CONTENT).hexdigest(),
+            },
+        ),
+        scenario("upload-session-detail", "PUT", prepare=_upload_chunk),
+        scenario("upload-session-finalize", "POST", prepare=_complete_upload),
+        scenario("protocol-presence-list", kwargs={"protocol_id": protocol.id}),
+        scenario("protocol-bundle", kwargs={"pk": protocol.id}),
+        scenario(
+            "protocol-clone",
+            "POST",
+            kwargs={"pk": protocol.id},
+            data={"protocol_date": "2030-01-01", "copy_values": True},
+        ),
+        scenario("protocol-exported-file", kwargs={"protocol_id": protocol.id}),
+        scenario("archived-protocol-detail", prepare=_archived_protocol),
+        scenario("archived-protocol-list"),
+        scenario(
+            "protocol-events",
+            kwargs={"protocol_id": protocol.id},
+            skip="long-lived ASGI stream; see bench_asgi",
+        ),
+        scenario(
+            "update-presence",
+            "POST",
+            data={"protocol": protocol.id, "user": member.id, "was_present": True},
+        ),
+        scenario(
+            "update-item",
+            "POST",
+            data={
+                "item_id": fixtures["item"].id,
+                "protocol": protocol.id,
+                "name": fixtures["item"].name,
+                "value": "Lorem ipsum " * 100,
+                "position": 0,
+            },
+        ),
+        scenario(
+            "rotate_image",
+            "POST",
+            data={"direction": "left", "image_url": resident.picture.url},
+        ),
+        scenario("mention-autocomplete", query=f"protocol_id={protocol.id}"),
+        scenario("admin-user-list", user="staff"),
+        scenario("admin-user-detail", user="staff", kwargs={"user_id": member.id}),
+        scenario(
+            "admin-user-groups",
+            "POST",
+            "staff",
+            kwargs={"user_id": member.id},
+            data={"group_id": fixtures["other_group"].id},
+            prepare=_remove_membership,
+        ),
+        scenario(
+            "admin-user-group-detail",
+            "DELETE",
+            "staff",
+            kwargs={"user_id": member.id, "group_id": fixtures["other_group"].id},
+            prepare=_add_membership,
+        ),
+        scenario("admin-user-permissions", user="staff", kwargs={"user_id": member.id}),
+        scenario(
+            "admin-user-permission-detail",
+            "DELETE",
+            "staff",
+            prepare=_create_permission,
+        ),
+        scenario("admin-profile-list", user="staff"),
+        scenario("admin-profile-detail", user="staff", prepare=_store_profile),
+        scenario("admin-metrics", user="staff"),
+    ]
+
+
+def run_request(client, fixtures, scenario):
+    """
+    Send one scenario request.
+
+    Returns ``(seconds, status_code, queries)`` where ``queries`` lists the
+    SQL run on any database connection.
+    """
+    request = dict(scenario)
+    if request.get("prepare"):
+        request.update(request["prepare"](fixtures))
+
+    path = reverse(request["route"], kwargs=request.get("kwargs"))
+    if request.get("query"):
+        path += "?" + request["query"]
+    token = request.get("token") or fixtures["tokens"].get(request["user"])
+    headers = {"authorization": f"Token {token}"} if token else {}
+    headers.update(request.get("headers", {}))
+    kwargs = {"headers": headers}
+    if request["method"] != "GET":
+        kwargs["data"] = request.get("data", {})
+        if request.get("format") != "multipart":
+            kwargs["content_type"] = request.get("content_type", "application/json")
+
+    # The databases requests are routed to; test mirrors may share one
+    # connection object.
+    aliases = [DEFAULT_DB_ALIAS, *getattr(settings, "DATABASE_REPLICAS", [])]
+    routed = {id(connections[alias]): connections[alias] for alias in aliases}
+    with contextlib.ExitStack() as stack:
+        captures = [
+            stack.enter_context(CaptureQueriesContext(connection))
+            for connection in routed.values()
+        ]
+        start = time.perf_counter()
+        response = getattr(client, request["method"].lower())(path, **kwargs)
+        elapsed = time.perf_counter() - start
+    if getattr(response, "streaming", False):
+        response.close()
+    queries = [query["sql"] for capture in captures for query in capture]
+    return elapsed, response.status_code, queries
@@ -0,0 +1,252 @@
+"""
+Per-user response cache for the group, resident, protocol and ``user/me``
+endpoints.
+
+Cached responses are tagged; a tag's current version is part of the cache
+key, so bumping a tag (see ``invalidate_tags``) makes every response carrying
+it unreachable without having to know the individual keys. Tags are:
+
+- ``user:{id}``     every response of that user (profile, staff and
+                    permission changes)
+- ``group:{id}``    responses of members of the group (group, resident,
+                    protocol and membership changes; items and todos
+                    being added or removed change the protocol list counts)
+- ``protocol:{id}`` protocol detail responses (item changes)
+- ``all``           responses of staff users, who see every group
+
+Model signals below bump the tags; code that bypasses signals
+(``QuerySet.update``, ``bulk_create``) must call ``invalidate_*`` itself.
+
+Tag versions only reach other workers through a shared cache, so caching is
+off unless ``RESPONSE_CACHE["ENABLED"]`` is set (``settings.SHARED_CACHE``).
+Responses are always built from the primary: a replica lagging behind a tag
+bump would otherwise be cached under the new version.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from django_grp_backend.models import (
+    Group,
+    Protocol,
+    ProtocolItem,
+    ProtocolTodo,
+    Resident,
+    UserPermission,
+)
+from django_grp_core.db_router import replica_reads
+
+from .permissions import get_permission_matrix
+
+RESPONSE_CACHE_DEFAULTS = {
+    # Only enable with a cache shared by all workers.
+    "ENABLED": False,
+    "ALIAS": "default",
+    # Seconds a cached response lives if no tag is bumped before.
+    "TIMEOUT": 300,
+}
+
+
+def get_response_cache_setting(name):
+    return getattr(settings, "RESPONSE_CACHE", {}).get(
+        name, RESPONSE_CACHE_DEFAULTS[name]
+    )
+
+
+def _cache():
+    return caches[get_response_cache_setting("ALIAS")]
+
+
+def _tag_key(tag):
+    return f"respcache:tag:{tag}"
+
+
+def _tag_versions(tags):
+    """Current version of each tag; unknown (or evicted) tags get a fresh one."""
+    cache = _cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    """
+    Bump ``tags`` now and again when the current transaction commits.
+
+    The second bump drops responses that concurrent requests cached from
+    not-yet-committed data in between.
+    """
+
+    def bump():
+        _cache().set_many({_tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_group(group_id):
+    invalidate_tags(f"group:{group_id}", "all")
+
+
+def invalidate_protocol(protocol_id):
+    invalidate_tags(f"protocol:{protocol_id}")
+
+
+class CachedResponseMixin:
+    """
+    Serve ``list`` and ``retrieve`` from the response cache.
+
+    Only successful responses are cached, keyed by user, absolute URL,
+    renderer and the versions of the user's tags. Other handlers can be
+    cached with ``cached_response``.
+    """
+
+    def get_cache_tags(self):
+        user = self.request.user
+        tags = [f"user:{user.id}"]
+        if user.is_staff:
+            tags.append("all")
+        else:
+            group_ids = get_permission_matrix(self.request).group_ids()
+            tags.extend(f"group:{group_id}" for group_id in group_ids)
+        return tags
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not get_response_cache_setting("ENABLED"):
+            return handler(request, *args, **kwargs)
+        tags = self.get_cache_tags()
+        parts = [
+            str(request.user.id),
+            request.build_absolute_uri(),
+            request.accepted_renderer.format,
+            *tags,
+            *_tag_versions(tags),
+        ]
+        key = "respcache:resp:" + hashlib.md5("|".join(parts).encode()).hexdigest()
+
+        data = _cache().get(key)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK)
+
+        with replica_reads(False):
+            response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            _cache().set(key, response.data, get_response_cache_setting("TIMEOUT"))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+# ============ INVALIDATION ============
+
+
+@receiver(post_init, sender=Resident)
+@receiver(post_init, sender=Protocol)
+def remember_group(sender, instance, **kwargs):
+    # Moving an object to another group must invalidate the old group too.
+    instance._cached_group_id = instance.__dict__.get("group_id")
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_change(sender, instance, **kwargs):
+    invalidate_group(instance.id)
+
+
+@receiver(post_save, sender=Resident)
+@receiver(post_delete, sender=Resident)
+@receiver(post_save, sender=Protocol)
+@receiver(post_delete, sender=Protocol)
+def invalidate_group_object_change(sender, instance, **kwargs):
+    group_ids = {instance.group_id, getattr(instance, "_cached_group_id", None)}
+    for group_id in group_ids - {None}:
+        invalidate_group(group_id)
+    instance._cached_group_id = instance.group_id
+    if sender is Protocol:
+        invalidate_protocol(instance.id)
+
+
+def _protocol_group_id(instance):
+    # None if the protocol is already gone (cascade delete).
+    if type(instance).protocol.is_cached(instance):
+        return instance.protocol.group_id
+    return (
+        Protocol.objects.filter(id=instance.protocol_id)
+        .values_list("group_id", flat=True)
+        .first()
+    )
+
+
+def _deleted_with_protocol(origin):
+    # Cascaded from a protocol delete, which invalidates by itself.
+    return getattr(origin, "model", type(origin)) is Protocol
+
+
+@receiver(post_save, sender=ProtocolItem)
+@receiver(post_delete, sender=ProtocolItem)
+def invalidate_item_change(sender, instance, created=None, origin=None, **kwargs):
+    if _deleted_with_protocol(origin):
+        return
+    invalidate_protocol(instance.protocol_id)
+    if created is not False:
+        # Added or removed: the item count in the protocol list changed.
+        group_id = _protocol_group_id(instance)
+        if group_id is not None:
+            invalidate_group(group_id)
+
+
+@receiver(post_save, sender=ProtocolTodo)
+@receiver(post_delete, sender=ProtocolTodo)
+def invalidate_todo_change(sender, instance, origin=None, **kwargs):
+    if _deleted_with_protocol(origin):
+        return
+    # Any change may move the (open) todo counts of the protocol list.
+    group_id = _protocol_group_id(instance)
+    if group_id is not None:
+        invalidate_group(group_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_change(sender, instance, **kwargs):
+    invalidate_tags(f"user:{instance.id}")
+
+
+@receiver(post_save, sender=UserPermission)
+@receiver(post_delete, sender=UserPermission)
+def invalidate_grant_change(sender, instance, **kwargs):
+    invalidate_tags(f"user:{instance.user_id}")
+
+
+@receiver(m2m_changed, sender=Group.group_members.through)
+def invalidate_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # user.group_set.clear(): remember the groups before they're gone.
+        instance._cleared_group_ids = list(
+            instance.group_set.values_list("id", flat=True)
+        )
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        invalidate_group(instance.id)
+    else:
+        group_ids = pk_set or getattr(instance, "_cleared_group_ids", [])
+        for group_id in group_ids:
+            invalidate_group(group_id)
@@ -0,0 +1,199 @@
+"""
+Live protocol events.
+
+Writes to items, presence and todos are published on a per-protocol channel
+and pushed to clients over Server-Sent Events (see ``ProtocolEventStreamView``)
+so they don't have to poll ``GET /api/v1/protocol/{id}/``.
+
+The broker is configured with ``PROTOCOL_EVENTS["BROKER"]``:
+
+- ``InProcessBroker`` (default) fans events out inside one process. Enough for
+  a single ASGI worker.
+- ``RedisBroker`` uses Redis pub/sub so events reach subscribers connected to
+  any worker or node.
+"""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+PROTOCOL_EVENTS_DEFAULTS = {
+    "BROKER": "django_grp_api.events.InProcessBroker",
+    "OPTIONS": {},
+    # Seconds between keep-alive comments on idle streams.
+    "KEEPALIVE": 15,
+}
+
+
+def get_events_setting(name):
+    return getattr(settings, "PROTOCOL_EVENTS", {}).get(
+        name, PROTOCOL_EVENTS_DEFAULTS[name]
+    )
+
+
+def protocol_channel(protocol_id):
+    return f"protocol:{protocol_id}"
+
+
+class BaseBroker:
+    """Interface for event brokers."""
+
+    def publish(self, channel, event):
+        """Publish ``event`` (a JSON-serializable dict). Callable from any thread."""
+        raise NotImplementedError
+
+    async def apublish(self, channel, event):
+        await sync_to_async(self.publish, thread_sensitive=False)(channel, event)
+
+    async def subscribe(self, channel):
+        """Return a subscription with ``async get(timeout)`` and ``async close()``."""
+        raise NotImplementedError
+
+
+class _QueueSubscription:
+    def __init__(self, broker, channel, queue):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue
+
+    async def get(self, timeout=None):
+        """Return the next event, or None if nothing arrived within ``timeout``."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker._unsubscribe(self.channel, self)
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Fan events out to subscribers of the current process.
+
+    Each subscriber owns a bounded queue on its event loop; a subscriber that
+    falls more than ``max_queue_size`` events behind misses the overflow
+    rather than slowing down publishers.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, {}).items())
+        for subscription, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, subscription.queue, event)
+            except RuntimeError:
+                # The subscriber's event loop is gone.
+                self._unsubscribe(channel, subscription)
+
+    async def apublish(self, channel, event):
+        self.publish(channel, event)
+
+    @staticmethod
+    def _deliver(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def subscribe(self, channel):
+        subscription = _QueueSubscription(
+            self, channel, asyncio.Queue(self.max_queue_size)
+        )
+        with self._lock:
+            self._subscribers[channel][subscription] = asyncio.get_running_loop()
+        return subscription
+
+    def _unsubscribe(self, channel, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.pop(subscription, None)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class _RedisSubscription:
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout=None):
+        message = await self.pubsub.get_message(
+            ignore_subscribe_messages=True, timeout=timeout
+        )
+        if message is None:
+            return None
+        return json.loads(message["data"])
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+class RedisBroker(BaseBroker):
+    """Redis pub/sub broker for deployments with several workers or nodes."""
+
+    def __init__(self, url=None, prefix="grp:events:"):
+        import redis
+
+        self.url = url or settings.REDIS_URL
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(self.url)
+
+    def publish(self, channel, event):
+        self._client.publish(
+            self.prefix + channel, json.dumps(event, cls=DjangoJSONEncoder)
+        )
+
+    async def subscribe(self, channel):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.prefix + channel)
+        return _RedisSubscription(client, pubsub)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    broker_class = import_string(get_events_setting("BROKER"))
+    return broker_class(**get_events_setting("OPTIONS"))
+
+
+def _event(event_type, data):
+    # Round-trip through JSON so every broker delivers the same plain types.
+    return json.loads(
+        json.dumps({"type": event_type, "data": data}, cls=DjangoJSONEncoder)
+    )
+
+
+def publish_protocol_event(protocol_id, event_type, data):
+    """Publish an event once the current transaction commits (sync callers)."""
+    event = _event(event_type, data)
+    transaction.on_commit(
+        lambda: get_broker().publish(protocol_channel(protocol_id), event)
+    )
+
+
+async def apublish_protocol_event(protocol_id, event_type, data):
+    """Publish an event from async code (writes there run in autocommit mode)."""
+    await get_broker().apublish(protocol_channel(protocol_id), _event(event_type, data))
+
+
+def format_sse(event):
+    """Encode an event as a Server-Sent Events message."""
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
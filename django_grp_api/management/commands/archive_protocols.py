@@ -0,0 +1,68 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_grp_backend.archive import (
+    archivable_protocols,
+    archive_protocols,
+    default_cutoff,
+    get_archive_setting,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move exported protocols older than the cutoff (ARCHIVE['AFTER_DAYS'], "
+        "default 365 days) with their items, todos and presence entries into "
+        "the archive tables, in batches of one transaction each. Safe to "
+        "interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before",
+            type=datetime.date.fromisoformat,
+            default=None,
+            help="Archive protocols dated before this day (YYYY-MM-DD) "
+            "instead of the configured cutoff.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help=f"Protocols per transaction (default {get_archive_setting('BATCH_SIZE')}).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many protocols would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = options["before"] or default_cutoff()
+        if cutoff > datetime.date.today():
+            raise CommandError("The cutoff must not be in the future.")
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        if options["dry_run"]:
+            count = archivable_protocols(cutoff).count()
+            self.stdout.write(
+                f"{count:,} protocols dated before {cutoff} would be archived"
+            )
+            return
+
+        start = time.perf_counter()
+        moved = archive_protocols(
+            cutoff,
+            batch_size=options["batch_size"],
+            log=lambda message: self.stderr.write(message),
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Archived "
+                + ", ".join(f"{count:,} {name}" for name, count in moved.items())
+                + f" dated before {cutoff} in {time.perf_counter() - start:.1f}s"
+            )
+        )
@@ -0,0 +1,254 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from rest_framework.authtoken.models import Token
+
+from django_grp_api.benchmark import benchmark_environment, summarize
+from django_grp_backend.models import Group, Protocol, ProtocolItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent throughput of the I/O-bound endpoints (file download, "
+        "item and presence writes) when served via ASGI (uvicorn-style, one event "
+        "loop) and via WSGI (uWSGI-style, a fixed pool of worker threads). Runs "
+        "in-process against a throwaway test database; use the production database "
+        "engine for representative numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=400,
+            help="Requests per scenario and server.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Concurrent ASGI requests in flight.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="WSGI worker threads (uWSGI 'threads').",
+        )
+        parser.add_argument(
+            "--file-size",
+            type=int,
+            default=512,
+            help="Size of the downloaded file in KiB.",
+        )
+        parser.add_argument(
+            "--json",
+            dest="json_path",
+            help="Write machine-readable results to this file.",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true", help="Keep the test database between runs."
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_environment(keepdb=options["keepdb"]):
+            scenarios = self._seed(options["file_size"])
+            asgi_app = get_asgi_application()
+            wsgi_app = get_wsgi_application()
+
+            results = []
+            for name, request in scenarios.items():
+                for server, runner in (
+                    (
+                        "asgi",
+                        lambda: asyncio.run(self._run_asgi(asgi_app, request, options)),
+                    ),
+                    ("wsgi", lambda: self._run_wsgi(wsgi_app, request, options)),
+                ):
+                    latencies, errors, elapsed = runner()
+                    result = {"scenario": name, "server": server, "errors": errors}
+                    result.update(summarize(latencies, elapsed))
+                    results.append(result)
+                    self.stdout.write(
+                        f"{name:<10} {server:<5} {result['requests_per_second']:>9.1f} req/s  "
+                        f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                        f"p99 {result['p99_ms']:>8.2f} ms  errors {errors}"
+                    )
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as fh:
+                json.dump(
+                    {
+                        "requests": options["requests"],
+                        "concurrency": options["concurrency"],
+                        "threads": options["threads"],
+                        "file_size_kib": options["file_size"],
+                        "results": results,
+                    },
+                    fh,
+                    indent=2,
+                )
+
+    def _seed(self, file_size):
+        """Create one member with a token, a protocol with an exported file and an item."""
+        user = User.objects.create_user(username="bench", password="bench")
+        token = Token.objects.create(user=user)
+        group = Group.objects.create(
+            name="Bench", address="-", postalcode="-", city="-"
+        )
+        group.group_members.add(user)
+        protocol = Protocol.objects.create(protocol_date=date.today(), group=group)
+        protocol.exported_file.save("bench.pdf", ContentFile(b"\0" * file_size * 1024))
+        item = ProtocolItem.objects.create(protocol=protocol, name="Bench", position=0)
+
+        headers = [("authorization", f"Token {token.key}"), ("host", "testserver")]
+        json_headers = headers + [("content-type", "application/json")]
+        return {
+            "download": (
+                "GET",
+                f"/api/v1/protocol/{protocol.id}/exported_file/",
+                "download=1",
+                headers,
+                b"",
+            ),
+            "item": (
+                "POST",
+                "/api/v1/item/",
+                "",
+                json_headers,
+                json.dumps(
+                    {
+                        "item_id": item.id,
+                        "protocol": protocol.id,
+                        "name": "Bench",
+                        "value": "x" * 2048,
+                        "position": 0,
+                    }
+                ).encode(),
+            ),
+            "presence": (
+                "POST",
+                "/api/v1/presence/",
+                "",
+                json_headers,
+                json.dumps(
+                    {"protocol": protocol.id, "user": user.id, "was_present": True}
+                ).encode(),
+            ),
+        }
+
+    async def _run_asgi(self, app, request, options):
+        method, path, query, headers, body = request
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        latencies, errors = [], 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                status = await self._asgi_call(app, method, path, query, headers, body)
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(options["requests"])))
+        return latencies, errors, time.perf_counter() - start
+
+    @staticmethod
+    async def _asgi_call(app, method, path, query, headers, body):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(name.encode(), value.encode()) for name, value in headers]
+            + [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0),
+            "server": ("testserver", 80),
+        }
+        body_sent = False
+        status = 500
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Keep the connection "open" until Django cancels its disconnect listener.
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await app(scope, receive, send)
+        return status
+
+    def _run_wsgi(self, app, request, options):
+        method, path, query, headers, body = request
+
+        def one(_):
+            environ = {
+                "REQUEST_METHOD": method,
+                "SCRIPT_NAME": "",
+                "PATH_INFO": path,
+                "QUERY_STRING": query,
+                "SERVER_NAME": "testserver",
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "REMOTE_ADDR": "127.0.0.1",
+                "CONTENT_LENGTH": str(len(body)),
+                "wsgi.version": (1, 0),
+                "wsgi.url_scheme": "http",
+                "wsgi.input": io.BytesIO(body),
+                "wsgi.errors": sys.stderr,
+                "wsgi.multithread": True,
+                "wsgi.multiprocess": False,
+                "wsgi.run_once": False,
+            }
+            for name, value in headers:
+                key = name.upper().replace("-", "_")
+                environ[key if key == "CONTENT_TYPE" else f"HTTP_{key}"] = value
+
+            statuses = []
+            start = time.perf_counter()
+            result = app(
+                environ,
+                lambda status, headers, exc_info=None: statuses.append(
+                    int(status.split()[0])
+                ),
+            )
+            try:
+                for _ in result:
+                    pass
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            return time.perf_counter() - start, statuses[0]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            outcomes = list(pool.map(one, range(options["requests"])))
+        elapsed = time.perf_counter() - start
+        return (
+            [latency for latency, _ in outcomes],
+            sum(1 for _, status in outcomes if status >= 400),
+            elapsed,
+        )
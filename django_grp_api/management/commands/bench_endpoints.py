@@ -0,0 +1,192 @@
+import collections
+import json
+import subprocess
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from django_grp_api.benchmark import (
+    DEFAULT_VOLUMES,
+    api_route_names,
+    benchmark_environment,
+    build_scenarios,
+    create_fixtures,
+    run_request,
+    seed_dataset,
+    summarize,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large synthetic dataset into a throwaway test database and measure "
+        "latency percentiles and query counts for every route in "
+        "django_grp_api/urls.py. Use --json to write results that can be compared "
+        "between commits with --compare."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_VOLUMES.items():
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                default=None,
+                help=f"Number of {name} to seed (default {default:,} x --scale).",
+            )
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="Scale the default volumes, e.g. 0.01 for a quick run.",
+        )
+        parser.add_argument(
+            "--iterations", type=int, default=20, help="Timed requests per route."
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=1, help="Untimed requests per route first."
+        )
+        parser.add_argument(
+            "--route",
+            action="append",
+            dest="routes",
+            help="Only benchmark these route names (repeatable).",
+        )
+        parser.add_argument(
+            "--warm-cache",
+            action="store_true",
+            help="Keep the response cache between requests instead of clearing it.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+        parser.add_argument(
+            "--json",
+            dest="json_path",
+            help="Write machine-readable results to this file.",
+        )
+        parser.add_argument(
+            "--compare",
+            dest="compare_path",
+            help="Results file of an earlier run to print deltas against.",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true", help="Keep the test database between runs."
+        )
+
+    def handle(self, *args, **options):
+        volumes = {
+            name: (
+                options[name]
+                if options[name] is not None
+                else int(default * options["scale"])
+            )
+            for name, default in DEFAULT_VOLUMES.items()
+        }
+        baseline = None
+        if options["compare_path"]:
+            with open(options["compare_path"]) as fh:
+                baseline = {
+                    (result["route"], result["method"]): result
+                    for result in json.load(fh)["results"]
+                }
+
+        with benchmark_environment(keepdb=options["keepdb"]):
+            start = time.perf_counter()
+            seed_dataset(
+                seed=options["seed"],
+                log=lambda message: self.stderr.write(message),
+                **volumes,
+            )
+            fixtures = create_fixtures()
+            self.stderr.write(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+            scenarios = build_scenarios(fixtures)
+            if options["routes"]:
+                unknown = set(options["routes"]) - set(api_route_names())
+                if unknown:
+                    raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+                scenarios = [s for s in scenarios if s["route"] in options["routes"]]
+            missing = [
+                name
+                for name in api_route_names()
+                if name not in {s["route"] for s in build_scenarios(fixtures)}
+            ]
+            for name in missing:
+                self.stderr.write(self.style.WARNING(f"No scenario for route {name}"))
+
+            results = [self._run(scenario, fixtures, options) for scenario in scenarios]
+
+        for result in results:
+            self._print(result, baseline)
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as fh:
+                json.dump(
+                    {
+                        "commit": self._commit(),
+                        "database": connection.vendor,
+                        "volumes": volumes,
+                        "iterations": options["iterations"],
+                        "warm_cache": options["warm_cache"],
+                        "missing_routes": missing,
+                        "results": results,
+                    },
+                    fh,
+                    indent=2,
+                )
+
+    def _run(self, scenario, fixtures, options):
+        result = {"route": scenario["route"], "method": scenario["method"]}
+        if scenario.get("skip"):
+            result["skipped"] = scenario["skip"]
+            return result
+
+        client = Client()
+        cache = caches["default"]
+        latencies, statuses, query_counts = [], collections.Counter(), []
+        for iteration in range(options["warmup"] + options["iterations"]):
+            if not options["warm_cache"]:
+                cache.clear()
+            elapsed, status_code, queries = run_request(client, fixtures, scenario)
+            if iteration < options["warmup"]:
+                continue
+            latencies.append(elapsed)
+            statuses[status_code] += 1
+            query_counts.append(len(queries))
+
+        result["statuses"] = {str(code): count for code, count in statuses.items()}
+        result["errors"] = sum(count for code, count in statuses.items() if code >= 400)
+        result["queries"] = max(query_counts)
+        result.update(summarize(latencies))
+        return result
+
+    def _print(self, result, baseline):
+        label = f"{result['method']:<6} {result['route']:<30}"
+        if "skipped" in result:
+            self.stdout.write(f"{label} skipped: {result['skipped']}")
+            return
+        line = (
+            f"{label} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+            f"p99 {result['p99_ms']:>9.2f} ms  queries {result['queries']:>5}  "
+            f"errors {result['errors']}"
+        )
+        previous = (baseline or {}).get((result["route"], result["method"]))
+        if previous and "p50_ms" in previous:
+            line += (
+                f"  (p50 {result['p50_ms'] - previous['p50_ms']:+.2f} ms, "
+                f"queries {result['queries'] - previous['queries']:+d})"
+            )
+        self.stdout.write(line)
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
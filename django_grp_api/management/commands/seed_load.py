@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from django_grp_api.benchmark import DEFAULT_VOLUMES, seed_dataset
+from django_grp_api.cache import invalidate_tags
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with a deterministic synthetic dataset "
+        "(groups, users, memberships, residents with pictures, protocols, items, "
+        "todos and presence) for load testing. Rows are bulk-inserted, bypassing "
+        "Model.save() and signals; existing data is left alone."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_VOLUMES.items():
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                default=None,
+                help=f"Number of {name} to create (default {default:,} x --scale).",
+            )
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="Scale the default volumes, e.g. 0.01 for a small dataset.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed; also part of the user names (load-<seed>-<n>).",
+        )
+        parser.add_argument(
+            "--password",
+            default="load",
+            help="Password of all created users (default: load).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Rows per INSERT."
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Do not ask for confirmation.",
+        )
+
+    def handle(self, *args, **options):
+        volumes = {
+            name: (
+                options[name]
+                if options[name] is not None
+                else int(default * options["scale"])
+            )
+            for name, default in DEFAULT_VOLUMES.items()
+        }
+        if any(count < 0 for count in volumes.values()):
+            raise CommandError("Volumes must not be negative.")
+        if volumes["groups"] == 0 and (volumes["residents"] or volumes["protocols"]):
+            raise CommandError("Residents and protocols need at least one group.")
+
+        prefix = f"load-{options['seed']}-"
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Users named {prefix}* already exist; pass another --seed."
+            )
+
+        summary = ", ".join(f"{count:,} {name}" for name, count in volumes.items())
+        if options["interactive"]:
+            answer = input(
+                f"This adds {summary} to the database "
+                f"'{connection.settings_dict['NAME']}'. Type 'yes' to continue: "
+            )
+            if answer != "yes":
+                raise CommandError("Seeding cancelled.")
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            created = seed_dataset(
+                seed=options["seed"],
+                batch_size=options["batch_size"],
+                password=options["password"],
+                log=lambda message: self.stderr.write(message),
+                **volumes,
+            )
+            # Signals were bypassed; drop cached responses of staff users.
+            invalidate_tags("all")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Created "
+                + ", ".join(f"{count:,} {name}" for name, count in created.items())
+                + f" in {time.perf_counter() - start:.1f}s"
+            )
+        )
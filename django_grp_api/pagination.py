@@ -0,0 +1,9 @@
+from rest_framework.pagination import PageNumberPagination
+
+
+class AdminUserPagination(PageNumberPagination):
+    """Page-number pagination of the admin user list (``?page=``, ``?page_size=``)."""
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
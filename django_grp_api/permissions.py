@@ -0,0 +1,263 @@
+"""
+Compiled per-user permissions: group id -> resource -> bitmask.
+
+Members of a group keep ``MEMBER_RIGHTS`` on it; ``UserPermission`` grants
+add rights on top, also for groups the user is not a member of, and never
+take any away (a user is restricted by removing the membership instead).
+Staff users may do everything.
+
+A user's matrix is loaded with one query, cached (see ``get_permission_matrix``)
+and dropped when one of the user's grants or memberships changes; with a
+process-local cache only for a few seconds, as other workers miss the drop.
+``GroupResourcePermission`` enforces it for views declaring a
+``permission_resource``; list querysets are narrowed with
+``PermissionMatrix.filter`` and single objects are looked up with
+``get_visible_object``, which folds the access check into the lookup query.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+from django_grp_backend.models import Group, UserPermission
+
+READ = 1
+WRITE = 2
+DELETE = 4
+ALL_RIGHTS = READ | WRITE | DELETE
+
+RIGHTS = {"read": READ, "write": WRITE, "delete": DELETE}
+RESOURCES = [resource for resource, _ in UserPermission.RESOURCE_CHOICES]
+
+# What membership alone allows: everything except deleting the group itself.
+MEMBER_RIGHTS = {
+    "group": READ | WRITE,
+    "resident": ALL_RIGHTS,
+    "protocol": ALL_RIGHTS,
+}
+
+# Cached matrices are dropped on change; the timeout only bounds staleness
+# should an invalidation be missed (e.g. raw SQL).
+MATRIX_TIMEOUT = 24 * 60 * 60
+# Without settings.SHARED_CACHE a change only drops the matrix in the worker
+# that made it, so the others may use a revoked right for this many seconds.
+LOCAL_MATRIX_TIMEOUT = 5
+
+
+def method_right(method):
+    """The right an HTTP method needs."""
+    if method in SAFE_METHODS:
+        return READ
+    if method == "DELETE":
+        return DELETE
+    return WRITE
+
+
+class PermissionMatrix:
+    """Rights of one user, as ``{group_id: {resource: bitmask}}``."""
+
+    def __init__(self, groups, is_staff=False):
+        self.groups = groups
+        self.is_staff = is_staff
+
+    def rights(self, group_id, resource):
+        if self.is_staff:
+            return ALL_RIGHTS
+        return self.groups.get(group_id, {}).get(resource, 0)
+
+    def allows(self, group_id, resource, right):
+        return bool(self.rights(group_id, resource) & right)
+
+    def group_ids(self, resource=None, right=READ):
+        """Sorted ids of groups with ``right`` on ``resource`` (any resource if None)."""
+        return sorted(
+            group_id
+            for group_id, resources in self.groups.items()
+            if any(
+                mask & right
+                for name, mask in resources.items()
+                if resource is None or name == resource
+            )
+        )
+
+    def filter(self, queryset, resource, right=READ, field="group"):
+        """Narrow ``queryset`` to objects whose ``field`` group allows ``right``."""
+        if self.is_staff:
+            return queryset
+        return queryset.filter(**{f"{field}__in": self.group_ids(resource, right)})
+
+    def check(self, group_id, resource, right):
+        """Raise PermissionDenied unless ``right`` is allowed."""
+        if not self.allows(group_id, resource, right):
+            raise PermissionDenied("Sie haben keine Berechtigung.")
+
+
+def compile_permissions(user_id):
+    """Memberships and grants of a user, compiled into ``{group_id: {resource: mask}}``."""
+    memberships = Group.group_members.through.objects.filter(
+        user_id=user_id
+    ).values_list(
+        "group_id",
+        Value("", output_field=CharField()),
+        Value("", output_field=CharField()),
+    )
+    grants = (
+        UserPermission.objects.filter(user_id=user_id)
+        .order_by()
+        .values_list("group_id", "resource", "permission")
+    )
+    groups = {}
+    for group_id, resource, permission in memberships.union(grants, all=True):
+        resources = groups.setdefault(group_id, {})
+        if not resource:
+            for name, mask in MEMBER_RIGHTS.items():
+                resources[name] = resources.get(name, 0) | mask
+        else:
+            resources[resource] = resources.get(resource, 0) | RIGHTS[permission]
+    return groups
+
+
+def _matrix_key(user_id):
+    return f"permissions:{user_id}"
+
+
+def _matrix_timeout():
+    if getattr(settings, "SHARED_CACHE", False):
+        return MATRIX_TIMEOUT
+    return LOCAL_MATRIX_TIMEOUT
+
+
+def get_permission_matrix(request):
+    """
+    The matrix of ``request.user``, memoized on the request.
+
+    Staff users need no lookup. Async views rely on ``GroupResourcePermission``
+    having loaded it before the handler runs.
+    """
+    matrix = getattr(request, "_permission_matrix", None)
+    if matrix is None:
+        user = request.user
+        if user.is_staff:
+            groups = {}
+        else:
+            groups = cache.get(_matrix_key(user.id))
+            if groups is None:
+                groups = compile_permissions(user.id)
+                cache.set(_matrix_key(user.id), groups, _matrix_timeout())
+        matrix = PermissionMatrix(groups, is_staff=user.is_staff)
+        request._permission_matrix = matrix
+    return matrix
+
+
+def permission_group_id(obj):
+    """The group an object's permissions are checked against."""
+    if isinstance(obj, Group):
+        return obj.id
+    if hasattr(obj, "group_id"):
+        return obj.group_id
+    return obj.protocol.group_id
+
+
+def visible_queryset(request, queryset, resource, field="group"):
+    """``queryset`` narrowed to objects the user holds any right on."""
+    return get_permission_matrix(request).filter(queryset, resource, ALL_RIGHTS, field)
+
+
+def get_visible_object(request, queryset, resource, field="group", **lookup):
+    """
+    The object matching ``lookup`` if the user holds any right on it, else None.
+
+    Access is part of the lookup query, so objects the user can't see look
+    exactly like missing ones (404) and their group is never loaded. The
+    right the request needs is then checked against the matrix without a
+    query.
+    """
+    try:
+        return visible_queryset(request, queryset, resource, field).get(**lookup)
+    except (queryset.model.DoesNotExist, ValueError, TypeError):
+        # Lookups like id="abc" are as missing as unknown ids.
+        return None
+
+
+async def aget_visible_object(request, queryset, resource, field="group", **lookup):
+    """Async ``get_visible_object``; the matrix must already be loaded."""
+    try:
+        return await visible_queryset(request, queryset, resource, field).aget(**lookup)
+    except (queryset.model.DoesNotExist, ValueError, TypeError):
+        return None
+
+
+class GroupResourcePermission(BasePermission):
+    """
+    Authenticated users, checked against their permission matrix.
+
+    Views set ``permission_resource`` ("group", "resident" or "protocol");
+    objects then need the right matching the request method on their group.
+    For those views the matrix is loaded here, so async handlers can use
+    ``get_permission_matrix`` without touching the database.
+    """
+
+    def has_permission(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return False
+        if getattr(view, "permission_resource", None) is not None:
+            get_permission_matrix(request)
+        return True
+
+    def has_object_permission(self, request, view, obj):
+        resource = getattr(view, "permission_resource", None)
+        if resource is None:
+            return True
+        return get_permission_matrix(request).allows(
+            permission_group_id(obj), resource, method_right(request.method)
+        )
+
+
+# ============ INVALIDATION ============
+
+
+def invalidate_permissions(*user_ids):
+    """Drop the cached matrices now and again when the transaction commits."""
+
+    def drop():
+        cache.delete_many([_matrix_key(user_id) for user_id in user_ids])
+
+    if user_ids:
+        drop()
+        transaction.on_commit(drop)
+
+
+@receiver(post_save, sender=UserPermission)
+@receiver(post_delete, sender=UserPermission)
+def invalidate_grant_change(sender, instance, **kwargs):
+    invalidate_permissions(instance.user_id)
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_group_delete(sender, instance, **kwargs):
+    # Memberships are deleted without m2m signals.
+    invalidate_permissions(*instance.group_members.values_list("id", flat=True))
+
+
+@receiver(m2m_changed, sender=Group.group_members.through)
+def invalidate_membership_permissions(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action == "pre_clear" and not reverse:
+        # group.group_members.clear(): remember the users before they're gone.
+        instance._cleared_member_ids = list(
+            instance.group_members.values_list("id", flat=True)
+        )
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        invalidate_permissions(instance.id)
+    else:
+        invalidate_permissions(
+            *(pk_set or getattr(instance, "_cleared_member_ids", []))
+        )
@@ -1,40 +1,220 @@
+import re
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
 
 from django_grp_backend.models import (
+    ArchivedProtocol,
+    ArchivedProtocolItem,
+    ArchivedProtocolPresence,
+    ArchivedProtocolTodo,
     Protocol,
     ProtocolItem,
     ProtocolTodo,
     Group,
     Resident,
     ProtocolPresence,
+    UploadSession,
     UserPermission,
 )
 
+from .cache import invalidate_group, invalidate_protocol
+from .events import publish_protocol_event
+from .permissions import (
+    DELETE,
+    READ,
+    RESOURCES,
+    RIGHTS,
+    WRITE,
+    get_permission_matrix,
+    visible_queryset,
+)
+from .uploads import expires_at, get_upload_setting
+
 
 class ProtocolItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProtocolItem
-        fields = ["id", "name", "position", "value"]
+        fields = ["id", "name", "position", "value", "version"]
+        read_only_fields = ["version"]
+
+
+class TextEditSerializer(serializers.Serializer):
+    """A single splice: replace ``delete`` characters at ``at`` with ``insert``."""
+    at = serializers.IntegerField(min_value=0)
+    delete = serializers.IntegerField(min_value=0, default=0)
+    insert = serializers.CharField(allow_blank=True, trim_whitespace=False, default="")
+
+
+class ItemPatchSerializer(serializers.Serializer):
+    """Serializer for patching an item's value against a known version."""
+    item_id = serializers.IntegerField()
+    version = serializers.IntegerField(min_value=0)
+    edits = TextEditSerializer(many=True, allow_empty=False)
+
+    def validate_edits(self, edits):
+        """Edits must be sorted by offset and must not overlap."""
+        cursor = 0
+        for edit in edits:
+            if edit["at"] < cursor:
+                raise serializers.ValidationError("Edits must be sorted and must not overlap.")
+            cursor = edit["at"] + edit["delete"]
+        return edits
 
 
 class ProtocolTodoSerializer(serializers.ModelSerializer):
     """Serializer for ProtocolTodo model."""
-    protocol = serializers.IntegerField(source='protocol.id', read_only=True)
+    protocol = serializers.IntegerField(source='protocol_id', read_only=True)
     
     class Meta:
         model = ProtocolTodo
-        fields = ["id", "protocol", "what", "who", "when", "position", "created_at", "updated_at"]
+        fields = ["id", "protocol", "what", "who", "when", "done", "position", "created_at", "updated_at"]
         read_only_fields = ["id", "created_at", "updated_at", "protocol"]
 
 
+class NestedItemSerializer(ProtocolItemSerializer):
+    """An item written inline with its protocol; ``id`` selects the item to update."""
+    id = serializers.IntegerField(required=False)
+
+
+class NestedTodoSerializer(ProtocolTodoSerializer):
+    """A todo written inline with its protocol; ``id`` selects the todo to update."""
+    id = serializers.IntegerField(required=False)
+
+
+def sync_protocol_children(protocol, model, entries, fields, required, allow_delete=True):
+    """
+    Make the ``model`` rows of ``protocol`` match ``entries``.
+    
+    Entries with an ``id`` update that row if one of ``fields`` changed,
+    entries without one are created and rows not listed are deleted - with
+    one query per kind of change instead of one per row.
+    
+    Returns ``(created, updated, deleted_ids)``.
+    """
+    existing = {obj.id: obj for obj in model.objects.filter(protocol=protocol)}
+    known_ids = list(existing)
+    auto_now = [
+        field.name for field in model._meta.concrete_fields if getattr(field, "auto_now", False)
+    ]
+    to_create = []
+    to_update = []
+    update_fields = set()
+    for entry in entries:
+        if entry.get("id") is None:
+            missing = [name for name in required if name not in entry]
+            if missing:
+                raise serializers.ValidationError(
+                    {name: "Dieses Feld ist erforderlich." for name in missing}
+                )
+            to_create.append(
+                model(protocol=protocol, **{name: entry[name] for name in fields if name in entry})
+            )
+            continue
+        obj = existing.pop(entry["id"], None)
+        if obj is None:
+            raise serializers.ValidationError(
+                {"id": f"Eintrag {entry['id']} gehört nicht zu diesem Protokoll."}
+            )
+        changed = [name for name in fields if name in entry and getattr(obj, name) != entry[name]]
+        if changed:
+            for name in changed:
+                setattr(obj, name, entry[name])
+            update_fields.update(changed)
+            # bulk_update() skips pre_save(), which sets these on save().
+            for name in auto_now:
+                setattr(obj, name, timezone.now())
+                update_fields.add(name)
+            if hasattr(obj, "version"):
+                obj.version += 1
+                update_fields.add("version")
+            to_update.append(obj)
+    
+    if existing and not allow_delete:
+        raise PermissionDenied("Sie haben keine Berechtigung.")
+    created = model.objects.bulk_create(to_create)
+    if any(obj.pk is None for obj in created):
+        # bulk_create doesn't return primary keys on every backend (MySQL).
+        created = list(
+            model.objects.filter(protocol=protocol).exclude(id__in=known_ids).order_by("id")
+        )
+    if to_update:
+        model.objects.bulk_update(to_update, sorted(update_fields))
+    if existing:
+        model.objects.filter(id__in=existing).delete()
+    return created, to_update, list(existing)
+
+
 class ProtocolSerializer(serializers.ModelSerializer):
-    items = ProtocolItemSerializer(many=True, required=False)
+    items = NestedItemSerializer(many=True, required=False)
+    # Accepted inline, but listed by the todo and bundle endpoints only.
+    todos = NestedTodoSerializer(many=True, required=False, write_only=True)
     exported_file = serializers.SerializerMethodField()
 
     class Meta:
         model = Protocol
-        fields = ["id", "protocol_date", "group", "items", "exported", "status", "exported_file"]
+        fields = ["id", "protocol_date", "group", "items", "todos", "exported", "status", "exported_file"]
+    
+    ITEM_FIELDS = ["name", "position", "value"]
+    TODO_FIELDS = ["what", "who", "when", "done", "position"]
+    
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create the protocol with its inline items and todos."""
+        items = validated_data.pop("items", None)
+        todos = validated_data.pop("todos", None)
+        protocol = super().create(validated_data)
+        self._sync_children(protocol, items, todos)
+        return protocol
+    
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """
+        Update the protocol; ``items``/``todos``, if sent, replace the current
+        ones, matched by ``id`` so unchanged rows are left alone.
+        """
+        items = validated_data.pop("items", None)
+        todos = validated_data.pop("todos", None)
+        protocol = super().update(instance, validated_data)
+        self._sync_children(protocol, items, todos)
+        return protocol
+    
+    def _sync_children(self, protocol, items, todos):
+        # Rows left out are deleted, which needs the right to delete.
+        allow_delete = get_permission_matrix(self.context["request"]).allows(
+            protocol.group_id, "protocol", DELETE
+        )
+        if items is not None:
+            changes = sync_protocol_children(
+                protocol, ProtocolItem, items, self.ITEM_FIELDS, ["name"], allow_delete
+            )
+            self._publish_changes(protocol, "item", ProtocolItemSerializer, changes)
+            # Drop items prefetched before the update from the response.
+            getattr(protocol, "_prefetched_objects_cache", {}).pop("items", None)
+        if todos is not None:
+            changes = sync_protocol_children(
+                protocol, ProtocolTodo, todos, self.TODO_FIELDS, ["what", "who", "when"], allow_delete
+            )
+            self._publish_changes(protocol, "todo", ProtocolTodoSerializer, changes)
+        if items is not None or todos is not None:
+            # Bulk queries send no signals for the response cache.
+            invalidate_protocol(protocol.id)
+            invalidate_group(protocol.group_id)
+    
+    @staticmethod
+    def _publish_changes(protocol, kind, serializer_class, changes):
+        """Notify live subscribers as the item and todo endpoints do."""
+        created, updated, deleted_ids = changes
+        for obj in created:
+            publish_protocol_event(protocol.id, f"{kind}.created", serializer_class(obj).data)
+        for obj in updated:
+            publish_protocol_event(protocol.id, f"{kind}.updated", serializer_class(obj).data)
+        for obj_id in deleted_ids:
+            publish_protocol_event(protocol.id, f"{kind}.deleted", {"id": obj_id})
     
     def to_representation(self, instance):
         """Override to handle both real and demo objects."""
@@ -58,19 +238,56 @@ class ProtocolSerializer(serializers.ModelSerializer):
         return None
 
 
+class ProtocolBundleSerializer(ProtocolSerializer):
+    """A protocol with its items, todos and presence entries in one response."""
+    todos = serializers.SerializerMethodField()
+    presence = serializers.SerializerMethodField()
+
+    class Meta(ProtocolSerializer.Meta):
+        fields = ProtocolSerializer.Meta.fields + ["presence"]
+
+    def get_todos(self, obj):
+        return ProtocolTodoSerializer(obj.todos.all(), many=True).data
+
+    def get_presence(self, obj):
+        return ProtocolPresenceSerializer(obj.protocolpresence_set.all(), many=True).data
+
+
+class ProtocolCloneSerializer(serializers.Serializer):
+    """Input of the protocol clone action."""
+    protocol_date = serializers.DateField()
+    copy_values = serializers.BooleanField(default=False)
+
+
 class ProtocolSummarySerializer(serializers.ModelSerializer):
-    """Serializer for protocol summary without items (list view)."""
+    """
+    Serializer for protocol summary without items (list view).
+
+    Expects ``Protocol.objects.with_summary()`` rows: the group is joined and
+    the counts are annotations, so no field queries per row.
+    """
+    group_name = serializers.CharField(source="group.name", read_only=True)
+    group_color = serializers.CharField(source="group.color", read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    todo_count = serializers.IntegerField(read_only=True)
+    open_todo_count = serializers.IntegerField(read_only=True)
+    archived = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Protocol
-        fields = ["id", "protocol_date", "group", "exported", "status"]
-    
-    def get_group_name(self, obj):
-        """Get group name from the related group object."""
-        try:
-            return obj.group.name if obj.group else None
-        except (AttributeError, TypeError):
-            return None
+        fields = [
+            "id",
+            "protocol_date",
+            "group",
+            "group_name",
+            "group_color",
+            "exported",
+            "status",
+            "item_count",
+            "todo_count",
+            "open_todo_count",
+            "archived",
+        ]
 
 
 class GroupSerializer(serializers.ModelSerializer):
@@ -92,7 +309,8 @@ class GroupSerializer(serializers.ModelSerializer):
     def get_members(self, obj):
         """Get residents in this group."""
         try:
-            residents = Resident.objects.filter(group=obj.id)
+            # Uses the residents prefetched by GroupViewSet.
+            residents = obj.resident_set.all()
             return ResidentSerializer(residents, many=True, context=self.context).data
         except (AttributeError, TypeError):
             # If it fails, return empty list
@@ -147,7 +365,16 @@ class ResidentSerializer(serializers.ModelSerializer):
         return None
 
 
+class VisibleProtocolField(serializers.PrimaryKeyRelatedField):
+    """Protocols the requesting user can see; others are reported as missing."""
+
+    def get_queryset(self):
+        return visible_queryset(self.context["request"], Protocol.objects.all(), "protocol")
+
+
 class ItemSerializer(serializers.ModelSerializer):
+    protocol = VisibleProtocolField()
+
     class Meta:
         model = ProtocolItem
         fields = ["id", "protocol", "name", "position", "value"]
@@ -180,7 +407,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     def get_groups(self, obj):
         """Get groups the user is member of."""
-        return [group.name for group in Group.objects.filter(group_members=obj)]
+        return [group.name for group in obj.group_set.all()]
 
 
 class UserGroupPermissionSerializer(serializers.ModelSerializer):
@@ -193,25 +420,37 @@ class UserGroupPermissionSerializer(serializers.ModelSerializer):
         fields = ["id", "name", "address", "postalcode", "city", "permissions", "resident_count"]
 
     def get_permissions(self, obj):
-        """Get user permissions for this group."""
+        """Get user permissions for this group (from the permission matrix)."""
         request = self.context.get("request")
         if not request:
             return {}
         
         user = request.user
-        is_member = obj.group_members.filter(id=user.id).exists()
-        is_staff = user.is_staff
+        if hasattr(obj, "is_member"):
+            is_member = obj.is_member
+        else:
+            is_member = obj.group_members.filter(id=user.id).exists()
+        matrix = get_permission_matrix(request)
         
         return {
             "is_member": is_member,
-            "is_staff": is_staff,
-            "can_view": is_member or is_staff,
-            "can_edit": is_member or is_staff,
-            "can_delete": is_staff,
+            "is_staff": user.is_staff,
+            "can_view": matrix.allows(obj.id, "group", READ),
+            "can_edit": matrix.allows(obj.id, "group", WRITE),
+            "can_delete": matrix.allows(obj.id, "group", DELETE),
+            "resources": {
+                resource: [
+                    name for name, right in RIGHTS.items()
+                    if matrix.allows(obj.id, resource, right)
+                ]
+                for resource in RESOURCES
+            },
         }
     
     def get_resident_count(self, obj):
         """Get number of residents in this group."""
+        if hasattr(obj, "resident_count"):
+            return obj.resident_count
         return obj.resident_set.count()
 
 
@@ -244,8 +483,16 @@ class UserDetailedProfileSerializer(serializers.ModelSerializer):
         ]
 
     def get_groups_with_permissions(self, obj):
-        """Get all accessible groups with permissions."""
-        groups = Group.objects.for_user(obj)
+        """Get all groups the user has any right on, with permissions."""
+        matrix = get_permission_matrix(self.context["request"])
+        groups = matrix.filter(Group.objects.all(), None, field="id").annotate(
+            resident_count=Count("resident", distinct=True),
+            is_member=Exists(
+                Group.group_members.through.objects.filter(
+                    group_id=OuterRef("pk"), user_id=obj.id
+                )
+            ),
+        )
         serializer = UserGroupPermissionSerializer(
             groups,
             many=True,
@@ -267,6 +514,63 @@ class ProtocolPresenceSerializer(serializers.ModelSerializer):
         return f"{obj.user.first_name} {obj.user.last_name}"
 
 
+# ============ ARCHIVE (read-only) ============
+
+class ArchivedProtocolSummarySerializer(ProtocolSummarySerializer):
+    """Archived protocol in the protocol list; expects ``with_summary()`` rows."""
+
+    class Meta(ProtocolSummarySerializer.Meta):
+        model = ArchivedProtocol
+
+
+class ArchivedProtocolItemSerializer(ProtocolItemSerializer):
+    class Meta(ProtocolItemSerializer.Meta):
+        model = ArchivedProtocolItem
+
+
+class ArchivedProtocolTodoSerializer(ProtocolTodoSerializer):
+    class Meta(ProtocolTodoSerializer.Meta):
+        model = ArchivedProtocolTodo
+
+
+class ArchivedProtocolPresenceSerializer(ProtocolPresenceSerializer):
+    class Meta(ProtocolPresenceSerializer.Meta):
+        model = ArchivedProtocolPresence
+
+
+class ArchivedProtocolSerializer(serializers.ModelSerializer):
+    """An archived protocol with its items, todos and presence entries."""
+    items = ArchivedProtocolItemSerializer(many=True, read_only=True)
+    todos = ArchivedProtocolTodoSerializer(many=True, read_only=True)
+    presence = ArchivedProtocolPresenceSerializer(many=True, read_only=True)
+    exported_file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedProtocol
+        fields = [
+            "id",
+            "protocol_date",
+            "group",
+            "items",
+            "exported",
+            "status",
+            "exported_file",
+            "todos",
+            "presence",
+            "archived",
+            "archived_at",
+        ]
+
+    def get_exported_file(self, obj):
+        """Return full URL for exported file if available."""
+        if not obj.exported_file:
+            return None
+        request = self.context.get("request")
+        if request:
+            return request.build_absolute_uri(obj.exported_file.url)
+        return obj.exported_file.url
+
+
 class GroupPDFTemplateSerializer(serializers.ModelSerializer):
     """Serializer for updating Group PDF template."""
     
@@ -276,6 +580,55 @@ class GroupPDFTemplateSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "name"]
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable upload sessions."""
+    max_chunk_size = serializers.SerializerMethodField()
+    expires_at = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "target",
+            "object_id",
+            "filename",
+            "size",
+            "checksum",
+            "offset",
+            "finalizing",
+            "max_chunk_size",
+            "expires_at",
+        ]
+        read_only_fields = ["id", "offset", "finalizing"]
+    
+    def get_max_chunk_size(self, obj):
+        return get_upload_setting("MAX_CHUNK_SIZE")
+    
+    def get_expires_at(self, obj):
+        return expires_at(obj)
+    
+    def validate_size(self, value):
+        if value < 1:
+            raise serializers.ValidationError("Die Datei ist leer.")
+        if value > get_upload_setting("MAX_SIZE"):
+            raise serializers.ValidationError(
+                f"Die Datei ist zu groß (höchstens {get_upload_setting('MAX_SIZE')} Bytes)."
+            )
+        return value
+    
+    def validate_checksum(self, value):
+        value = value.lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", value):
+            raise serializers.ValidationError("Erwartet wird die SHA-256-Prüfsumme in Hexadezimalschreibweise.")
+        return value
+    
+    def validate_filename(self, value):
+        # Exported files and templates are PDFs; the content is checked on finalize.
+        if not value.lower().endswith(".pdf"):
+            raise serializers.ValidationError("Nur PDF-Dateien sind erlaubt.")
+        return value
+
+
 class UserPermissionSerializer(serializers.ModelSerializer):
     """Serializer for user permissions on specific resources."""
     resource_display = serializers.CharField(source="get_resource_display", read_only=True)
@@ -316,12 +669,11 @@ class UserDetailSerializer(serializers.ModelSerializer):
     
     def get_groups(self, obj):
         """Get groups the user is member of."""
-        return [{"id": group.id, "name": group.name} for group in Group.objects.filter(group_members=obj)]
+        return [{"id": group.id, "name": group.name} for group in obj.group_set.all()]
     
     def get_permissions(self, obj):
         """Get all permissions for this user."""
-        perms = UserPermission.objects.filter(user=obj)
-        return UserPermissionSerializer(perms, many=True).data
+        return UserPermissionSerializer(obj.permissions.all(), many=True).data
 
 
 class UserStaffSerializer(serializers.ModelSerializer):
@@ -354,4 +706,4 @@ class UserStaffSerializer(serializers.ModelSerializer):
     
     def get_groups(self, obj):
         """Get groups the user is member of."""
-        return [group.name for group in Group.objects.filter(group_members=obj)]
+        return [group.name for group in obj.group_set.all()]
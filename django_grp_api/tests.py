@@ -0,0 +1,289 @@
+"""
+Query budgets for every API route.
+
+Each route is requested once against a small dataset and once after the rows
+it returns have grown; the number of queries must stay the same and within
+the route's budget. A failure lists the SQL that was run.
+
+The synthetic dataset itself is tested by the ``seed_load`` command tests.
+"""
+
+import io
+import tempfile
+from datetime import date
+
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from django_grp_api.benchmark import (
+    api_route_names,
+    build_scenarios,
+    create_fixtures,
+    run_request,
+    seed_dataset,
+)
+from django_grp_backend.models import (
+    Group,
+    Protocol,
+    ProtocolItem,
+    ProtocolPresence,
+    ProtocolTodo,
+    Resident,
+    UserPermission,
+)
+
+# Maximum number of queries per route (including authentication).
+QUERY_BUDGETS = {
+    "auth-login": 2,
+    "auth-logout": 2,
+    "user-profile": 2,
+    "user-me": 3,
+    "api-root": 1,
+    "protocol-list": 3,
+    "protocol-detail": 4,
+    "group-list": 4,
+    "group-detail": 4,
+    "resident-list": 3,
+    "resident-detail": 3,
+    "protocol-todo-list": 4,
+    "protocol-todo-detail": 3,
+    "resident-picture": 3,
+    "group-pdf-template": 6,
+    "upload-session-list": 5,
+    "upload-session-detail": 6,
+    "upload-session-finalize": 14,
+    "protocol-presence-list": 3,
+    "protocol-bundle": 6,
+    "protocol-clone": 13,
+    "archived-protocol-list": 3,
+    "archived-protocol-detail": 6,
+    "protocol-exported-file": 3,
+    "update-presence": 7,
+    "update-item": 5,
+    "rotate_image": 3,
+    "mention-autocomplete": 4,
+    "admin-user-list": 5,
+    "admin-user-detail": 4,
+    "admin-user-groups": 7,
+    "admin-user-group-detail": 6,
+    "admin-user-permissions": 3,
+    "admin-user-permission-detail": 4,
+    "admin-profile-list": 1,
+    "admin-profile-detail": 1,
+    "admin-metrics": 1,
+}
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    PROFILER={"DIR": tempfile.mkdtemp()},
+)
+class QueryBudgetTestCase(TestCase):
+    """Test cases asserting per-route query budgets that don't grow with data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(
+            groups=3,
+            users=4,
+            memberships=6,
+            residents=6,
+            pictures=2,
+            protocols=6,
+            items=30,
+            todos=12,
+        )
+        cls.fixtures = create_fixtures()
+
+    def _grow(self, rows=10):
+        """Add ``rows`` of everything the member and staff requests return."""
+        group = self.fixtures["group"]
+        protocol = self.fixtures["protocol"]
+        groups = Group.objects.bulk_create(
+            Group(name=f"Grown {i}", address="-", postalcode="-", city="-")
+            for i in range(rows)
+        )
+        groups = list(Group.objects.filter(name__startswith="Grown "))
+        self.fixtures["member"].group_set.add(*groups)
+        self.fixtures["staff"].group_set.add(*groups)
+        users = User.objects.bulk_create(
+            User(username=f"grown-{i}", first_name="Grown") for i in range(rows)
+        )
+        users = list(User.objects.filter(username__startswith="grown-"))
+        group.group_members.add(*users)
+        ProtocolPresence.objects.bulk_create(
+            ProtocolPresence(protocol=protocol, user=user) for user in users
+        )
+        UserPermission.objects.bulk_create(
+            UserPermission(
+                user=user, group=group, resource="protocol", permission="read"
+            )
+            for user in users
+        )
+        Resident.objects.bulk_create(
+            Resident(
+                first_name="Grown",
+                last_name=str(i),
+                moved_in_since=date(2020, 1, 1),
+                group=grown_group,
+            )
+            for i in range(rows)
+            for grown_group in (group, groups[i])
+        )
+        Protocol.objects.bulk_create(
+            Protocol(protocol_date=date(2021, 1, 1 + i % 28), group=grown_group)
+            for i in range(rows)
+            for grown_group in (group, groups[i])
+        )
+        ProtocolItem.objects.bulk_create(
+            ProtocolItem(protocol=protocol, name="Grown", position=100 + i)
+            for i in range(rows)
+        )
+        ProtocolTodo.objects.bulk_create(
+            ProtocolTodo(
+                protocol=protocol, what="Grown", who="Grown", when=timezone.now()
+            )
+            for i in range(rows)
+        )
+
+    def _measure(self, scenarios):
+        client = Client()
+        queries = {}
+        for scenario in scenarios:
+            cache.clear()
+            _, status_code, sql = run_request(client, self.fixtures, scenario)
+            self.assertLess(
+                status_code, 400, f"{scenario['route']} returned {status_code}"
+            )
+            queries[scenario["route"], scenario["method"]] = sql
+        return queries
+
+    def test_every_route_has_a_budget(self):
+        """Test every API route is exercised and has a query budget."""
+        scenarios = build_scenarios(self.fixtures)
+        self.assertEqual(
+            sorted(api_route_names()), sorted(s["route"] for s in scenarios)
+        )
+        measured = {s["route"] for s in scenarios if not s.get("skip")}
+        self.assertEqual(sorted(measured), sorted(QUERY_BUDGETS))
+
+    def test_query_counts_do_not_grow(self):
+        """Test each route stays within its budget as the returned rows grow."""
+        scenarios = [s for s in build_scenarios(self.fixtures) if not s.get("skip")]
+        small = self._measure(scenarios)
+        self._grow()
+        large = self._measure(scenarios)
+
+        for key, sql in large.items():
+            route, method = key
+            with self.subTest(route=route, method=method):
+                listing = "\n".join(f"  {i}. {query}" for i, query in enumerate(sql, 1))
+                self.assertEqual(
+                    len(sql),
+                    len(small[key]),
+                    f"{method} {route}: {len(small[key])} queries grew to {len(sql)} "
+                    f"with more rows:\n{listing}",
+                )
+                self.assertLessEqual(
+                    len(sql),
+                    QUERY_BUDGETS.get(route, 0),
+                    f"{method} {route}: {len(sql)} queries exceed the budget of "
+                    f"{QUERY_BUDGETS.get(route, 0)}:\n{listing}",
+                )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SeedLoadTestCase(TestCase):
+    """Test cases for the seed_load management command."""
+
+    def _seed(self, **options):
+        volumes = {
+            "groups": 2,
+            "users": 3,
+            "memberships": 4,
+            "residents": 5,
+            "pictures": 2,
+            "protocols": 4,
+            "items": 10,
+            "todos": 6,
+        }
+        volumes.update(options)
+        call_command(
+            "seed_load",
+            interactive=False,
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+            **volumes,
+        )
+
+    def test_volumes(self):
+        """Test the requested volumes and matching presence rows are created."""
+        existing = Group.objects.create(
+            name="Existing", address="-", postalcode="-", city="-"
+        )
+        self._seed()
+
+        self.assertEqual(Group.objects.exclude(id=existing.id).count(), 2)
+        self.assertEqual(User.objects.filter(username__startswith="load-0-").count(), 3)
+        self.assertEqual(Group.group_members.through.objects.count(), 4)
+        self.assertEqual(Resident.objects.count(), 5)
+        self.assertEqual(Resident.objects.exclude(picture="").count(), 2)
+        self.assertEqual(Protocol.objects.count(), 4)
+        self.assertEqual(ProtocolItem.objects.count(), 10)
+        self.assertEqual(ProtocolTodo.objects.count(), 6)
+        self.assertFalse(Resident.objects.filter(group=existing).exists())
+
+        for protocol in Protocol.objects.all():
+            self.assertEqual(
+                set(protocol.protocolpresence_set.values_list("user_id", flat=True)),
+                set(protocol.group.group_members.values_list("id", flat=True)),
+            )
+        for resident in Resident.objects.exclude(picture=""):
+            with default_storage.open(resident.picture.name) as f:
+                self.assertEqual(Image.open(f).format, "PNG")
+        self.assertTrue(User.objects.get(username="load-0-0").check_password("load"))
+
+    def test_without_groups(self):
+        """Test a volume too small for a single group only seeds users."""
+        counts = seed_dataset(
+            groups=0, residents=5, protocols=4, items=10, users=2, memberships=2
+        )
+
+        self.assertEqual(counts["users"], 2)
+        self.assertEqual(
+            (
+                counts["groups"],
+                counts["residents"],
+                counts["protocols"],
+                counts["items"],
+            ),
+            (0, 0, 0, 0),
+        )
+        self.assertFalse(Resident.objects.exists())
+
+    def test_deterministic(self):
+        """Test the same seed produces the same data."""
+        self._seed(pictures=0)
+        first = list(
+            ProtocolItem.objects.order_by("id").values_list("value", flat=True)
+        )
+        ProtocolItem.objects.all().delete()
+        User.objects.filter(username__startswith="load-").delete()
+        self._seed(pictures=0)
+        second = list(
+            ProtocolItem.objects.order_by("id").values_list("value", flat=True)
+        )
+        self.assertEqual(first, second)
+
+    def test_same_seed_twice_is_rejected(self):
+        """Test seeding again with an already used seed fails before inserting."""
+        self._seed()
+        with self.assertRaises(CommandError):
+            self._seed()
+        self.assertEqual(Protocol.objects.count(), 4)
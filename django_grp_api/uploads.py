@@ -0,0 +1,199 @@
+"""
+Resumable chunked uploads of exported protocol files and PDF templates.
+
+A client creates an ``UploadSession`` with the file's name, size and SHA-256,
+PUTs the content in chunks with a ``Content-Range`` header and finalizes the
+session. Each chunk is streamed to a temporary file of its own without Django
+buffering the request body, then copied into the session's file at its offset
+while the session is locked, which only takes as long as a local copy.
+Resending a chunk after a lost response is harmless, and a client that lost
+track reads the session's ``offset`` and continues from there instead of
+starting over. Finalizing verifies size and checksum and attaches the file
+like the single-request upload endpoints; the session is only locked to mark
+it as finalizing and to attach the stored file, not while the file is read
+and stored.
+
+Sessions expire ``EXPIRE_AFTER`` seconds after their last chunk; expired
+sessions and stray temporary files are swept whenever a session is created.
+"""
+
+import contextlib
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from django_grp_backend.functions import FILE_CHUNK_SIZE, validate_pdf
+from django_grp_backend.models import Group, Protocol, UploadSession
+
+UPLOAD_DEFAULTS = {
+    # Largest file accepted, in bytes.
+    "MAX_SIZE": 100 * 1024 * 1024,
+    # Largest chunk per request, in bytes; clients may send smaller ones.
+    "MAX_CHUNK_SIZE": 8 * 1024 * 1024,
+    # Seconds after the last chunk until a session is dropped.
+    "EXPIRE_AFTER": 24 * 60 * 60,
+    # Directory for partial uploads (default: a subdirectory of the system's
+    # temporary directory or FILE_UPLOAD_TEMP_DIR).
+    "TEMP_DIR": None,
+}
+
+# target -> (model, permission resource, error if missing or invisible)
+TARGETS = {
+    "exported_file": (Protocol, "protocol", "Protokoll nicht gefunden."),
+    "pdf_template": (Group, "group", "Gruppe nicht gefunden."),
+}
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def get_upload_setting(name):
+    return getattr(settings, "UPLOADS", {}).get(name, UPLOAD_DEFAULTS[name])
+
+
+def temp_dir():
+    return get_upload_setting("TEMP_DIR") or os.path.join(
+        settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), "group-protocol-uploads"
+    )
+
+
+def temp_path(session):
+    return os.path.join(temp_dir(), f"{session.id.hex}.part")
+
+
+def expires_at(session):
+    return session.updated_at + timedelta(seconds=get_upload_setting("EXPIRE_AFTER"))
+
+
+def active_sessions(user):
+    """Sessions of ``user`` that have not expired."""
+    cutoff = timezone.now() - timedelta(seconds=get_upload_setting("EXPIRE_AFTER"))
+    return UploadSession.objects.filter(user=user, updated_at__gte=cutoff)
+
+
+def start_session(session):
+    """Create the (empty) temporary file of a new session."""
+    os.makedirs(temp_dir(), exist_ok=True)
+    open(temp_path(session), "wb").close()
+
+
+def discard_session(session):
+    """Delete a session and its temporary file."""
+    path = temp_path(session)
+    session.delete()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_expired_sessions():
+    """Delete expired sessions and temporary files without a live session."""
+    expire_after = get_upload_setting("EXPIRE_AFTER")
+    UploadSession.objects.filter(
+        updated_at__lt=timezone.now() - timedelta(seconds=expire_after)
+    ).delete()
+    # Files are swept by age, which also catches those of sessions deleted
+    # with their user.
+    cutoff = time.time() - expire_after
+    try:
+        entries = list(os.scandir(temp_dir()))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name.endswith((".part", ".chunk")) and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def parse_content_range(header):
+    """
+    ``(start, end, total)`` of a ``Content-Range: bytes start-last/total``
+    header, with ``end`` exclusive and ``total`` None for ``*``; None if the
+    header is missing or malformed.
+    """
+    match = CONTENT_RANGE.fullmatch((header or "").strip())
+    if match is None:
+        return None
+    start, last, total = match.groups()
+    start, end = int(start), int(last) + 1
+    if end <= start:
+        return None
+    return start, end, None if total == "*" else int(total)
+
+
+@contextlib.contextmanager
+def receive_chunk(session, stream, length):
+    """
+    Stream up to ``length`` bytes from ``stream`` into a temporary file of
+    their own, piece by piece, so nothing is locked while the client sends
+    them. Yields the file's path and the number of bytes received; the file
+    is deleted on exit.
+    """
+    fd, path = tempfile.mkstemp(
+        dir=temp_dir(), prefix=f"{session.id.hex}-", suffix=".chunk"
+    )
+    try:
+        received = 0
+        with os.fdopen(fd, "wb") as file:
+            while received < length:
+                piece = stream.read(min(FILE_CHUNK_SIZE, length - received))
+                if not piece:
+                    break
+                file.write(piece)
+                received += len(piece)
+        yield path, received
+    finally:
+        os.remove(path)
+
+
+def append_chunk(session, chunk_path, start):
+    """Copy a received chunk into the session's file at ``start``, cutting off anything after it."""
+    with open(chunk_path, "rb") as chunk, open(temp_path(session), "r+b") as file:
+        file.seek(start)
+        shutil.copyfileobj(chunk, file, FILE_CHUNK_SIZE)
+        file.truncate()
+
+
+def file_checksum(session):
+    """SHA-256 (hex) of the session's file."""
+    digest = hashlib.sha256()
+    with open(temp_path(session), "rb") as file:
+        for piece in iter(lambda: file.read(FILE_CHUNK_SIZE), b""):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def validate_upload(session):
+    """Check the uploaded content like a single-request upload's (both targets are PDFs)."""
+    with open(temp_path(session), "rb") as file:
+        validate_pdf(File(file, name=session.filename))
+
+
+def store_upload(session, obj):
+    """Save the session's file to the storage of its target field of ``obj``; returns its name."""
+    field_file = getattr(obj, session.target)
+    with open(temp_path(session), "rb") as file:
+        field_file.save(session.filename, File(file), save=False)
+    return field_file.name
+
+
+def attach_upload(session, obj, name):
+    """Point the target field of ``obj`` at the stored file ``name`` and save it."""
+    update_fields = [session.target]
+    if session.target == "exported_file":
+        # As for the single-request upload.
+        obj.exported = True
+        obj.status = "exported"
+        update_fields += ["exported", "status"]
+    setattr(obj, session.target, name)
+    obj.save(update_fields=update_fields)
@@ -16,10 +16,13 @@ from .views import (
     GroupPDFTemplateView,
     ProtocolPresenceListView,
     ProtocolExportedFileView,
+    ProtocolEventStreamView,
     AdminUserListView,
     AdminUserDetailView,
     AdminUserGroupView,
     AdminUserPermissionView,
+    AdminMetricsView,
+    AdminProfileView,
 )
 
 
@@ -27,6 +30,8 @@ router = routers.DefaultRouter()
 router.register(r"protocol", views.ProtocolViewSet, "protocol")
 router.register(r"group", views.GroupViewSet, "group")
 router.register(r"resident", views.ResidentViewSet, "resident")
+router.register(r"archive/protocol", views.ArchivedProtocolViewSet, "archived-protocol")
+router.register(r"upload", views.UploadSessionViewSet, "upload-session")
 
 # Nested router for protocol todos
 protocol_router = nested_routers.NestedSimpleRouter(router, r"protocol", lookup="protocol")
@@ -43,6 +48,7 @@ urlpatterns = [
     path("v1/group/<int:group_id>/pdf_template/", GroupPDFTemplateView.as_view(), name="group-pdf-template"),
     path("v1/protocol/<int:protocol_id>/presence/", ProtocolPresenceListView.as_view(), name="protocol-presence-list"),
     path("v1/protocol/<int:protocol_id>/exported_file/", ProtocolExportedFileView.as_view(), name="protocol-exported-file"),
+    path("v1/protocol/<int:protocol_id>/events/", ProtocolEventStreamView.as_view(), name="protocol-events"),
     path("v1/presence/", ProtocolPresenceUpdateView.as_view(), name="update-presence"),
     path("v1/item/", ItemValuesUpdateView.as_view(), name="update-item"),
     path("v1/rotate_image/", RotateImageView.as_view(), name="rotate_image"),
@@ -54,4 +60,7 @@ urlpatterns = [
     path("v1/admin/users/<int:user_id>/groups/<int:group_id>/", AdminUserGroupView.as_view(), name="admin-user-group-detail"),
     path("v1/admin/users/<int:user_id>/permissions/", AdminUserPermissionView.as_view(), name="admin-user-permissions"),
     path("v1/admin/users/<int:user_id>/permissions/<int:permission_id>/", AdminUserPermissionView.as_view(), name="admin-user-permission-detail"),
+    path("v1/admin/profiles/", AdminProfileView.as_view(), name="admin-profile-list"),
+    path("v1/admin/profiles/<str:name>/", AdminProfileView.as_view(), name="admin-profile-detail"),
+    path("v1/admin/metrics/", AdminMetricsView.as_view(), name="admin-metrics"),
 ]
@@ -1,31 +1,85 @@
+import hmac
 import os
+from urllib.parse import unquote, urlparse
 
-from PIL import Image
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from rest_framework import viewsets, status
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils.dateparse import parse_date
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import filters, mixins, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 
 from django_grp_backend.models import (
+    ArchivedProtocol,
+    ArchivedProtocolPresence,
     Protocol,
     Group,
     Resident,
     ProtocolPresence,
     ProtocolItem,
     ProtocolTodo,
+    UploadSession,
     UserPermission,
 )
+from django_grp_backend.archive import newest_archived_date
+from django_grp_backend.functions import (
+    apply_text_edits,
+    file_response,
+    is_asgi_request,
+    open_image,
+    validate_pdf,
+)
+from django_grp_core.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    get_metrics_setting,
+    render_metrics,
+)
+from django_grp_core.profiling import list_profiles, profile_path
+from django_grp_core.timing import timed
+from .async_views import AsyncAPIView
+from .cache import CachedResponseMixin, invalidate_group, invalidate_protocol
+from .events import (
+    apublish_protocol_event,
+    format_sse,
+    get_broker,
+    get_events_setting,
+    protocol_channel,
+    publish_protocol_event,
+)
+from .pagination import AdminUserPagination
+from .permissions import (
+    DELETE,
+    READ,
+    WRITE,
+    GroupResourcePermission,
+    aget_visible_object,
+    get_permission_matrix,
+    get_visible_object,
+    permission_group_id,
+    visible_queryset,
+)
 from .serializers import (
     ProtocolSerializer,
+    ProtocolBundleSerializer,
+    ProtocolCloneSerializer,
+    ArchivedProtocolSerializer,
+    ArchivedProtocolSummarySerializer,
+    ProtocolItemSerializer,
     ProtocolSummarySerializer,
     GroupSerializer,
     ResidentSerializer,
     ItemSerializer,
+    ItemPatchSerializer,
     ProtocolTodoSerializer,
     UserProfileSerializer,
     UserDetailedProfileSerializer,
@@ -34,6 +88,22 @@ from .serializers import (
     UserStaffSerializer,
     UserDetailSerializer,
     UserPermissionSerializer,
+    UploadSessionSerializer,
+)
+from .uploads import (
+    TARGETS,
+    active_sessions,
+    append_chunk,
+    attach_upload,
+    discard_session,
+    file_checksum,
+    get_upload_setting,
+    parse_content_range,
+    receive_chunk,
+    store_upload,
+    start_session,
+    sweep_expired_sessions,
+    validate_upload,
 )
 
 
@@ -121,7 +191,7 @@ class LogoutView(APIView):
         "message": "Logged out successfully"
     }
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def post(self, request):
         # Delete the user's authentication token
@@ -139,21 +209,136 @@ class LogoutView(APIView):
         )
 
 
-class ProtocolViewSet(viewsets.ModelViewSet):
-    permission_classes = [IsAuthenticated]
+class ProtocolViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "protocol"
     
     def get_serializer_class(self):
         """Use different serializers for list vs detail."""
         if self.action == 'list':
             return ProtocolSummarySerializer
+        if self.action == 'bundle':
+            return ProtocolBundleSerializer
         return ProtocolSerializer
 
     def get_queryset(self):
-        """Filter protocols by user group membership or staff status."""
-        user = self.request.user
-        return Protocol.objects.for_user(user)
+        """Filter protocols by the user's permissions (staff see all)."""
+        queryset = get_permission_matrix(self.request).filter(Protocol.objects.all(), "protocol")
+        if self.action == 'list':
+            queryset = queryset.with_summary()
+        elif self.action == 'bundle':
+            # One query per relation, user names joined into the presence query.
+            queryset = queryset.prefetch_related(
+                "items",
+                "todos",
+                Prefetch(
+                    "protocolpresence_set",
+                    queryset=ProtocolPresence.objects.select_related("user").order_by("id"),
+                ),
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        Protocols, optionally filtered by ``date_from``/``date_to``
+        (YYYY-MM-DD, inclusive).
+        
+        Archived protocols are appended (oldest first) when ``date_from``
+        reaches back to the newest archived one.
+        """
+        return self.cached_response(self._list, request, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        date_from, date_to = _date_range(request)
+        data = list(
+            self.get_serializer(_filter_dates(self.get_queryset(), date_from, date_to), many=True).data
+        )
+        newest_archived = newest_archived_date() if date_from is not None else None
+        if newest_archived is not None and date_from <= newest_archived:
+            archived = get_permission_matrix(request).filter(
+                ArchivedProtocol.objects.with_summary(), "protocol"
+            )
+            archived = _filter_dates(archived, date_from, date_to).order_by("protocol_date", "id")
+            data += ArchivedProtocolSummarySerializer(
+                archived, many=True, context=self.get_serializer_context()
+            ).data
+        return Response(data)
+
+    def get_cache_tags(self):
+        tags = super().get_cache_tags()
+        if self.action == "retrieve":
+            # Detail responses include the items.
+            tags.append(f"protocol:{self.kwargs['pk']}")
+        return tags
+
+    @action(detail=True, methods=["get"])
+    def bundle(self, request, pk=None):
+        """
+        The protocol with its items, todos and presence entries.
+        
+        GET /api/v1/protocol/{id}/bundle/
+        
+        Replaces the detail, todo and presence requests when opening a
+        protocol; runs a fixed number of queries regardless of its size.
+        """
+        serializer = self.get_serializer(self.get_object())
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["post"])
+    def clone(self, request, pk=None):
+        """
+        Create a protocol for another date from this one.
+        
+        POST /api/v1/protocol/{id}/clone/
+        {"protocol_date": "YYYY-MM-DD", "copy_values": false}
+        
+        Copies the items (names and positions; values only with
+        ``copy_values``) and the open todos. Everything is inserted in
+        one transaction with one query per table.
+        """
+        source = self.get_object()
+        serializer = ProtocolCloneSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        copy_values = serializer.validated_data["copy_values"]
+        
+        with transaction.atomic():
+            protocol = Protocol.objects.create(
+                protocol_date=serializer.validated_data["protocol_date"],
+                group_id=source.group_id,
+            )
+            ProtocolItem.objects.bulk_create(
+                ProtocolItem(
+                    protocol=protocol,
+                    name=item.name,
+                    position=item.position,
+                    value=item.value if copy_values else "",
+                )
+                for item in source.items.all()
+            )
+            ProtocolTodo.objects.bulk_create(
+                ProtocolTodo(
+                    protocol=protocol,
+                    what=todo.what,
+                    who=todo.who,
+                    when=todo.when,
+                    position=todo.position,
+                )
+                for todo in source.todos.filter(done=False)
+            )
+            # bulk_create sends no signals; the list counts changed.
+            invalidate_group(protocol.group_id)
+        
+        # The items are read back: bulk_create doesn't set primary keys on
+        # every backend (MySQL).
+        return Response(
+            ProtocolSerializer(protocol, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
 
     def perform_create(self, serializer):
+        get_permission_matrix(self.request).check(
+            serializer.validated_data["group"].id, "protocol", WRITE
+        )
         serializer.save()
 
     def perform_update(self, serializer):
@@ -161,17 +346,89 @@ class ProtocolViewSet(viewsets.ModelViewSet):
         # Prevent updates if protocol is exported (read-only)
         if protocol.status == "exported":
             raise ValidationError("Exportierte Protokolle können nicht bearbeitet werden.")
+        # Moving it to another group needs write access there too.
+        if "group" in serializer.validated_data:
+            get_permission_matrix(self.request).check(
+                serializer.validated_data["group"].id, "protocol", WRITE
+            )
         serializer.save()
 
 
-class GroupViewSet(viewsets.ModelViewSet):
-    permission_classes = [IsAuthenticated]
+def _date_range(request):
+    """The ``date_from`` and ``date_to`` query parameters as dates (or None)."""
+    dates = []
+    for name in ("date_from", "date_to"):
+        value = request.query_params.get(name)
+        try:
+            dates.append(parse_date(value) if value else None)
+        except ValueError:
+            dates.append(None)
+        if value and dates[-1] is None:
+            raise ValidationError({name: "Ungültiges Datum, erwartet JJJJ-MM-TT."})
+    return dates
+
+
+def _filter_dates(queryset, date_from, date_to):
+    if date_from is not None:
+        queryset = queryset.filter(protocol_date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(protocol_date__lte=date_to)
+    return queryset
+
+
+class ArchivedProtocolViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only access to archived protocols.
+    
+    - GET /api/v1/archive/protocol/ - List archived protocols (summaries),
+      filtered by ``date_from``/``date_to`` like the protocol list
+    - GET /api/v1/archive/protocol/{id}/ - Archived protocol with items,
+      todos and presence entries
+    """
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "protocol"
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ArchivedProtocolSummarySerializer
+        return ArchivedProtocolSerializer
+
+    def get_queryset(self):
+        queryset = get_permission_matrix(self.request).filter(ArchivedProtocol.objects.all(), "protocol")
+        if self.action == 'list':
+            return queryset.with_summary().order_by("-protocol_date", "-id")
+        return queryset.prefetch_related(
+            "items",
+            "todos",
+            Prefetch(
+                "presence",
+                queryset=ArchivedProtocolPresence.objects.select_related("user").order_by("id"),
+            ),
+        )
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return queryset
+        date_from, date_to = _date_range(self.request)
+        return _filter_dates(queryset, date_from, date_to)
+
+
+class GroupViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "group"
     serializer_class = GroupSerializer
     
     def get_queryset(self):
-        """Filter groups by user membership or staff status."""
-        user = self.request.user
-        return Group.objects.for_user(user)
+        """Filter groups by the user's permissions (staff see all)."""
+        return get_permission_matrix(self.request).filter(
+            Group.objects.all(), "group", field="id"
+        ).prefetch_related("resident_set")
+    
+    def perform_create(self, serializer):
+        """Only staff can create groups."""
+        if not self.request.user.is_staff:
+            raise PermissionDenied("Sie haben keine Berechtigung.")
+        serializer.save()
     
     def get_serializer(self, *args, **kwargs):
         """
@@ -190,14 +447,28 @@ class GroupViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 
-class ResidentViewSet(viewsets.ModelViewSet):
-    permission_classes = [IsAuthenticated]
+class ResidentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "resident"
     serializer_class = ResidentSerializer
     
     def get_queryset(self):
-        """Filter residents by user group membership or staff status."""
-        user = self.request.user
-        return Resident.objects.for_user(user)
+        """Filter residents by the user's permissions (staff see all)."""
+        return get_permission_matrix(self.request).filter(Resident.objects.all(), "resident")
+    
+    def perform_create(self, serializer):
+        get_permission_matrix(self.request).check(
+            serializer.validated_data["group"].id, "resident", WRITE
+        )
+        serializer.save()
+    
+    def perform_update(self, serializer):
+        # Moving a resident to another group needs write access there too.
+        if "group" in serializer.validated_data:
+            get_permission_matrix(self.request).check(
+                serializer.validated_data["group"].id, "resident", WRITE
+            )
+        serializer.save()
 
 
 
@@ -214,46 +485,53 @@ class ProtocolTodoViewSet(viewsets.ModelViewSet):
     - PUT /api/v1/protocol/{protocol_id}/todo/{id}/ - Update todo
     - DELETE /api/v1/protocol/{protocol_id}/todo/{id}/ - Delete todo
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "protocol"
     serializer_class = ProtocolTodoSerializer
     
+    def get_protocol(self):
+        """The protocol from the URL, or 404 if the user can't see it."""
+        if not hasattr(self, "_protocol"):
+            self._protocol = get_visible_object(
+                self.request, Protocol.objects.all(), "protocol", id=self.kwargs.get('protocol_pk')
+            )
+        if self._protocol is None:
+            raise NotFound("Protokoll nicht gefunden.")
+        return self._protocol
+    
     def get_queryset(self):
         """Filter todos by protocol_id from URL parameter."""
-        protocol_id = self.kwargs.get('protocol_pk')
-        user = self.request.user
-        
-        # Get the protocol and check access
-        try:
-            protocol = Protocol.objects.get(id=protocol_id)
-            # Check if user has access to this protocol
-            is_member = protocol.group.group_members.filter(id=user.id).exists()
-            if not is_member and not user.is_staff:
-                return ProtocolTodo.objects.none()
-            
-            return ProtocolTodo.objects.filter(protocol_id=protocol_id)
-        except Protocol.DoesNotExist:
-            return ProtocolTodo.objects.none()
+        if self.action == "list":
+            # An unknown or invisible protocol is a 404, not an empty list.
+            protocol = self.get_protocol()
+            get_permission_matrix(self.request).check(protocol.group_id, "protocol", READ)
+        # Single todos are looked up together with their protocol's access;
+        # the object permission then checks the right the method needs.
+        return visible_queryset(
+            self.request,
+            ProtocolTodo.objects.filter(protocol_id=self.kwargs.get('protocol_pk')),
+            "protocol",
+            field="protocol__group",
+        ).select_related("protocol")
     
     def perform_create(self, serializer):
         """Create todo and automatically set protocol from URL."""
-        protocol_id = self.kwargs.get('protocol_pk')
-        
-        # Verify protocol exists
-        try:
-            protocol = Protocol.objects.get(id=protocol_id)
-        except Protocol.DoesNotExist:
-            raise ValidationError(f"Protokoll mit ID {protocol_id} nicht gefunden.")
+        protocol = self.get_protocol()
         
         # Check user access
-        is_member = protocol.group.group_members.filter(id=self.request.user.id).exists()
-        if not is_member and not self.request.user.is_staff:
-            raise ValidationError(f"Sie sind nicht Mitglied der Gruppe '{protocol.group.name}'.")
+        get_permission_matrix(self.request).check(protocol.group_id, "protocol", WRITE)
         
         # Check if protocol is exported (read-only)
         if protocol.status == "exported":
             raise ValidationError("Exportierte Protokolle können nicht bearbeitet werden.")
         
-        serializer.save(protocol_id=protocol_id)
+        serializer.save(protocol=protocol)
+        publish_protocol_event(protocol.id, "todo.created", serializer.data)
+    
+    def perform_update(self, serializer):
+        """Update todo and notify live subscribers."""
+        serializer.save()
+        publish_protocol_event(serializer.instance.protocol_id, "todo.updated", serializer.data)
     
     def perform_destroy(self, instance):
         """Delete todo with validation."""
@@ -263,45 +541,57 @@ class ProtocolTodoViewSet(viewsets.ModelViewSet):
         if protocol.status == "exported":
             raise ValidationError("Exportierte Protokolle koennen nicht bearbeitet werden.")
         
+        todo_id = instance.id
         instance.delete()
+        publish_protocol_event(protocol.id, "todo.deleted", {"id": todo_id})
 
-class ProtocolPresenceUpdateView(APIView):
-    permission_classes = [IsAuthenticated]
+class ProtocolPresenceUpdateView(AsyncAPIView):
+    permission_resource = "protocol"
     
-    def post(self, request):
+    async def post(self, request):
         protocol_id = request.data.get("protocol")
         user_id = request.data.get("user")
         was_present = request.data.get("was_present")
 
         # Check if protocol is exported
         try:
-            protocol = Protocol.objects.get(id=protocol_id)
+            protocol = await Protocol.objects.aget(id=protocol_id)
             if protocol.status == "exported":
-                return Response(
+                return JsonResponse(
                     {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
                     status=status.HTTP_403_FORBIDDEN,
                 )
             
-            # Check access: user must be staff or member of protocol's group
-            is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-            if not is_member and not request.user.is_staff:
-                return Response(
+            # Check access: user must be allowed to write the protocol
+            matrix = get_permission_matrix(request)
+            if not matrix.allows(protocol.group_id, "protocol", WRITE):
+                return JsonResponse(
                     {"error": "You do not have permission to access this protocol"},
                     status=status.HTTP_403_FORBIDDEN,
                 )
         except Protocol.DoesNotExist:
-            return Response(
+            return JsonResponse(
                 {"error": "Protocol not found"},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        obj, created = ProtocolPresence.objects.update_or_create(
+        obj, created = await ProtocolPresence.objects.aupdate_or_create(
             protocol_id=protocol_id,
             user_id=user_id,
             defaults={"was_present": was_present},
         )
+        await apublish_protocol_event(
+            protocol.id,
+            "presence.updated",
+            {
+                "id": obj.id,
+                "protocol": protocol.id,
+                "user": obj.user_id,
+                "was_present": obj.was_present,
+            },
+        )
 
-        return Response(
+        return JsonResponse(
             {
                 "message": "Presence updated" if not created else "Presence created",
                 "created": created,
@@ -310,38 +600,33 @@ class ProtocolPresenceUpdateView(APIView):
         )
 
 
-class ItemValuesUpdateView(APIView):
-    permission_classes = [IsAuthenticated]
+class ItemValuesUpdateView(AsyncAPIView):
+    permission_resource = "protocol"
     
-    def post(self, request):
-        serializer = ItemSerializer(data=request.data)
-        if serializer.is_valid():
+    async def post(self, request):
+        # Protocols the user can't see fail validation like unknown ones.
+        serializer = ItemSerializer(data=request.data, context={"request": request})
+        if await sync_to_async(serializer.is_valid)():
             item_id = request.data.get("id") or request.data.get("item_id")
-            name = serializer.data.get("name")
-            protocol_id = serializer.data.get("protocol")
-            value = serializer.data.get("value")
-            position = serializer.data.get("position")
+            name = serializer.validated_data.get("name")
+            # Already fetched (with access) by the serializer's protocol field
+            protocol = serializer.validated_data.get("protocol")
+            value = serializer.validated_data.get("value")
+            position = serializer.validated_data.get("position")
             
             # Check if protocol is exported
-            try:
-                protocol = Protocol.objects.get(id=protocol_id)
-                if protocol.status == "exported":
-                    return Response(
-                        {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
-                        status=status.HTTP_403_FORBIDDEN,
-                    )
-                
-                # Check access: user must be staff or member of protocol's group
-                is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-                if not is_member and not request.user.is_staff:
-                    return Response(
-                        {"error": "You do not have permission to access this protocol"},
-                        status=status.HTTP_403_FORBIDDEN,
-                    )
-            except Protocol.DoesNotExist:
-                return Response(
-                    {"error": "Protocol not found"},
-                    status=status.HTTP_404_NOT_FOUND,
+            if protocol.status == "exported":
+                return JsonResponse(
+                    {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            
+            # Check access: user must be allowed to write the protocol
+            matrix = get_permission_matrix(request)
+            if not matrix.allows(protocol.group_id, "protocol", WRITE):
+                return JsonResponse(
+                    {"error": "You do not have permission to access this protocol"},
+                    status=status.HTTP_403_FORBIDDEN,
                 )
             
             if item_id == "":
@@ -350,65 +635,185 @@ class ItemValuesUpdateView(APIView):
             # Fix: Separate CREATE and UPDATE logic
             # BUG: update_or_create(id=None) doesn't work - it tries to update instead of create
             if item_id:
-                # UPDATE existing item
-                ProtocolItem.objects.filter(id=item_id).update(
-                    protocol_id=protocol_id,
+                # UPDATE existing item, only if it belongs to a visible protocol
+                items = matrix.filter(
+                    ProtocolItem.objects.filter(id=item_id),
+                    "protocol",
+                    WRITE,
+                    field="protocol__group",
+                )
+                updated = await items.aupdate(
+                    protocol_id=protocol.id,
                     name=name,
                     value=value,
                     position=position,
+                    version=F("version") + 1,
                 )
+                if not updated:
+                    # Unknown, or of a protocol the user can't write.
+                    return JsonResponse(
+                        {"error": "Item not found"},
+                        status=status.HTTP_404_NOT_FOUND,
+                    )
+                item = await ProtocolItem.objects.aget(id=item_id)
+                # QuerySet.update() sends no signals for the response cache.
+                await sync_to_async(invalidate_protocol)(protocol.id)
                 message = "Item updated"
+                event_type = "item.updated"
             else:
                 # CREATE new item
-                ProtocolItem.objects.create(
-                    protocol_id=protocol_id,
+                item = await ProtocolItem.objects.acreate(
+                    protocol_id=protocol.id,
                     name=name,
                     value=value,
                     position=position,
                 )
                 message = "Item created"
+                event_type = "item.created"
             
-            return Response(
-                {"message": message},
+            await apublish_protocol_event(
+                protocol.id, event_type, ProtocolItemSerializer(item).data
+            )
+            return JsonResponse(
+                {"message": message, "id": item.id, "version": item.version},
                 status=status.HTTP_200_OK,
             )
-        return Response(
-            data="message: serializer.errors", status=status.HTTP_400_BAD_REQUEST
+        if any(error.code == "does_not_exist" for error in serializer.errors.get("protocol", [])):
+            return JsonResponse(
+                {"error": "Protocol not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return JsonResponse(
+            {"message": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    def delete(self, request):
-        try:
-            item = ProtocolItem.objects.get(id=request.data.get("item_id"))
-            
-            # Check if protocol is exported
-            if item.protocol.status == "exported":
-                return Response(
-                    {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
-                    status=status.HTTP_403_FORBIDDEN,
+    async def patch(self, request):
+        """
+        Apply text edits to an item's value instead of re-sending all of it.
+        
+        PATCH /api/v1/item/
+        {
+            "item_id": int,
+            "version": int,
+            "edits": [{"at": int, "delete": int, "insert": "string"}]
+        }
+        
+        Offsets refer to the value at ``version``. If the item has moved on
+        since, nothing is written and 409 is returned with the current
+        version and value so the client can rebase its edits.
+        """
+        serializer = ItemPatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse(
+                {"message": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        item_id = serializer.validated_data["item_id"]
+        version = serializer.validated_data["version"]
+        edits = serializer.validated_data["edits"]
+        
+        item = await aget_visible_object(
+            request,
+            ProtocolItem.objects.select_related("protocol"),
+            "protocol",
+            field="protocol__group",
+            id=item_id,
+        )
+        if item is None:
+            return JsonResponse(
+                {"message": "Item not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Check if protocol is exported
+        if item.protocol.status == "exported":
+            return JsonResponse(
+                {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        
+        # Check access: user must be allowed to write the protocol
+        matrix = get_permission_matrix(request)
+        if not matrix.allows(item.protocol.group_id, "protocol", WRITE):
+            return JsonResponse(
+                {"error": "You do not have permission to access this protocol"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        
+        if item.version == version:
+            try:
+                value = apply_text_edits(item.value or "", edits)
+            except ValueError as e:
+                return JsonResponse(
+                    {"message": {"edits": [str(e)]}}, status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            # Check access: user must be staff or member of protocol's group
-            is_member = item.protocol.group.group_members.filter(id=request.user.id).exists()
-            if not is_member and not request.user.is_staff:
-                return Response(
-                    {"error": "You do not have permission to access this protocol"},
-                    status=status.HTTP_403_FORBIDDEN,
+            # Only write if nobody else has written since we read the item.
+            updated = await ProtocolItem.objects.filter(id=item.id, version=version).aupdate(
+                value=value, version=version + 1
+            )
+            if updated:
+                await sync_to_async(invalidate_protocol)(item.protocol_id)
+                await apublish_protocol_event(
+                    item.protocol_id,
+                    "item.patched",
+                    {"id": item.id, "base_version": version, "version": version + 1, "edits": edits},
                 )
-            
-            item.delete()
-            return Response(
-                {"message": "Item deleted"},
-                status=status.HTTP_200_OK,
+                return JsonResponse(
+                    {"message": "Item patched", "id": item.id, "version": version + 1},
+                    status=status.HTTP_200_OK,
+                )
+            await item.arefresh_from_db(fields=["value", "version"])
+        
+        return JsonResponse(
+            {
+                "error": "Item was changed in the meantime",
+                "id": item.id,
+                "version": item.version,
+                "value": item.value,
+            },
+            status=status.HTTP_409_CONFLICT,
+        )
+
+    async def delete(self, request):
+        item = await aget_visible_object(
+            request,
+            ProtocolItem.objects.select_related("protocol"),
+            "protocol",
+            field="protocol__group",
+            id=request.data.get("item_id"),
+        )
+        if item is None:
+            return JsonResponse(
+                {"message": "Item not found"}, status=status.HTTP_404_NOT_FOUND
             )
-        except ProtocolItem.DoesNotExist:
-            return Response(
-                data={"message": "Item not found"}, status=status.HTTP_404_NOT_FOUND
+        
+        # Check if protocol is exported
+        if item.protocol.status == "exported":
+            return JsonResponse(
+                {"error": "Exportierte Protokolle können nicht bearbeitet werden."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        
+        # Check access: user must be allowed to delete from the protocol
+        matrix = get_permission_matrix(request)
+        if not matrix.allows(item.protocol.group_id, "protocol", DELETE):
+            return JsonResponse(
+                {"error": "You do not have permission to access this protocol"},
+                status=status.HTTP_403_FORBIDDEN,
             )
+        
+        item_id = item.id
+        await item.adelete()
+        await apublish_protocol_event(
+            item.protocol_id, "item.deleted", {"id": item_id}
+        )
+        return JsonResponse(
+            {"message": "Item deleted"},
+            status=status.HTTP_200_OK,
+        )
 
 
 class MentionAutocompleteView(APIView):
     """Get list of residents for @mention autocomplete."""
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "protocol"
     
     def get(self, request):
         protocol_id = request.query_params.get('protocol_id')
@@ -421,15 +826,14 @@ class MentionAutocompleteView(APIView):
         try:
             protocol = Protocol.objects.get(id=protocol_id)
             
-            # Check access: user must be staff or member of protocol's group
-            is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-            if not is_member and not request.user.is_staff:
+            # Check access: user must be allowed to read the protocol
+            if not get_permission_matrix(request).allows(protocol.group_id, "protocol", READ):
                 return Response(
                     {"error": "You do not have permission to access this protocol"},
                     status=status.HTTP_403_FORBIDDEN,
                 )
             
-            residents = Resident.objects.filter(group=protocol.group, moved_out_since__isnull=True)
+            residents = Resident.objects.filter(group_id=protocol.group_id, moved_out_since__isnull=True)
             
             data = [
                 {
@@ -449,8 +853,23 @@ class MentionAutocompleteView(APIView):
 
 
 class RotateImageView(APIView):
-    """Rotate resident images (left/right)."""
-    permission_classes = [IsAuthenticated]
+    """
+    Rotate resident images (left/right).
+    
+    POST /api/v1/rotate_image/
+    
+    Request:
+    {
+        "direction": "left" | "right",
+        "image_url": "/media/images/abc123.jpg"
+    }
+    
+    Access Control:
+    - Resident write permission on the group of the resident owning the
+      picture; pictures the user can't see are a 404
+    """
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "resident"
     
     def post(self, request):
         try:
@@ -463,34 +882,49 @@ class RotateImageView(APIView):
                     {"success": False, "error": "direction and image_url are required"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            if direction not in ("left", "right"):
+                return Response(
+                    {"success": False, "error": "Invalid direction"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            image_path = os.path.join(
-                settings.MEDIA_ROOT, os.path.relpath(image_url, settings.MEDIA_URL)
-            )
-            if not os.path.exists(image_path):
+            # The URL only names the picture; the file rotated is always the
+            # one stored for a resident the user can see.
+            image_path = unquote(urlparse(image_url).path)
+            resident = None
+            if image_path.startswith(settings.MEDIA_URL):
+                resident = get_visible_object(
+                    request,
+                    Resident.objects.all(),
+                    "resident",
+                    picture=image_path[len(settings.MEDIA_URL):],
+                )
+            if resident is None:
                 return Response(
                     {"success": False, "error": "Image not found"},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            if not get_permission_matrix(request).allows(resident.group_id, "resident", WRITE):
+                return Response(
+                    {"success": False, "error": "You do not have permission to edit this image"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
-            with Image.open(image_path) as img:
-                if direction == "left":
-                    img = img.rotate(90, expand=True)
-                elif direction == "right":
-                    img = img.rotate(-90, expand=True)
-                else:
-                    return Response(
-                        {"success": False, "error": "Invalid direction"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                img.save(image_path)
+            # Header checks first: an oversized image is never decoded.
+            with timed("pillow"), open_image(resident.picture.path) as img:
+                img = img.rotate(90 if direction == "left" else -90, expand=True)
+                img.save(resident.picture.path)
 
-            new_image_url = f"{settings.MEDIA_URL}{os.path.relpath(image_path, settings.MEDIA_ROOT)}"
             return Response(
-                {"success": True, "new_image_url": new_image_url},
+                {"success": True, "new_image_url": resident.picture.url},
                 status=status.HTTP_200_OK
             )
 
+        except DjangoValidationError as e:
+            return Response(
+                {"success": False, "error": e.messages[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {"success": False, "error": str(e)},
@@ -519,7 +953,7 @@ class UserProfileView(APIView):
         "groups": ["group_name1", "group_name2"]
     }
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def get(self, request):
         serializer = UserProfileSerializer(request.user, context={"request": request})
@@ -539,7 +973,7 @@ class UserProfileView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserMeView(APIView):
+class UserMeView(CachedResponseMixin, APIView):
     """
     Get detailed authenticated user profile with group permissions.
     
@@ -573,36 +1007,51 @@ class UserMeView(APIView):
             }
         ]
     }
+    
+    Group membership and resident counts are annotated in one query; the
+    payload is cached per user until the user, a membership or a resident
+    of the user's groups changes.
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def get(self, request):
         """Get detailed user profile with group permissions and resident counts."""
+        return self.cached_response(self._profile, request)
+    
+    def _profile(self, request):
         serializer = UserDetailedProfileSerializer(request.user, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class ResidentPictureView(APIView):
+class ResidentPictureView(AsyncAPIView):
     """
     Get resident picture by resident ID.
     
     GET /api/v1/resident/{id}/picture/
+    GET /api/v1/resident/{id}/picture/?download=1
     
-    Returns: Image file or 404 if not found/no picture
+    Returns: Picture URL (or the image file itself with ?download=1),
+    404 if not found/no picture
     """
-    permission_classes = [IsAuthenticated]
     
-    def get(self, request, resident_id: int):
+    permission_resource = "resident"
+    
+    async def get(self, request, resident_id: int):
         try:
-            resident = Resident.objects.for_user(request.user).get(id=resident_id)
+            resident = await get_permission_matrix(request).filter(
+                Resident.objects.all(), "resident"
+            ).aget(id=resident_id)
             
             if not resident.picture:
-                return Response(
+                return JsonResponse(
                     {"error": "Resident has no picture"},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            return Response(
+            if request.query_params.get("download"):
+                return file_response(request, resident.picture.path)
+            
+            return JsonResponse(
                 {
                     "id": resident.id,
                     "name": resident.get_full_name(),
@@ -611,12 +1060,35 @@ class ResidentPictureView(APIView):
                 status=status.HTTP_200_OK
             )
         except Resident.DoesNotExist:
-            return Response(
+            return JsonResponse(
                 {"error": "Resident not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
 
+def _pdf_template_payload(request, group):
+    """Response to a finished PDF template upload."""
+    return {
+        "success": True,
+        "message": "PDF template updated",
+        "group_id": group.id,
+        "template_url": request.build_absolute_uri(group.pdf_template.url) if group.pdf_template else None,
+    }
+
+
+def _exported_file_payload(request, protocol):
+    """Response to a finished exported file upload."""
+    return {
+        "success": True,
+        "message": "Exported file uploaded successfully",
+        "protocol_id": protocol.id,
+        "exported": protocol.exported,
+        "status": protocol.status,
+        "file_url": request.build_absolute_uri(protocol.exported_file.url),
+        "file_name": protocol.exported_file.name.split('/')[-1],
+    }
+
+
 class GroupPDFTemplateView(APIView):
     """
     Upload or update PDF template for a group.
@@ -635,24 +1107,23 @@ class GroupPDFTemplateView(APIView):
     }
     
     Access Control:
-    - User must be staff OR member of group.group_members
+    - Group write permission; groups the user can't see are a 404
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "group"
     
     def post(self, request, group_id: int):
         try:
             # Get group
-            try:
-                group = Group.objects.get(id=group_id)
-            except Group.DoesNotExist:
+            group = get_visible_object(request, Group.objects.all(), "group", field="id", id=group_id)
+            if group is None:
                 return Response(
                     {"error": "Group not found"},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Check access: user must be staff or member of group
-            is_member = group.group_members.filter(id=request.user.id).exists()
-            if not is_member and not request.user.is_staff:
+            # Check access: user must be allowed to edit the group
+            if not get_permission_matrix(request).allows(group.id, "group", WRITE):
                 return Response(
                     {"error": "You do not have permission to update this group's PDF template"},
                     status=status.HTTP_403_FORBIDDEN
@@ -667,26 +1138,25 @@ class GroupPDFTemplateView(APIView):
             
             pdf_file = request.FILES["pdf_template"]
             
-            # Validate file type
+            # Validate file type, by extension and by content
             if not pdf_file.name.lower().endswith(".pdf"):
                 return Response(
                     {"error": "Only PDF files are allowed"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            try:
+                validate_pdf(pdf_file)
+            except DjangoValidationError as e:
+                return Response(
+                    {"error": e.messages[0]},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             # Update group with new template
             group.pdf_template = pdf_file
             group.save()
             
-            return Response(
-                {
-                    "success": True,
-                    "message": "PDF template updated",
-                    "group_id": group.id,
-                    "template_url": request.build_absolute_uri(group.pdf_template.url) if group.pdf_template else None,
-                },
-                status=status.HTTP_200_OK
-            )
+            return Response(_pdf_template_payload(request, group), status=status.HTTP_200_OK)
         
         except Exception as e:
             return Response(
@@ -695,12 +1165,13 @@ class GroupPDFTemplateView(APIView):
             )
 
 
-class ProtocolExportedFileView(APIView):
+class ProtocolExportedFileView(AsyncAPIView):
     """
     Get or upload exported protocol file.
     
     GET /api/v1/protocol/{id}/exported_file/
-    - Download the exported file (if available)
+    - Get the exported file's URL (if available)
+    - With ?download=1 the file itself is streamed
     
     POST /api/v1/protocol/{id}/exported_file/
     - Upload exported file (automatically sets exported=true and status='exported')
@@ -709,35 +1180,40 @@ class ProtocolExportedFileView(APIView):
     - exported_file: File
     
     Access Control:
-    - User must be staff OR member of protocol's group.group_members
+    - Protocol read (GET) or write (POST) permission; protocols the user
+      can't see are a 404
     """
-    permission_classes = [IsAuthenticated]
     
-    def get(self, request, protocol_id: int):
+    permission_resource = "protocol"
+    
+    async def get(self, request, protocol_id: int):
         """Get exported file for a protocol."""
-        try:
-            protocol = Protocol.objects.get(id=protocol_id)
-        except Protocol.DoesNotExist:
-            return Response(
+        protocol = await aget_visible_object(
+            request, Protocol.objects.all(), "protocol", id=protocol_id
+        )
+        if protocol is None:
+            return JsonResponse(
                 {"error": "Protocol not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Check access: user must be staff or member of protocol's group
-        is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-        if not is_member and not request.user.is_staff:
-            return Response(
+        # Check access: user must be allowed to read the protocol
+        if not get_permission_matrix(request).allows(protocol.group_id, "protocol", READ):
+            return JsonResponse(
                 {"error": "You do not have permission to view this protocol's exported file"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
         if not protocol.exported_file:
-            return Response(
+            return JsonResponse(
                 {"error": "No exported file available for this protocol"},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        return Response(
+        if request.query_params.get("download"):
+            return file_response(request, protocol.exported_file.path, as_attachment=True)
+        
+        return JsonResponse(
             {
                 "id": protocol.id,
                 "protocol_date": protocol.protocol_date,
@@ -748,58 +1224,297 @@ class ProtocolExportedFileView(APIView):
             status=status.HTTP_200_OK
         )
     
-    def post(self, request, protocol_id: int):
+    async def post(self, request, protocol_id: int):
         """Upload exported file. Automatically sets exported=true and status='exported'."""
-        try:
-            protocol = Protocol.objects.get(id=protocol_id)
-        except Protocol.DoesNotExist:
-            return Response(
+        protocol = await aget_visible_object(
+            request, Protocol.objects.all(), "protocol", id=protocol_id
+        )
+        if protocol is None:
+            return JsonResponse(
                 {"error": "Protocol not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Check access: user must be staff or member of protocol's group
-        is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-        if not is_member and not request.user.is_staff:
-            return Response(
+        # Check access: user must be allowed to write the protocol
+        if not get_permission_matrix(request).allows(protocol.group_id, "protocol", WRITE):
+            return JsonResponse(
                 {"error": "You do not have permission to upload files for this protocol"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
         # Check if file is provided
         if "exported_file" not in request.FILES:
-            return Response(
+            return JsonResponse(
                 {"error": "exported_file is required"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        exported_file = request.FILES["exported_file"]
+        try:
+            # Only the first KiB is read.
+            validate_pdf(exported_file)
+        except DjangoValidationError as e:
+            return JsonResponse(
+                {"error": e.messages[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         try:
-            exported_file = request.FILES["exported_file"]
             protocol.exported_file = exported_file
             # Automatically set exported=true and status='exported' when file is uploaded
             protocol.exported = True
             protocol.status = "exported"
-            protocol.save()
+            await protocol.asave()
             
-            return Response(
-                {
-                    "success": True,
-                    "message": "Exported file uploaded successfully",
-                    "protocol_id": protocol.id,
-                    "exported": protocol.exported,
-                    "status": protocol.status,
-                    "file_url": request.build_absolute_uri(protocol.exported_file.url),
-                    "file_name": protocol.exported_file.name.split('/')[-1],
-                },
-                status=status.HTTP_200_OK
+            return JsonResponse(
+                _exported_file_payload(request, protocol), status=status.HTTP_200_OK
             )
         except Exception as e:
-            return Response(
+            return JsonResponse(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
 
+class UploadSessionViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable uploads of exported files and PDF templates for large files
+    and unreliable connections.
+    
+    - POST /api/v1/upload/ - Start an upload: ``target`` ("exported_file" or
+      "pdf_template"), ``object_id`` (protocol or group), ``filename``,
+      ``size`` and ``checksum`` (SHA-256, hex)
+    - GET /api/v1/upload/{id}/ - The session, with the ``offset`` to go on from
+    - PUT /api/v1/upload/{id}/ - The next chunk as raw request body, with
+      ``Content-Range: bytes {offset}-{last byte}/{size}``
+    - POST /api/v1/upload/{id}/finalize/ - Check size and checksum and attach
+      the file, answering like the single-request upload
+    - DELETE /api/v1/upload/{id}/ - Abort
+    
+    Access Control:
+    - Write permission on the protocol (exported_file) or group
+      (pdf_template) to start and finalize; sessions are private to their user
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [GroupResourcePermission]
+    
+    def get_queryset(self):
+        queryset = active_sessions(self.request.user)
+        if self.action == "finalize":
+            # Held only to mark the session as finalizing and to attach the file.
+            queryset = queryset.select_for_update()
+        return queryset
+    
+    def _finalizing(self):
+        return Response(
+            {"error": "Die Datei wird bereits abgeschlossen."},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    def _target(self, target, object_id):
+        """The protocol or group to upload to, if the user may write it."""
+        model, resource, missing = TARGETS[target]
+        obj = get_visible_object(
+            self.request,
+            model.objects.all(),
+            resource,
+            field="id" if model is Group else "group",
+            id=object_id,
+        )
+        if obj is None:
+            raise NotFound(missing)
+        get_permission_matrix(self.request).check(permission_group_id(obj), resource, WRITE)
+        return obj
+    
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self._target(serializer.validated_data["target"], serializer.validated_data["object_id"])
+        sweep_expired_sessions()
+        session = serializer.save(user=request.user)
+        start_session(session)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    def update(self, request, pk=None):
+        content_range = parse_content_range(request.headers.get("Content-Range"))
+        if content_range is None:
+            return Response(
+                {"error": "Content-Range fehlt oder ist ungültig, erwartet: bytes start-ende/größe."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end, total = content_range
+        if end - start > get_upload_setting("MAX_CHUNK_SIZE"):
+            return Response(
+                {"error": f"Abschnitt zu groß (höchstens {get_upload_setting('MAX_CHUNK_SIZE')} Bytes)."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if request.META.get("CONTENT_LENGTH") != str(end - start):
+            return Response(
+                {"error": "Content-Length passt nicht zu Content-Range."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        session = self.get_object()
+        if session.finalizing:
+            return self._finalizing()
+        if (total is not None and total != session.size) or end > session.size:
+            return Response(
+                {"error": "Content-Range passt nicht zur Dateigröße."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if start != session.offset:
+            # E.g. a chunk resent after its response got lost.
+            return Response(
+                {"error": "Unerwarteter Abschnitt.", "offset": session.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        # Streamed from the request without holding a lock or transaction;
+        # the body is never held in memory.
+        with receive_chunk(session, request.stream, end - start) as (chunk_path, written):
+            with transaction.atomic():
+                session = self.get_queryset().select_for_update().filter(pk=session.pk).first()
+                if session is None:
+                    raise NotFound()
+                if session.finalizing:
+                    return self._finalizing()
+                if start != session.offset:
+                    # Another request appended a chunk in the meantime.
+                    return Response(
+                        {"error": "Unerwarteter Abschnitt.", "offset": session.offset},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                append_chunk(session, chunk_path, start)
+                session.offset = start + written
+                session.save(update_fields=["offset", "updated_at"])
+        
+        if written < end - start:
+            # What arrived is kept; the client goes on from ``offset``.
+            return Response(
+                {"error": "Abschnitt unvollständig.", "offset": session.offset},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(self.get_serializer(session).data, status=status.HTTP_200_OK)
+    
+    def destroy(self, request, pk=None):
+        session = self.get_object()
+        if session.finalizing:
+            return self._finalizing()
+        discard_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        with transaction.atomic():
+            session = self.get_object()
+            if session.finalizing:
+                return self._finalizing()
+            if session.offset != session.size:
+                return Response(
+                    {"error": "Die Datei ist noch nicht vollständig hochgeladen.", "offset": session.offset},
+                    status=status.HTTP_409_CONFLICT
+                )
+            # Rights may have changed since the upload started.
+            obj = self._target(session.target, session.object_id)
+            session.finalizing = True
+            session.save(update_fields=["finalizing", "updated_at"])
+        
+        # Read and stored without a lock; chunks are refused in the meantime.
+        try:
+            if file_checksum(session) != session.checksum:
+                discard_session(session)
+                return Response(
+                    {"error": "Die Prüfsumme stimmt nicht überein, bitte erneut hochladen."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                validate_upload(session)
+            except DjangoValidationError as e:
+                discard_session(session)
+                return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+            name = store_upload(session, obj)
+            
+            with transaction.atomic():
+                model, _, missing = TARGETS[session.target]
+                # Reloaded so concurrent changes to other fields are kept.
+                obj = model.objects.select_for_update().filter(pk=obj.pk).first()
+                if obj is None:
+                    discard_session(session)
+                    raise NotFound(missing)
+                attach_upload(session, obj, name)
+                discard_session(session)
+        except Exception:
+            # Let the client retry; a no-op for discarded sessions.
+            UploadSession.objects.filter(pk=session.pk).update(finalizing=False)
+            raise
+        
+        if session.target == "exported_file":
+            return Response(_exported_file_payload(request, obj), status=status.HTTP_200_OK)
+        return Response(_pdf_template_payload(request, obj), status=status.HTTP_200_OK)
+
+
+class ProtocolEventStreamView(AsyncAPIView):
+    """
+    Stream live changes of a protocol as Server-Sent Events.
+    
+    GET /api/v1/protocol/{id}/events/
+    
+    Events (``data`` is JSON):
+    - item.created, item.updated: the item as in ``items`` of the protocol
+    - item.deleted, todo.deleted: {"id": int}
+    - presence.updated: {"id", "protocol", "user", "was_present"}
+    - todo.created, todo.updated: the todo as returned by the todo endpoint
+    
+    Idle streams receive a keep-alive comment every few seconds.
+    Requires an ASGI server; under WSGI the endpoint answers 501.
+    
+    Access Control:
+    - User must be allowed to read the protocol; protocols of other groups
+      answer 404 like missing ones
+    """
+    
+    permission_resource = "protocol"
+    
+    async def get(self, request, protocol_id: int):
+        if not is_asgi_request(request):
+            return JsonResponse(
+                {"error": "Event streams require an ASGI server"},
+                status=status.HTTP_501_NOT_IMPLEMENTED
+            )
+        
+        protocol = await aget_visible_object(
+            request, Protocol.objects.all(), "protocol", id=protocol_id
+        )
+        if protocol is None:
+            return JsonResponse(
+                {"error": "Protocol not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Check access: user must be allowed to read the protocol
+        if not get_permission_matrix(request).allows(protocol.group_id, "protocol", READ):
+            return JsonResponse(
+                {"error": "You do not have permission to access this protocol"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        return StreamingHttpResponse(
+            self._stream(protocol.id),
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    
+    async def _stream(self, protocol_id):
+        subscription = await get_broker().subscribe(protocol_channel(protocol_id))
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = await subscription.get(timeout=get_events_setting("KEEPALIVE"))
+                yield format_sse(event) if event is not None else ": keepalive\n\n"
+        finally:
+            await subscription.close()
+
+
 class ProtocolPresenceListView(APIView):
     """
     List all presence entries for a protocol.
@@ -818,31 +1533,37 @@ class ProtocolPresenceListView(APIView):
     ]
     
     Access Control:
-    - User must be staff OR member of protocol's group.group_members
+    - Protocol read permission; protocols the user can't see are a 404
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
+    permission_resource = "protocol"
     
     def get(self, request, protocol_id: int):
         try:
-            # Get protocol for authenticated users
-            try:
-                protocol = Protocol.objects.get(id=protocol_id)
-            except Protocol.DoesNotExist:
-                return Response(
-                    {"error": "Protocol not found"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            # Check access: user must be staff or member of protocol's group
-            is_member = protocol.group.group_members.filter(id=request.user.id).exists()
-            if not is_member and not request.user.is_staff:
-                return Response(
-                    {"error": "You do not have permission to view this protocol's presence entries"},
-                    status=status.HTTP_403_FORBIDDEN
+            # Get all presence entries for this protocol the user may read;
+            # the access check is part of the query.
+            presence_entries = list(
+                get_permission_matrix(request).filter(
+                    ProtocolPresence.objects.filter(protocol_id=protocol_id),
+                    "protocol",
+                    field="protocol__group",
+                ).select_related("user")
+            )
+            if not presence_entries:
+                # No entries, or no access: only then tell both apart.
+                protocol = get_visible_object(
+                    request, Protocol.objects.all(), "protocol", id=protocol_id
                 )
-            
-            # Get all presence entries for this protocol
-            presence_entries = ProtocolPresence.objects.filter(protocol=protocol)
+                if protocol is None:
+                    return Response(
+                        {"error": "Protocol not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                if not get_permission_matrix(request).allows(protocol.group_id, "protocol", READ):
+                    return Response(
+                        {"error": "You do not have permission to view this protocol's presence entries"},
+                        status=status.HTTP_403_FORBIDDEN
+                    )
             serializer = ProtocolPresenceSerializer(presence_entries, many=True)
             
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -858,29 +1579,39 @@ class AdminUserListView(APIView):
     """
     Admin: List all users in the system with their group memberships and permissions.
     
-    GET /api/v1/admin/users/
+    GET /api/v1/admin/users/?search=<text>&page=<n>&page_size=<n>
+    
+    ``search`` matches username, first name, last name and email (every
+    whitespace-separated term must match). Pages hold 50 users by default,
+    at most 200.
     
     Returns:
-    [
-        {
-            "id": int,
-            "username": "string",
-            "email": "string",
-            "first_name": "string",
-            "last_name": "string",
-            "is_staff": boolean,
-            "is_superuser": boolean,
-            "is_active": boolean,
-            "date_joined": "ISO 8601 datetime",
-            "groups": [{"id": int, "name": "string"}],
-            "permissions": [...]
-        }
-    ]
+    {
+        "count": int,
+        "next": "URL" | null,
+        "previous": "URL" | null,
+        "results": [
+            {
+                "id": int,
+                "username": "string",
+                "email": "string",
+                "first_name": "string",
+                "last_name": "string",
+                "is_staff": boolean,
+                "is_superuser": boolean,
+                "is_active": boolean,
+                "date_joined": "ISO 8601 datetime",
+                "groups": [{"id": int, "name": "string"}],
+                "permissions": [...]
+            }
+        ]
+    }
     
     Access Control:
     - Staff only (is_staff == true)
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
+    search_fields = ['username', 'first_name', 'last_name', 'email']
     
     def get(self, request):
         """List all users (staff only)."""
@@ -891,9 +1622,19 @@ class AdminUserListView(APIView):
             )
         
         try:
-            users = User.objects.all().order_by('first_name', 'last_name')
-            serializer = UserDetailSerializer(users, many=True, context={"request": request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            users = User.objects.order_by('first_name', 'last_name', 'id').prefetch_related(
+                'group_set', 'permissions'
+            )
+            users = filters.SearchFilter().filter_queryset(request, users, self)
+            paginator = AdminUserPagination()
+            page = paginator.paginate_queryset(users, request, view=self)
+            serializer = UserDetailSerializer(page, many=True, context={"request": request})
+            return paginator.get_paginated_response(serializer.data)
+        except NotFound:
+            return Response(
+                {"error": "Seite nicht gefunden."},
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)},
@@ -958,7 +1699,7 @@ class AdminUserDetailView(APIView):
     Access Control:
     - Staff only (is_staff == true)
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def _get_user_or_404(self, user_id: int):
         """Helper to get user or return 404."""
@@ -1064,7 +1805,7 @@ class AdminUserGroupView(APIView):
     Access Control:
     - Staff only (is_staff == true)
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def post(self, request, user_id: int):
         """Add user to group (staff only)."""
@@ -1165,7 +1906,7 @@ class AdminUserPermissionView(APIView):
     Access Control:
     - Staff only (is_staff == true)
     """
-    permission_classes = [IsAuthenticated]
+    permission_classes = [GroupResourcePermission]
     
     def get(self, request, user_id: int):
         """List user permissions (staff only)."""
@@ -1295,3 +2036,71 @@ class AdminUserPermissionView(APIView):
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class AdminProfileView(APIView):
+    """
+    Admin: List and download request profiles.
+    
+    GET /api/v1/admin/profiles/
+    - List stored profiles (newest first)
+    
+    GET /api/v1/admin/profiles/{name}/
+    - Download a profile (pstats file)
+    
+    Profiles are recorded for staff requests sent with the ``X-Profile``
+    header or the ``_profile`` query parameter.
+    
+    Access Control:
+    - Staff only (is_staff == true)
+    """
+    permission_classes = [GroupResourcePermission]
+    
+    def get(self, request, name: str = None):
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Sie haben keine Berechtigung."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if name is None:
+            return Response(list_profiles(), status=status.HTTP_200_OK)
+        
+        path = profile_path(name)
+        if path is None:
+            return Response(
+                {"error": "Profil nicht gefunden."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return file_response(request, path, as_attachment=True)
+
+
+class AdminMetricsView(APIView):
+    """
+    Admin: Request metrics in the Prometheus text format.
+    
+    GET /api/v1/admin/metrics/
+    - Request counts, latency, query count and Pillow time histograms per
+      route, summed over all workers
+    
+    Access Control:
+    - Staff only (is_staff == true), or
+    - ``Authorization: Bearer <METRICS_TOKEN>`` for scrapers
+    """
+    permission_classes = [AllowAny]
+    
+    def _has_scrape_token(self, request):
+        token = get_metrics_setting("TOKEN")
+        authorization = request.headers.get("Authorization", "")
+        return bool(token) and hmac.compare_digest(
+            authorization.encode(), f"Bearer {token}".encode()
+        )
+    
+    def get(self, request):
+        if not (request.user.is_staff or self._has_scrape_token(request)):
+            return Response(
+                {"error": "Sie haben keine Berechtigung."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,134 @@
+"""
+Moving exported protocols out of the live tables.
+
+``archive_protocols`` copies exported protocols dated before a cutoff, with
+their items, todos and presence entries, into the ``Archived*`` tables and
+deletes them from the live ones. It works in batches, each in its own
+transaction, so a run can be interrupted at any point without losing or
+duplicating rows. Archived rows keep their ids.
+
+Archived protocols are read-only. The protocol list includes them when its
+``date_from`` filter reaches back to ``newest_archived_date()``.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from django_grp_backend.models import (
+    ArchivedProtocol,
+    ArchivedProtocolItem,
+    ArchivedProtocolPresence,
+    ArchivedProtocolTodo,
+    Protocol,
+    ProtocolItem,
+    ProtocolPresence,
+    ProtocolTodo,
+    StoredFile,
+)
+
+ARCHIVE_DEFAULTS = {
+    # Exported protocols older than this many days are archived.
+    "AFTER_DAYS": 365,
+    # Protocols moved per transaction.
+    "BATCH_SIZE": 500,
+}
+
+# live model -> archive model, parents first
+TABLES = [
+    (Protocol, ArchivedProtocol),
+    (ProtocolItem, ArchivedProtocolItem),
+    (ProtocolTodo, ArchivedProtocolTodo),
+    (ProtocolPresence, ArchivedProtocolPresence),
+]
+
+NEWEST_DATE_KEY = "archive:newest-date"
+
+
+def get_archive_setting(name):
+    return getattr(settings, "ARCHIVE", {}).get(name, ARCHIVE_DEFAULTS[name])
+
+
+def default_cutoff():
+    return timezone.localdate() - timedelta(days=get_archive_setting("AFTER_DAYS"))
+
+
+def archivable_protocols(cutoff):
+    """Live protocols ``archive_protocols`` would move for ``cutoff``."""
+    return Protocol.objects.filter(status="exported", protocol_date__lt=cutoff)
+
+
+def newest_archived_date():
+    """
+    Date of the newest archived protocol, or None if nothing is archived.
+
+    Only cached with ``settings.SHARED_CACHE``: ``archive_protocols`` runs in
+    a process of its own, whose invalidation a process-local cache of the web
+    workers would never see. Otherwise it is one indexed query.
+    """
+    shared = getattr(settings, "SHARED_CACHE", False)
+    value = cache.get(NEWEST_DATE_KEY) if shared else None
+    if value is None:
+        newest = (
+            ArchivedProtocol.objects.order_by("-protocol_date")
+            .values_list("protocol_date", flat=True)
+            .first()
+        )
+        # "" caches an empty archive, which ``None`` can't.
+        value = newest or ""
+        if shared:
+            cache.set(NEWEST_DATE_KEY, value, None)
+    return value or None
+
+
+def _copy(model, archive_model, protocol_ids):
+    columns = [
+        field.attname
+        for field in archive_model._meta.concrete_fields
+        if field.name != "archived_at"
+    ]
+    key = "id" if model is Protocol else "protocol_id"
+    rows = model.objects.filter(**{f"{key}__in": protocol_ids}).values(*columns)
+    return len(archive_model.objects.bulk_create(archive_model(**row) for row in rows))
+
+
+def archive_protocols(cutoff=None, batch_size=None, log=None):
+    """
+    Move exported protocols dated before ``cutoff`` into the archive.
+
+    Returns the number of moved rows per table.
+    """
+    cutoff = cutoff or default_cutoff()
+    batch_size = batch_size or get_archive_setting("BATCH_SIZE")
+    moved = {archive_model._meta.model_name: 0 for _, archive_model in TABLES}
+    while True:
+        with transaction.atomic():
+            protocol_ids = list(
+                archivable_protocols(cutoff)
+                .select_for_update()
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not protocol_ids:
+                break
+            for model, archive_model in TABLES:
+                moved[archive_model._meta.model_name] += _copy(
+                    model, archive_model, protocol_ids
+                )
+            # The archived copies reference the exported files too; without
+            # this the delete below would release their last reference.
+            StoredFile.objects.acquire(
+                ArchivedProtocol.objects.filter(id__in=protocol_ids).values_list(
+                    "exported_file", flat=True
+                )
+            )
+            # Cascades to items, todos and presence; the model signals keep
+            # the response cache and file references in step.
+            Protocol.objects.filter(id__in=protocol_ids).delete()
+        cache.delete(NEWEST_DATE_KEY)
+        if log:
+            log(f"Archived {moved['archivedprotocol']} protocols")
+    return moved
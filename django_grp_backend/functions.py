@@ -1,15 +1,121 @@
+import mimetypes
 import os
+import warnings
+from contextlib import contextmanager
+
+from PIL import Image, UnidentifiedImageError
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.http import HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from functools import wraps
 from django.contrib.auth.models import Group
 
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+IMAGE_DEFAULTS = {
+    # Largest image (width x height) accepted; bigger ones are rejected
+    # before any pixel data is decoded.
+    "MAX_PIXELS": 50_000_000,
+}
+
+# Extension -> the format Pillow must detect in the file's header.
+IMAGE_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".gif": "GIF",
+}
+
+# PDF readers accept the header anywhere in the first KiB.
+PDF_HEADER = b"%PDF-"
+PDF_HEADER_WINDOW = 1024
+
+
+def get_image_setting(name):
+    return getattr(settings, "IMAGES", {}).get(name, IMAGE_DEFAULTS[name])
+
+
+@contextmanager
+def _rewound(file):
+    """Read ``file`` from the start and rewind it afterwards."""
+    file.seek(0)
+    try:
+        yield file
+    finally:
+        file.seek(0)
+
+
+@contextmanager
+def open_image(fp):
+    """
+    Open an image lazily after checking its header, as a context manager.
+
+    Only the header is parsed: the format must be one of ``IMAGE_FORMATS``
+    and width x height within ``IMAGES["MAX_PIXELS"]``, so an oversized or
+    malformed file is rejected (ValidationError) before Pillow decodes any
+    pixel data.
+    """
+    try:
+        with warnings.catch_warnings():
+            # Pillow warns about very large images; they are rejected below.
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            img = Image.open(fp, formats=sorted(set(IMAGE_FORMATS.values())))
+    except Image.DecompressionBombError:
+        raise ValidationError("Image is too large.")
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValidationError("File is not a supported image.")
+    # Closes files opened by path only, not file objects passed in.
+    with img:
+        width, height = img.size
+        if width * height > get_image_setting("MAX_PIXELS"):
+            raise ValidationError("Image is too large.")
+        yield img
+
 
 def validate_image(file):
     ext = os.path.splitext(file.name)[1].lower()
-    valid_extensions = [".jpg", ".jpeg", ".png", ".gif"]
-    if ext not in valid_extensions:
+    if ext not in IMAGE_FORMATS:
+        raise ValidationError("Unsupported file extension.")
+    with _rewound(file), open_image(file) as img:
+        if img.format != IMAGE_FORMATS[ext]:
+            raise ValidationError("File content does not match its extension.")
+
+
+def validate_pdf(file):
+    ext = os.path.splitext(file.name)[1].lower()
+    if ext != ".pdf":
         raise ValidationError("Unsupported file extension.")
+    with _rewound(file):
+        head = file.read(PDF_HEADER_WINDOW)
+    if PDF_HEADER not in head:
+        raise ValidationError("File is not a PDF document.")
+
+
+def apply_text_edits(text, edits):
+    """
+    Apply splice edits to ``text`` and return the result.
+
+    Each edit is a dict ``{"at": int, "delete": int, "insert": str}`` whose
+    offsets (in characters) refer to the original ``text``. Edits must be
+    sorted by ``at`` and must not overlap. Raises ValueError otherwise.
+    """
+    result = []
+    cursor = 0
+    for edit in edits:
+        at, delete = edit["at"], edit.get("delete", 0)
+        if at < cursor or at + delete > len(text):
+            raise ValueError(
+                "Edits must be sorted, non-overlapping and within the text."
+            )
+        result.append(text[cursor:at])
+        result.append(edit.get("insert", ""))
+        cursor = at + delete
+    result.append(text[cursor:])
+    return "".join(result)
 
 
 def group_required(group_name):
@@ -35,3 +141,51 @@ def group_required(group_name):
         return _wrapped_view
 
     return decorator
+
+
+async def aiter_file(file_path, chunk_size=FILE_CHUNK_SIZE):
+    """
+    Read a file chunk by chunk without blocking the event loop.
+
+    Each read runs in a worker thread that is not shared with the ORM
+    (``thread_sensitive=False``), so concurrent downloads don't queue up.
+    """
+    file = await sync_to_async(open, thread_sensitive=False)(file_path, "rb")
+    try:
+        while True:
+            chunk = await sync_to_async(file.read, thread_sensitive=False)(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def is_asgi_request(request):
+    """Return True if ``request`` (Django or DRF) is served by an ASGI server."""
+    return isinstance(getattr(request, "_request", request), ASGIRequest)
+
+
+def file_response(request, file_path, as_attachment=False):
+    """
+    Stream a file from disk, picking the cheapest strategy for the server.
+
+    Under WSGI this is a plain ``FileResponse`` (uWSGI can use sendfile).
+    Under ASGI the file is streamed through ``aiter_file``; a ``FileResponse``
+    would make Django read the whole file into memory first.
+    """
+    if not is_asgi_request(request):
+        return FileResponse(open(file_path, "rb"), as_attachment=as_attachment)
+
+    content_type, encoding = mimetypes.guess_type(file_path)
+    response = StreamingHttpResponse(
+        aiter_file(file_path),
+        content_type=content_type or "application/octet-stream",
+    )
+    response["Content-Length"] = str(os.path.getsize(file_path))
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Content-Disposition"] = content_disposition_header(
+        as_attachment, os.path.basename(file_path)
+    )
+    return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0019_rename_todo_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="protocolitem",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
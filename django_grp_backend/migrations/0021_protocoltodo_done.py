@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0020_protocolitem_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="protocoltodo",
+            name="done",
+            field=models.BooleanField(
+                default=False, help_text="Whether it has been done", verbose_name="Done"
+            ),
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0021_protocoltodo_done"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedProtocol",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("protocol_date", models.DateField()),
+                ("date_added", models.DateField()),
+                ("last_updated", models.DateField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("draft", "Entwurf"),
+                            ("ready", "Bereit zum Export"),
+                            ("exported", "Exportiert"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("exported", models.BooleanField(default=True)),
+                (
+                    "exported_file",
+                    models.FileField(blank=True, null=True, upload_to="exports/"),
+                ),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "group",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_grp_backend.group",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedProtocolItem",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=100)),
+                ("position", models.IntegerField(default=0)),
+                ("value", models.TextField(blank=True, null=True)),
+                ("version", models.PositiveIntegerField(default=0)),
+                (
+                    "protocol",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="items",
+                        to="django_grp_backend.archivedprotocol",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["position"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedProtocolPresence",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("was_present", models.BooleanField(default=False)),
+                (
+                    "protocol",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="presence",
+                        to="django_grp_backend.archivedprotocol",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedProtocolTodo",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("what", models.TextField()),
+                ("who", models.CharField(max_length=255)),
+                ("when", models.DateTimeField()),
+                ("done", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField()),
+                ("position", models.IntegerField(default=0)),
+                (
+                    "protocol",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="todos",
+                        to="django_grp_backend.archivedprotocol",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["position", "when"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="archivedprotocol",
+            index=models.Index(
+                fields=["group", "protocol_date"], name="django_grp__group_i_4e6876_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:31
+
+import django_grp_backend.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0022_archive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredFile",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("size", models.BigIntegerField()),
+                ("references", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="archivedprotocol",
+            name="exported_file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=django_grp_backend.storage.ContentAddressedStorage(),
+                upload_to="exports/",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="group",
+            name="pdf_template",
+            field=models.FileField(
+                blank=True,
+                storage=django_grp_backend.storage.ContentAddressedStorage(),
+                upload_to="docs/",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="protocol",
+            name="exported_file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=django_grp_backend.storage.ContentAddressedStorage(),
+                upload_to="exports/",
+            ),
+        ),
+    ]
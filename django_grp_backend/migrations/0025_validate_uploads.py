@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:10
+
+import django_grp_backend.functions
+import django_grp_backend.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0024_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="group",
+            name="pdf_template",
+            field=models.FileField(
+                blank=True,
+                storage=django_grp_backend.storage.ContentAddressedStorage(),
+                upload_to="docs/",
+                validators=[django_grp_backend.functions.validate_pdf],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="protocol",
+            name="exported_file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=django_grp_backend.storage.ContentAddressedStorage(),
+                upload_to="exports/",
+                validators=[django_grp_backend.functions.validate_pdf],
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0025_validate_uploads"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="archivedprotocol",
+            index=models.Index(
+                fields=["protocol_date"], name="django_grp__protoco_062994_idx"
+            ),
+        ),
+    ]
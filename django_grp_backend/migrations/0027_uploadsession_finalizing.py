@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_grp_backend", "0026_archivedprotocol_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="finalizing",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,15 +1,18 @@
 import os
 import random
 import uuid
+from collections import Counter
 
-from PIL import Image
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 from django.utils.deconstruct import deconstructible
 
-from django_grp_backend.functions import validate_image
+from django_grp_backend.functions import open_image, validate_image, validate_pdf
+from django_grp_backend.storage import content_storage, is_blob_name
+from django_grp_core.timing import timed
 
 
 # ============ CUSTOM QUERYSETS ============
@@ -52,6 +55,28 @@ class ProtocolQuerySet(models.QuerySet):
         from django.utils.timezone import now
         today = now().date()
         return self.filter(protocol_date__year=today.year, protocol_date__month=today.month)
+    
+    def with_summary(self):
+        """Join the group and annotate item, todo and open todo counts."""
+        return self.select_related("group").annotate(
+            item_count=_related_count(ProtocolItem),
+            todo_count=_related_count(ProtocolTodo),
+            open_todo_count=_related_count(ProtocolTodo, done=False),
+        )
+
+
+def _related_count(model, **filters):
+    """Number of ``model`` rows of the outer protocol, as a correlated subquery."""
+    # A subquery per count keeps the protocol rows from multiplying the way
+    # joining both items and todos would.
+    rows = (
+        model.objects.filter(protocol=models.OuterRef("pk"), **filters)
+        .order_by()
+        .values("protocol")
+        .annotate(count=models.Count("*"))
+        .values("count")
+    )
+    return Coalesce(models.Subquery(rows, output_field=models.IntegerField()), 0)
 
 
 # ============ CUSTOM MANAGERS ============
@@ -90,6 +115,9 @@ class ProtocolManager(models.Manager):
     
     def current_month(self):
         return self.get_queryset().current_month()
+    
+    def with_summary(self):
+        return self.get_queryset().with_summary()
 
 
 class Group(models.Model):
@@ -99,7 +127,9 @@ class Group(models.Model):
     city = models.CharField(max_length=100)
     color = models.CharField(max_length=9, default="#ffffff")
     group_members = models.ManyToManyField(User, blank=True)
-    pdf_template = models.FileField(upload_to=f"docs/", blank=True)
+    pdf_template = models.FileField(
+        upload_to=f"docs/", blank=True, storage=content_storage, validators=[validate_pdf]
+    )
     
     objects = GroupManager()
 
@@ -139,11 +169,14 @@ class Resident(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         if self.picture:
-            img = Image.open(self.picture.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.picture.path)
+            # open_image() checks format and size from the header, so only
+            # validated images are ever decoded.
+            with timed("pillow"), open_image(self.picture.path) as img:
+                if img.height > 800 or img.width > 800:
+                    output_size = (800, 800)
+                    # For JPEGs this decodes at a reduced scale (draft mode).
+                    img.thumbnail(output_size)
+                    img.save(self.picture.path)
 
     def __str__(self):
         return self.get_full_name()
@@ -162,9 +195,18 @@ class Protocol(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="draft")
     exported = models.BooleanField(default=False)
-    exported_file = models.FileField(upload_to="exports/", blank=True, null=True)
+    exported_file = models.FileField(
+        upload_to="exports/",
+        blank=True,
+        null=True,
+        storage=content_storage,
+        validators=[validate_pdf],
+    )
     
     objects = ProtocolManager()
+    
+    # See ArchivedProtocol.
+    archived = False
 
     def __str__(self):
         return f"{self.group.name} - {self.protocol_date}"
@@ -194,6 +236,8 @@ class ProtocolItem(models.Model):
     name = models.CharField(max_length=100)
     position = models.IntegerField(default=0)
     value = models.TextField(blank=True, null=True)
+    # Bumped on every write of ``value``; used for optimistic concurrency.
+    version = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ["position"]
@@ -245,6 +289,7 @@ class ProtocolTodo(models.Model):
     - what: What needs to be done
     - who: Who is responsible
     - when: When it's due
+    - done: Whether it has been done (open todos are not)
     """
     protocol = models.ForeignKey(
         Protocol,
@@ -264,6 +309,11 @@ class ProtocolTodo(models.Model):
         verbose_name="When",
         help_text="When it's due"
     )
+    done = models.BooleanField(
+        default=False,
+        verbose_name="Done",
+        help_text="Whether it has been done"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     position = models.IntegerField(default=0)
@@ -277,9 +327,271 @@ class ProtocolTodo(models.Model):
         return f"{self.protocol} - {self.what[:50]}"
 
 
+
+# ============ ARCHIVE ============
+# Exported protocols past the archive cutoff are moved here with their items,
+# todos and presence (see django_grp_backend.archive) to keep the live tables
+# and their indexes small. Rows keep their original ids and are read-only.
+
+class ArchivedProtocolQuerySet(models.QuerySet):
+    """Custom QuerySet for ArchivedProtocol model."""
+    
+    def with_summary(self):
+        """Join the group and annotate item, todo and open todo counts."""
+        return self.select_related("group").annotate(
+            item_count=_related_count(ArchivedProtocolItem),
+            todo_count=_related_count(ArchivedProtocolTodo),
+            open_todo_count=_related_count(ArchivedProtocolTodo, done=False),
+        )
+
+
+class ArchivedProtocol(models.Model):
+    # Lets serializers tell archived from live protocols.
+    archived = True
+    
+    id = models.BigIntegerField(primary_key=True)
+    protocol_date = models.DateField()
+    date_added = models.DateField()
+    last_updated = models.DateField()
+    group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Protocol.STATUS_CHOICES)
+    exported = models.BooleanField(default=True)
+    exported_file = models.FileField(
+        upload_to="exports/", blank=True, null=True, storage=content_storage
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = ArchivedProtocolQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=["group", "protocol_date"]),
+            # newest_archived_date()
+            models.Index(fields=["protocol_date"]),
+        ]
+    
+    def __str__(self):
+        return f"{self.group.name} - {self.protocol_date} (archiviert)"
+    
+    @property
+    def is_exported(self):
+        return True
+
+
+class ArchivedProtocolPresence(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    protocol = models.ForeignKey(
+        ArchivedProtocol, related_name="presence", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    was_present = models.BooleanField(default=False)
+
+
+class ArchivedProtocolItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    protocol = models.ForeignKey(
+        ArchivedProtocol, related_name="items", on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=100)
+    position = models.IntegerField(default=0)
+    value = models.TextField(blank=True, null=True)
+    version = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ["position"]
+
+
+class ArchivedProtocolTodo(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    protocol = models.ForeignKey(
+        ArchivedProtocol, related_name="todos", on_delete=models.CASCADE
+    )
+    what = models.TextField()
+    who = models.CharField(max_length=255)
+    when = models.DateTimeField()
+    done = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    position = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ["position", "when"]
+
+
+# ============ STORED FILES ============
+# Uploaded documents are stored once per content (see
+# django_grp_backend.storage); these rows count the fields referencing each
+# blob so it can be deleted with its last reference.
+
+class StoredFileQuerySet(models.QuerySet):
+    """Custom QuerySet for StoredFile model."""
+    
+    def acquire(self, names):
+        """
+        Add a reference to each of ``names`` (repeats count).
+
+        The update locks the row until the transaction ends, which keeps
+        ``_delete_blobs`` of a concurrent release from deleting the blob.
+        """
+        for name, count in Counter(filter(is_blob_name, names)).items():
+            # Insert-or-keep, then count: two queries whether the blob is new
+            # or a duplicate, and safe against concurrent uploads. size()
+            # fails if a release deleted the blob since it was saved, rather
+            # than committing a reference to a missing file.
+            self.bulk_create(
+                [StoredFile(name=name, size=content_storage.size(name))],
+                ignore_conflicts=True,
+            )
+            self.filter(name=name).update(references=models.F("references") + count)
+    
+    def release(self, names):
+        """Drop a reference to each of ``names``; unreferenced blobs are deleted on commit."""
+        # Files stored before deduplication are left alone.
+        counts = Counter(filter(is_blob_name, names))
+        if not counts:
+            return
+        for name, count in counts.items():
+            self.filter(name=name).update(references=models.F("references") - count)
+        unreferenced = list(
+            self.filter(name__in=list(counts), references__lte=0).values_list("name", flat=True)
+        )
+        if unreferenced:
+            self.filter(name__in=unreferenced).delete()
+            transaction.on_commit(lambda: _delete_blobs(unreferenced))
+
+
+def _delete_blobs(names):
+    # Skip blobs uploaded again since the transaction released them. The
+    # lock waits for transactions that acquired them but haven't committed.
+    with transaction.atomic():
+        kept = set(
+            StoredFile.objects.select_for_update()
+            .filter(name__in=names)
+            .values_list("name", flat=True)
+        )
+        for name in names:
+            if name not in kept:
+                content_storage.delete(name)
+
+
+class StoredFile(models.Model):
+    """A deduplicated upload and the number of file fields referencing it."""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = StoredFileQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+
+# Fields stored in ``content_storage`` and counted in StoredFile.
+STORED_FILE_FIELDS = {
+    Group: ["pdf_template"],
+    Protocol: ["exported_file"],
+    ArchivedProtocol: ["exported_file"],
+}
+
+
+def _file_name(value):
+    """Storage name of a file field value (FieldFile, str or None)."""
+    return getattr(value, "name", value) or ""
+
+
+def remember_stored_files(sender, instance, **kwargs):
+    # Deferred fields are missing and looked up in pre_save if needed.
+    instance._stored_files = {
+        field: _file_name(instance.__dict__[field])
+        for field in STORED_FILE_FIELDS[sender]
+        if field in instance.__dict__
+    }
+
+
+def load_stored_files(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding:
+        return
+    missing = [
+        field
+        for field in STORED_FILE_FIELDS[sender]
+        if field not in instance._stored_files
+        and (update_fields is None or field in update_fields)
+    ]
+    if missing:
+        row = sender.objects.filter(pk=instance.pk).values(*missing).first() or {}
+        instance._stored_files.update({field: row.get(field) or "" for field in missing})
+
+
+def count_stored_files(sender, instance, created, update_fields=None, **kwargs):
+    acquired, released = [], []
+    for field in STORED_FILE_FIELDS[sender]:
+        if update_fields is not None and field not in update_fields:
+            continue
+        old = "" if created else instance._stored_files.get(field, "")
+        new = _file_name(getattr(instance, field))
+        if old != new:
+            acquired.append(new)
+            released.append(old)
+        instance._stored_files[field] = new
+    StoredFile.objects.acquire(acquired)
+    StoredFile.objects.release(released)
+
+
+def release_stored_files(sender, instance, **kwargs):
+    StoredFile.objects.release(
+        _file_name(instance.__dict__.get(field)) for field in STORED_FILE_FIELDS[sender]
+    )
+
+
+# Connected per model: receivers for all senders would keep Django from
+# fast-deleting (without loading rows) every other model.
+for _model in STORED_FILE_FIELDS:
+    post_init.connect(remember_stored_files, sender=_model)
+    pre_save.connect(load_stored_files, sender=_model)
+    post_save.connect(count_stored_files, sender=_model)
+    post_delete.connect(release_stored_files, sender=_model)
+
+
+# ============ UPLOAD SESSIONS ============
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress (see django_grp_api.uploads).
+    
+    The content received so far is kept in a temporary file; ``offset`` is
+    its length. Once all ``size`` bytes are there and match ``checksum``
+    (SHA-256, hex) the file is attached to ``target`` of the protocol or
+    group ``object_id`` and the session is deleted. ``finalizing`` is set
+    while that is checked, which takes no chunks any more.
+    """
+    TARGET_CHOICES = [
+        ("exported_file", "Exportierte Datei"),
+        ("pdf_template", "PDF-Vorlage"),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    object_id = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64)
+    offset = models.BigIntegerField(default=0)
+    finalizing = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
 @receiver(post_save, sender=Protocol)
 def create_protocol_presence(sender, instance, created, **kwargs):
     if created:
-        users_in_group = instance.group.group_members.all()
-        for user in users_in_group:
-            ProtocolPresence.objects.create(protocol=instance, user=user)
+        member_ids = Group.group_members.through.objects.filter(
+            group_id=instance.group_id
+        ).values_list("user_id", flat=True)
+        ProtocolPresence.objects.bulk_create(
+            ProtocolPresence(protocol=instance, user_id=user_id) for user_id in member_ids
+        )
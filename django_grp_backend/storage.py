@@ -0,0 +1,96 @@
+"""
+Content-addressed storage for uploaded documents.
+
+``ContentAddressedStorage`` names every file after the SHA-256 of its content,
+computed while the upload is streamed to a temporary file next to its final
+place, and sharded into ``<dir>/ab/cd/<digest><ext>``. Uploading a file whose
+content is already stored replaces the blob with identical bytes, so each
+distinct blob is kept once no matter how many groups or protocols use it.
+
+Files are never deleted by the storage itself: ``StoredFile`` rows count the
+model fields referencing each blob (see ``django_grp_backend.models``) and
+the blob goes away when the last reference does.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+# Two levels of 256 directories keep directory listings short.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def _shards(digest):
+    return [digest[i * SHARD_WIDTH : (i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+
+
+def blob_name(directory, digest, ext):
+    """Storage name of the blob with ``digest`` below ``directory``."""
+    return os.path.join(directory, *_shards(digest), digest + ext.lower())
+
+
+def is_blob_name(name):
+    """
+    Whether ``name`` was stored by ``ContentAddressedStorage``.
+
+    Files uploaded before it have other names and are never reference counted.
+    """
+    parts = (name or "").split("/")
+    digest = os.path.splitext(parts[-1])[0]
+    return (
+        len(parts) > SHARD_DEPTH
+        and DIGEST.fullmatch(digest) is not None
+        and parts[-1 - SHARD_DEPTH : -1] == _shards(digest)
+    )
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that stores each distinct content once."""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content and an existing file with it
+        # is the same blob, so there is nothing to make unique.
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1]
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        # Same directory as the target so the final rename stays on one file system.
+        fd, tmp_path = tempfile.mkstemp(dir=full_directory, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                if hasattr(content, "seek"):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            name = blob_name(directory, digest.hexdigest(), ext)
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            # Replaced even if it exists, which re-creates a blob deleted by
+            # a concurrent release in the meantime. Atomic; a concurrent
+            # upload of the same content writes the same bytes.
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name.replace("\\", "/")
+
+
+content_storage = ContentAddressedStorage()
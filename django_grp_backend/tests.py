@@ -1,8 +1,39 @@
-from django.test import TestCase, Client
+import contextlib
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, Client, AsyncClient, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from django_grp_backend.models import Group, Resident, Protocol, ProtocolItem, ProtocolPresence
+from django_grp_api.events import InProcessBroker
+from django_grp_api.uploads import file_checksum, get_upload_setting, receive_chunk
+from django_grp_api.permissions import (
+    DELETE, LOCAL_MATRIX_TIMEOUT, MATRIX_TIMEOUT, READ, WRITE, compile_permissions
+)
+from django_grp_backend.archive import archive_protocols, newest_archived_date
+from django_grp_backend.functions import apply_text_edits, validate_image, validate_pdf
+from django_grp_backend.models import (
+    ArchivedProtocol, Group, Resident, Protocol, ProtocolItem, ProtocolPresence, ProtocolTodo,
+    StoredFile, UploadSession, UserPermission
+)
+from django_grp_backend.storage import content_storage
 from datetime import date
 
 
@@ -374,3 +405,1493 @@ class PermissionTestCase(APITestCase):
         self.assertEqual(self.group1.name, 'New Group Name')
         self.assertEqual(self.group1.city, 'New City')
         self.assertEqual(self.group1.postalcode, original_postalcode)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncViewTestCase(APITestCase):
+    """Test cases for the async (ASGI-native) download and write endpoints."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.protocol.exported_file.save('export.pdf', ContentFile(b'%PDF-1.7 export'))
+        self.item = ProtocolItem.objects.create(protocol=self.protocol, name='Item', position=1)
+    
+    def _auth_headers(self, token):
+        return {'Authorization': f'Token {token.key}'}
+    
+    async def _consume(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+    
+    def test_exported_file_download_wsgi(self):
+        """Test ?download=1 streams the exported file under WSGI."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/exported_file/?download=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.7 export')
+    
+    async def test_exported_file_download_asgi(self):
+        """Test ?download=1 streams the exported file asynchronously under ASGI."""
+        response = await AsyncClient().get(
+            f'/api/v1/protocol/{self.protocol.id}/exported_file/?download=1',
+            headers=self._auth_headers(self.token),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Length'], '15')
+        self.assertEqual(await self._consume(response), b'%PDF-1.7 export')
+    
+    async def test_exported_file_hidden_from_non_member(self):
+        """Test another group's exported file looks missing to non-members."""
+        token = await Token.objects.acreate(user=self.outsider)
+        response = await AsyncClient().get(
+            f'/api/v1/protocol/{self.protocol.id}/exported_file/',
+            headers=self._auth_headers(token),
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    async def test_item_update_asgi(self):
+        """Test the item write endpoint under ASGI with a JSON body."""
+        response = await AsyncClient().post('/api/v1/item/', {
+            'item_id': self.item.id,
+            'protocol': self.protocol.id,
+            'name': 'Renamed',
+            'value': 'Value',
+            'position': 2,
+        }, content_type='application/json', headers=self._auth_headers(self.token))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        item = await ProtocolItem.objects.aget(id=self.item.id)
+        self.assertEqual(item.name, 'Renamed')
+    
+    async def test_presence_update_asgi_requires_token(self):
+        """Test the presence endpoint rejects requests without credentials."""
+        response = await AsyncClient().post('/api/v1/presence/', {
+            'protocol': self.protocol.id,
+            'user': self.user.id,
+            'was_present': True,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ProtocolEventStreamTestCase(APITestCase):
+    """Test cases for live protocol events over Server-Sent Events."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+    
+    async def test_in_process_broker_fan_out(self):
+        """Test the in-process broker delivers to every subscriber of a channel."""
+        broker = InProcessBroker()
+        first = await broker.subscribe('protocol:1')
+        second = await broker.subscribe('protocol:1')
+        other = await broker.subscribe('protocol:2')
+        broker.publish('protocol:1', {'type': 'item.updated', 'data': {'id': 1}})
+        self.assertEqual((await first.get(timeout=1))['data'], {'id': 1})
+        self.assertEqual((await second.get(timeout=1))['data'], {'id': 1})
+        self.assertIsNone(await other.get(timeout=0.01))
+        for subscription in (first, second, other):
+            await subscription.close()
+        self.assertEqual(dict(broker._subscribers), {})
+    
+    async def test_item_write_is_streamed(self):
+        """Test an item write reaches an open event stream."""
+        response = await AsyncClient().get(
+            f'/api/v1/protocol/{self.protocol.id}/events/', headers=self.headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        # The first chunk is sent once the stream is subscribed.
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        
+        await AsyncClient().post('/api/v1/item/', {
+            'protocol': self.protocol.id,
+            'name': 'Agenda',
+            'value': 'Text',
+            'position': 1,
+        }, content_type='application/json', headers=self.headers)
+        
+        message = (await anext(stream)).decode()
+        self.assertTrue(message.startswith('event: item.created\n'))
+        self.assertIn('"name": "Agenda"', message)
+        await stream.aclose()
+    
+    async def test_stream_hidden_from_non_member(self):
+        """Test another group's protocol can't be subscribed to and looks like a missing one."""
+        token = await Token.objects.acreate(user=self.outsider)
+        headers = {'Authorization': f'Token {token.key}'}
+        response = await AsyncClient().get(
+            f'/api/v1/protocol/{self.protocol.id}/events/', headers=headers
+        )
+        missing = await AsyncClient().get(
+            f'/api/v1/protocol/{self.protocol.id + 1}/events/', headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), missing.json())
+    
+    def test_stream_requires_asgi(self):
+        """Test the stream endpoint refuses to run under WSGI."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/events/')
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+    
+    def test_todo_write_publishes_after_commit(self):
+        """Test todo writes publish an event once the transaction commits."""
+        self.client.force_authenticate(user=self.user)
+        with mock.patch.object(InProcessBroker, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/v1/protocol/{self.protocol.id}/todo/', {
+                    'what': 'Call plumber',
+                    'who': 'Anna',
+                    'when': '2024-01-05T10:00:00Z',
+                })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        channel, event = publish.call_args.args
+        self.assertEqual(channel, f'protocol:{self.protocol.id}')
+        self.assertEqual(event['type'], 'todo.created')
+        self.assertEqual(event['data']['what'], 'Call plumber')
+
+
+class ItemPatchTestCase(APITestCase):
+    """Test cases for patch-based item value updates."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.item = ProtocolItem.objects.create(
+            protocol=self.protocol, name='Minutes', position=1, value='Hello world'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def _patch(self, version, edits):
+        return self.client.patch('/api/v1/item/', {
+            'item_id': self.item.id,
+            'version': version,
+            'edits': edits,
+        }, format='json')
+    
+    def test_apply_text_edits(self):
+        """Test edits are applied against the original offsets."""
+        self.assertEqual(
+            apply_text_edits('Hello world', [
+                {'at': 0, 'delete': 5, 'insert': 'Goodbye'},
+                {'at': 11, 'delete': 0, 'insert': '!'},
+            ]),
+            'Goodbye world!',
+        )
+        with self.assertRaises(ValueError):
+            apply_text_edits('Hello', [{'at': 3, 'delete': 5, 'insert': ''}])
+    
+    def test_patch_applies_edits_and_bumps_version(self):
+        """Test a patch against the current version is applied."""
+        response = self._patch(0, [{'at': 5, 'delete': 6, 'insert': ', team'}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['version'], 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.value, 'Hello, team')
+        self.assertEqual(self.item.version, 1)
+    
+    def test_patch_with_stale_version_is_rejected(self):
+        """Test a patch against an outdated version does not overwrite."""
+        self.assertEqual(self._patch(0, [{'at': 0, 'insert': 'A '}]).status_code, status.HTTP_200_OK)
+        response = self._patch(0, [{'at': 0, 'insert': 'B '}])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['version'], 1)
+        self.assertEqual(response.json()['value'], 'A Hello world')
+    
+    def test_patch_with_overlapping_edits_is_rejected(self):
+        """Test overlapping or out-of-range edits return 400."""
+        response = self._patch(0, [
+            {'at': 4, 'delete': 3, 'insert': ''},
+            {'at': 5, 'delete': 1, 'insert': ''},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._patch(0, [{'at': 50, 'delete': 1, 'insert': ''}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_full_update_bumps_version(self):
+        """Test posting the whole value also advances the version."""
+        response = self.client.post('/api/v1/item/', {
+            'item_id': self.item.id,
+            'protocol': self.protocol.id,
+            'name': 'Minutes',
+            'value': 'Rewritten',
+            'position': 1,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['version'], 1)
+        self.assertEqual(self._patch(0, [{'at': 0, 'insert': 'x'}]).status_code, status.HTTP_409_CONFLICT)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    RESPONSE_CACHE={"ENABLED": True},
+)
+class ResponseCacheTestCase(APITestCase):
+    """Test cases for the per-user response cache and its invalidation."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.other_group = Group.objects.create(
+            name='Other', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.resident = Resident.objects.create(
+            first_name='Max', last_name='Mustermann', moved_in_since=date(2020, 1, 1),
+            group=self.group
+        )
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.item = ProtocolItem.objects.create(
+            protocol=self.protocol, name='Minutes', position=1, value='Hello'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_list_is_served_from_cache(self):
+        """Test repeated list requests run no queries."""
+        first = self.client.get('/api/v1/group/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/v1/group/')
+        self.assertEqual(first.json(), second.json())
+    
+    def test_disabled_without_shared_cache(self):
+        """Test responses are not cached unless the cache is enabled."""
+        with self.settings(RESPONSE_CACHE={}):
+            self.client.get('/api/v1/group/')
+            with self.assertNumQueries(2):
+                self.client.get('/api/v1/group/')
+    
+    def test_resident_change_invalidates_group_and_resident_lists(self):
+        """Test saving a resident invalidates the responses of its group."""
+        self.client.get('/api/v1/group/')
+        self.client.get(f'/api/v1/resident/{self.resident.id}/')
+        self.resident.first_name = 'Moritz'
+        self.resident.save()
+        
+        group = self.client.get('/api/v1/group/').json()[0]
+        self.assertEqual(group['members'][0]['first_name'], 'Moritz')
+        response = self.client.get(f'/api/v1/resident/{self.resident.id}/')
+        self.assertEqual(response.json()['first_name'], 'Moritz')
+    
+    def test_resident_moved_to_other_group(self):
+        """Test moving a resident invalidates the group it left."""
+        self.other_group.group_members.add(self.user)
+        self.client.get(f'/api/v1/group/{self.group.id}/')
+        self.resident.group = self.other_group
+        self.resident.save()
+        
+        response = self.client.get(f'/api/v1/group/{self.group.id}/')
+        self.assertEqual(response.json()['members'], [])
+    
+    def test_item_update_invalidates_protocol_detail(self):
+        """Test item writes that bypass model signals still invalidate."""
+        self.client.get(f'/api/v1/protocol/{self.protocol.id}/')
+        self.client.post('/api/v1/item/', {
+            'item_id': self.item.id,
+            'protocol': self.protocol.id,
+            'name': 'Minutes',
+            'value': 'Changed',
+            'position': 1,
+        }, format='json')
+        
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/')
+        self.assertEqual(response.json()['items'][0]['value'], 'Changed')
+    
+    def test_protocol_summary(self):
+        """Test protocol list rows carry group and counts without extra queries."""
+        self.group.color = '#ff0000'
+        self.group.save()
+        ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Call', who='Max', when=timezone.now(), done=True
+        )
+        ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Buy', who='Max', when=timezone.now()
+        )
+        for day in range(2, 12):
+            Protocol.objects.create(protocol_date=date(2024, 1, day), group=self.group)
+        cache.clear()
+        
+        with self.assertNumQueries(2):
+            # Permission matrix and the annotated protocol list.
+            protocols = self.client.get('/api/v1/protocol/').json()
+        
+        summary = next(p for p in protocols if p['id'] == self.protocol.id)
+        self.assertEqual(summary['group_name'], 'Group')
+        self.assertEqual(summary['group_color'], '#ff0000')
+        self.assertEqual(
+            (summary['item_count'], summary['todo_count'], summary['open_todo_count']), (1, 2, 1)
+        )
+        self.assertEqual(
+            {(p['item_count'], p['todo_count']) for p in protocols if p['id'] != self.protocol.id},
+            {(0, 0)},
+        )
+    
+    def test_protocol_list_counts_invalidated(self):
+        """Test adding items and todos refreshes the cached protocol list."""
+        self.client.get('/api/v1/protocol/')
+        ProtocolItem.objects.create(protocol=self.protocol, name='Other', position=2)
+        todo = ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Call', who='Max', when=timezone.now()
+        )
+        summary = self.client.get('/api/v1/protocol/').json()[0]
+        self.assertEqual((summary['item_count'], summary['open_todo_count']), (2, 1))
+        
+        response = self.client.patch(
+            f'/api/v1/protocol/{self.protocol.id}/todo/{todo.id}/', {'done': True}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = self.client.get('/api/v1/protocol/').json()[0]
+        self.assertEqual((summary['todo_count'], summary['open_todo_count']), (1, 0))
+    
+    def test_membership_change(self):
+        """Test a removed member no longer gets the group's cached responses."""
+        self.assertEqual(len(self.client.get('/api/v1/protocol/').json()), 1)
+        self.group.group_members.remove(self.user)
+        self.assertEqual(self.client.get('/api/v1/protocol/').json(), [])
+        self.user.group_set.add(self.group)
+        self.assertEqual(len(self.client.get('/api/v1/protocol/').json()), 1)
+    
+    def test_responses_are_cached_per_user(self):
+        """Test staff users don't receive a member's cached list."""
+        self.client.get('/api/v1/group/')
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        self.assertEqual(len(self.client.get('/api/v1/group/').json()), 2)
+    
+    def test_user_me_is_cached_and_invalidated(self):
+        """Test user/me is cached and follows membership and resident changes."""
+        first = self.client.get('/api/v1/user/me/').json()
+        self.assertEqual(first['groups_with_permissions'][0]['resident_count'], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/user/me/').json(), first)
+        
+        Resident.objects.create(
+            first_name='Erika', last_name='Musterfrau', moved_in_since=date(2021, 1, 1),
+            group=self.group
+        )
+        groups = self.client.get('/api/v1/user/me/').json()['groups_with_permissions']
+        self.assertEqual(groups[0]['resident_count'], 2)
+        
+        self.other_group.group_members.add(self.user)
+        groups = self.client.get('/api/v1/user/me/').json()['groups_with_permissions']
+        self.assertEqual(len(groups), 2)
+        
+        self.user.first_name = 'Changed'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/user/me/').json()['first_name'], 'Changed')
+    
+    def test_user_me_query_count(self):
+        """Test staff user/me costs one query however many groups exist."""
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        with self.assertNumQueries(1):
+            self.client.get('/api/v1/user/me/')
+        Group.objects.bulk_create(
+            Group(name=f'Group {i}', address='-', postalcode='-', city='-') for i in range(20)
+        )
+        cache.clear()
+        with self.assertNumQueries(1):
+            groups = self.client.get('/api/v1/user/me/').json()['groups_with_permissions']
+        self.assertEqual(len(groups), 22)
+
+
+class AdminUserListTestCase(APITestCase):
+    """Test cases for the paginated, searchable admin user list."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.staff = User.objects.create_user(
+            username='staff', password='testpass123', first_name='Aaron', is_staff=True
+        )
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        for i in range(12):
+            user = User.objects.create_user(
+                username=f'user{i:02d}',
+                first_name='Berta' if i % 2 else 'Carl',
+                last_name=f'Nachname{i:02d}',
+                email=f'user{i:02d}@example.com',
+            )
+            self.group.group_members.add(user)
+        self.client.force_authenticate(user=self.staff)
+    
+    def test_pagination(self):
+        """Test users are returned in pages with count and links."""
+        response = self.client.get('/api/v1/admin/users/?page_size=5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['count'], 13)
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['previous'])
+        self.assertIn('page=2', data['next'])
+        self.assertEqual(data['results'][0]['username'], 'staff')
+        self.assertEqual(data['results'][1]['groups'], [{'id': self.group.id, 'name': 'Group'}])
+        
+        last = self.client.get('/api/v1/admin/users/?page_size=5&page=3').json()
+        self.assertEqual(len(last['results']), 3)
+        self.assertIsNone(last['next'])
+    
+    def test_search(self):
+        """Test search matches name, username and email terms."""
+        results = self.client.get('/api/v1/admin/users/?search=berta').json()['results']
+        self.assertEqual(len(results), 6)
+        results = self.client.get('/api/v1/admin/users/?search=carl nachname04').json()['results']
+        self.assertEqual([user['username'] for user in results], ['user04'])
+        results = self.client.get('/api/v1/admin/users/?search=user11@example').json()['results']
+        self.assertEqual([user['username'] for user in results], ['user11'])
+    
+    def test_query_count_is_constant(self):
+        """Test a full page costs the same queries as a short one."""
+        with self.assertNumQueries(4):
+            self.client.get('/api/v1/admin/users/?page_size=2')
+        with self.assertNumQueries(4):
+            self.client.get('/api/v1/admin/users/?page_size=50')
+    
+    def test_invalid_page(self):
+        """Test a page past the end returns 404."""
+        response = self.client.get('/api/v1/admin/users/?page=9')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {'error': 'Seite nicht gefunden.'})
+    
+    def test_non_staff_forbidden(self):
+        """Test non-staff users cannot list users."""
+        self.client.force_authenticate(user=User.objects.get(username='user00'))
+        response = self.client.get('/api/v1/admin/users/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class PermissionMatrixTestCase(APITestCase):
+    """Test cases for UserPermission grants enforced via the permission matrix."""
+    
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.member = User.objects.create_user(username='member', password='testpass123')
+        self.guest = User.objects.create_user(username='guest', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.member)
+        self.resident = Resident.objects.create(
+            first_name='Max', last_name='Mustermann', moved_in_since=date(2020, 1, 1),
+            group=self.group
+        )
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.item = ProtocolItem.objects.create(
+            protocol=self.protocol, name='Minutes', position=1, value='Hello'
+        )
+    
+    def _grant(self, user, resource, permission):
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.post(f'/api/v1/admin/users/{user.id}/permissions/', {
+            'group_id': self.group.id,
+            'resource': resource,
+            'permission': permission,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(user=user)
+        return response.json()['id']
+    
+    def _update_item(self):
+        return self.client.post('/api/v1/item/', {
+            'item_id': self.item.id,
+            'protocol': self.protocol.id,
+            'name': 'Minutes',
+            'value': 'Changed',
+            'position': 1,
+        }, format='json')
+    
+    def test_compile_permissions(self):
+        """Test memberships and grants compile into per-group bitmasks."""
+        other = Group.objects.create(name='Other', address='-', postalcode='-', city='-')
+        UserPermission.objects.create(user=self.member, group=other, resource='protocol', permission='read')
+        UserPermission.objects.create(user=self.member, group=self.group, resource='group', permission='delete')
+        
+        self.assertEqual(compile_permissions(self.member.id), {
+            self.group.id: {'group': READ | WRITE | DELETE, 'resident': 7, 'protocol': 7},
+            other.id: {'protocol': READ},
+        })
+    
+    def test_grants_never_restrict_members(self):
+        """Test a read grant leaves a member's write and delete rights in place."""
+        self._grant(self.member, 'protocol', 'read')
+        
+        self.assertEqual(compile_permissions(self.member.id)[self.group.id]['protocol'], READ | WRITE | DELETE)
+        self.assertEqual(self._update_item().status_code, status.HTTP_200_OK)
+        response = self.client.delete(f'/api/v1/protocol/{self.protocol.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    
+    def test_read_grant_for_non_member(self):
+        """Test a read grant exposes the group's protocols read-only."""
+        self.client.force_authenticate(user=self.guest)
+        self.assertEqual(self.client.get('/api/v1/protocol/').json(), [])
+        
+        self._grant(self.guest, 'protocol', 'read')
+        self.assertEqual(len(self.client.get('/api/v1/protocol/').json()), 1)
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(f'/api/v1/protocol/{self.protocol.id}/', {
+            'protocol_date': '2024-01-20', 'group': self.group.id
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self._update_item().status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/api/v1/resident/').json(), [])
+    
+    def test_write_grant_and_revoke(self):
+        """Test write grants allow edits until revoked through the admin API."""
+        self.client.force_authenticate(user=self.guest)
+        self.assertEqual(self._update_item().status_code, status.HTTP_404_NOT_FOUND)
+        
+        permission_id = self._grant(self.guest, 'protocol', 'write')
+        self.assertEqual(self._update_item().status_code, status.HTTP_200_OK)
+        
+        self.client.force_authenticate(user=self.staff)
+        self.client.delete(f'/api/v1/admin/users/{self.guest.id}/permissions/{permission_id}/')
+        self.client.force_authenticate(user=self.guest)
+        self.assertEqual(self._update_item().status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_matrix_is_cached(self):
+        """Test the matrix is loaded once and dropped on membership changes."""
+        self.client.force_authenticate(user=self.member)
+        self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/')
+        with self.assertNumQueries(1):
+            # Presence entries only.
+            self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/')
+        
+        self.group.group_members.remove(self.member)
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_matrix_timeout_follows_shared_cache(self):
+        """Test process-local caches keep matrices for seconds only."""
+        self.client.force_authenticate(user=self.member)
+        for shared, timeout in ((True, MATRIX_TIMEOUT), (False, LOCAL_MATRIX_TIMEOUT)):
+            cache.clear()
+            with self.subTest(shared=shared), self.settings(SHARED_CACHE=shared), \
+                    mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+                self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/')
+                cache_set.assert_any_call(f'permissions:{self.member.id}', mock.ANY, timeout)
+    
+    def test_member_rights(self):
+        """Test members keep full access to residents and protocols only."""
+        self.client.force_authenticate(user=self.member)
+        other = Group.objects.create(name='Other', address='-', postalcode='-', city='-')
+        
+        response = self.client.post('/api/v1/protocol/', {
+            'protocol_date': '2024-01-15', 'group': other.id
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post('/api/v1/group/', {
+            'name': 'New', 'address': '-', 'postalcode': '-', 'city': '-'
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.delete(f'/api/v1/group/{self.group.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.delete(f'/api/v1/resident/{self.resident.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    
+    def test_user_me_lists_granted_groups(self):
+        """Test user/me reports the rights of granted groups."""
+        self._grant(self.guest, 'resident', 'read')
+        groups = self.client.get('/api/v1/user/me/').json()['groups_with_permissions']
+        self.assertEqual(len(groups), 1)
+        permissions = groups[0]['permissions']
+        self.assertFalse(permissions['is_member'])
+        self.assertFalse(permissions['can_view'])
+        self.assertEqual(permissions['resources'], {'resident': ['read'], 'protocol': [], 'group': []})
+    
+    def test_invisible_objects_are_not_found(self):
+        """Test objects of groups the user has no rights on answer 404."""
+        todo = ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Call', who='Max', when=timezone.now(), position=1
+        )
+        self.client.force_authenticate(user=self.guest)
+        
+        for response in [
+            self.client.get(f'/api/v1/protocol/{self.protocol.id}/todo/'),
+            self.client.get(f'/api/v1/protocol/{self.protocol.id}/todo/{todo.id}/'),
+            self.client.get(f'/api/v1/protocol/{self.protocol.id}/presence/'),
+            self.client.get(f'/api/v1/protocol/{self.protocol.id}/exported_file/'),
+            self.client.post(f'/api/v1/group/{self.group.id}/pdf_template/', {}),
+            self._update_item(),
+            self.client.delete('/api/v1/item/', {'item_id': self.item.id}, format='json'),
+        ]:
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+        self._grant(self.guest, 'protocol', 'read')
+        response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/todo/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(f'/api/v1/protocol/{self.protocol.id}/todo/{todo.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_item_update_cannot_move_foreign_items(self):
+        """Test updating items of protocols the user can't write is a 404."""
+        other = Group.objects.create(name='Other', address='-', postalcode='-', city='-')
+        other_protocol = Protocol.objects.create(protocol_date=date(2024, 2, 1), group=other)
+        foreign = ProtocolItem.objects.create(protocol=other_protocol, name='Secret', position=1)
+        self.client.force_authenticate(user=self.member)
+        
+        response = self.client.post('/api/v1/item/', {
+            'item_id': foreign.id,
+            'protocol': self.protocol.id,
+            'name': 'Stolen',
+            'value': '',
+            'position': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {'error': 'Item not found'})
+        foreign.refresh_from_db()
+        self.assertEqual((foreign.protocol_id, foreign.name), (other_protocol.id, 'Secret'))
+    
+    def test_object_lookup_query_count(self):
+        """Test object lookups check access in the same query."""
+        todo = ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Call', who='Max', when=timezone.now(), position=1
+        )
+        self.client.force_authenticate(user=self.member)
+        self.client.get(f'/api/v1/protocol/{self.protocol.id}/todo/{todo.id}/')
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/todo/{todo.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/v1/protocol/{self.protocol.id}/exported_file/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProtocolBundleTestCase(APITestCase):
+    """Test cases for the protocol bundle endpoint."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(
+            username='member', password='testpass123', first_name='Erika', last_name='Muster'
+        )
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.url = f'/api/v1/protocol/{self.protocol.id}/bundle/'
+    
+    def _add_rows(self, count):
+        for i in range(count):
+            ProtocolItem.objects.create(protocol=self.protocol, name=f'Item {i}', position=i)
+            ProtocolTodo.objects.create(
+                protocol=self.protocol, what=f'Todo {i}', who='Max', when=timezone.now(), position=i
+            )
+            user = User.objects.create_user(username=f'user{self.protocol.id}-{i}-{count}')
+            ProtocolPresence.objects.create(protocol=self.protocol, user=user, was_present=True)
+    
+    def test_bundle_contents(self):
+        """Test the bundle holds the protocol, its items, todos and presence."""
+        self._add_rows(2)
+        ProtocolPresence.objects.update_or_create(
+            protocol=self.protocol, user=self.user, defaults={'was_present': False}
+        )
+        self.client.force_authenticate(user=self.user)
+        
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['id'], self.protocol.id)
+        self.assertEqual([item['name'] for item in data['items']], ['Item 0', 'Item 1'])
+        self.assertEqual([todo['what'] for todo in data['todos']], ['Todo 0', 'Todo 1'])
+        self.assertEqual(len(data['presence']), 3)
+        # Members get an entry when the protocol is created.
+        self.assertEqual(data['presence'][0]['user_name'], 'Erika Muster')
+        self.assertFalse(data['presence'][0]['was_present'])
+    
+    def test_bundle_query_count_is_constant(self):
+        """Test the bundle's queries don't grow with its rows."""
+        self.client.force_authenticate(user=self.user)
+        self._add_rows(1)
+        self.client.get(self.url)
+        with self.assertNumQueries(4):
+            # Protocol, items, todos and presence with user names.
+            self.client.get(self.url)
+        
+        self._add_rows(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()['presence']), 12)
+    
+    def test_bundle_hidden_from_non_members(self):
+        """Test the bundle of another group's protocol is not found."""
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProtocolCloneTestCase(APITestCase):
+    """Test cases for cloning a protocol."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(
+            protocol_date=date(2024, 1, 1), group=self.group, status='exported', exported=True
+        )
+        ProtocolItem.objects.create(protocol=self.protocol, name='Agenda', position=1, value='A')
+        ProtocolItem.objects.create(protocol=self.protocol, name='Notes', position=2, value='B')
+        ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Call', who='Max', when=timezone.now(), position=1
+        )
+        ProtocolTodo.objects.create(
+            protocol=self.protocol, what='Done', who='Max', when=timezone.now(), done=True
+        )
+        self.url = f'/api/v1/protocol/{self.protocol.id}/clone/'
+    
+    def test_clone_copies_items_and_open_todos(self):
+        """Test a clone gets the item names and open todos, but no values."""
+        self.client.force_authenticate(user=self.user)
+        
+        response = self.client.post(self.url, {'protocol_date': '2024-01-08'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        clone = Protocol.objects.get(id=response.json()['id'])
+        self.assertEqual((clone.protocol_date, clone.group_id), (date(2024, 1, 8), self.group.id))
+        self.assertEqual((clone.status, clone.exported), ('draft', False))
+        self.assertEqual(
+            list(clone.items.values_list('name', 'position', 'value')),
+            [('Agenda', 1, ''), ('Notes', 2, '')],
+        )
+        self.assertEqual(
+            [(item['id'], item['name']) for item in response.json()['items']],
+            list(clone.items.values_list('id', 'name')),
+        )
+        self.assertEqual(list(clone.todos.values_list('what', 'done')), [('Call', False)])
+        self.assertTrue(ProtocolPresence.objects.filter(protocol=clone, user=self.user).exists())
+    
+    def test_clone_with_values(self):
+        """Test copy_values also copies the item values."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            self.url, {'protocol_date': '2024-01-08', 'copy_values': True}, format='json'
+        )
+        clone = Protocol.objects.get(id=response.json()['id'])
+        self.assertEqual(list(clone.items.values_list('value', flat=True)), ['A', 'B'])
+    
+    def test_clone_query_count_is_constant(self):
+        """Test cloning inserts each table in one query."""
+        self.client.force_authenticate(user=self.user)
+        self.client.post(self.url, {'protocol_date': '2024-01-08'}, format='json')
+        for i in range(20):
+            ProtocolItem.objects.create(protocol=self.protocol, name=f'Item {i}', position=i + 3)
+        with self.assertNumQueries(11):
+            self.client.post(self.url, {'protocol_date': '2024-01-15'}, format='json')
+    
+    def test_clone_validation_and_access(self):
+        """Test a date is required and other groups' protocols are not found."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.post(self.url, {'protocol_date': '2024-01-08'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Protocol.objects.count(), 1)
+
+
+class NestedProtocolWriteTestCase(APITestCase):
+    """Test cases for writing items and todos inline with a protocol."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.keep = ProtocolItem.objects.create(protocol=self.protocol, name='Keep', position=1, value='A')
+        self.change = ProtocolItem.objects.create(protocol=self.protocol, name='Change', position=2, value='B')
+        self.drop = ProtocolItem.objects.create(protocol=self.protocol, name='Drop', position=3, value='C')
+        self.client.force_authenticate(user=self.user)
+    
+    def _create(self, item_count):
+        return self.client.post('/api/v1/protocol/', {
+            'protocol_date': '2024-02-01',
+            'group': self.group.id,
+            'items': [{'name': f'Item {i}', 'position': i} for i in range(item_count)],
+            'todos': [{'what': 'Call', 'who': 'Max', 'when': '2024-02-02T10:00:00Z'}],
+        }, format='json')
+    
+    def _put(self, items):
+        return self.client.put(f'/api/v1/protocol/{self.protocol.id}/', {
+            'protocol_date': '2024-01-01',
+            'group': self.group.id,
+            'items': items,
+        }, format='json')
+    
+    def test_create_with_items_and_todos(self):
+        """Test a protocol is created together with its items and todos."""
+        response = self._create(3)
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        protocol = Protocol.objects.get(id=response.json()['id'])
+        self.assertEqual(
+            list(protocol.items.values_list('name', flat=True)), ['Item 0', 'Item 1', 'Item 2']
+        )
+        self.assertEqual([item['name'] for item in response.json()['items']], ['Item 0', 'Item 1', 'Item 2'])
+        self.assertEqual(list(protocol.todos.values_list('what', flat=True)), ['Call'])
+        self.assertNotIn('todos', response.json())
+    
+    def test_create_query_count_is_constant(self):
+        """Test inline rows are inserted in bulk."""
+        self._create(1)
+        with self.assertNumQueries(11):
+            self._create(2)
+        with self.assertNumQueries(11):
+            self._create(30)
+    
+    def test_update_diffs_items(self):
+        """Test updates keep unchanged items, update changed ones and delete the rest."""
+        response = self._put([
+            {'id': self.keep.id, 'name': 'Keep', 'position': 1, 'value': 'A'},
+            {'id': self.change.id, 'name': 'Change', 'position': 2, 'value': 'B2'},
+            {'name': 'New', 'position': 3},
+        ])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        items = {item.name: item for item in self.protocol.items.all()}
+        self.assertEqual(set(items), {'Keep', 'Change', 'New'})
+        self.assertEqual((items['Keep'].id, items['Keep'].version), (self.keep.id, 0))
+        self.assertEqual((items['Change'].value, items['Change'].version), ('B2', 1))
+        self.assertEqual(
+            [(item['name'], item['version']) for item in response.json()['items']],
+            [('Keep', 0), ('Change', 1), ('New', 0)],
+        )
+    
+    def test_update_without_items_keeps_them(self):
+        """Test items are left alone when the update doesn't send them."""
+        response = self.client.patch(
+            f'/api/v1/protocol/{self.protocol.id}/', {'protocol_date': '2024-01-02'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.protocol.items.count(), 3)
+    
+    def test_update_rejects_foreign_items(self):
+        """Test items of other protocols can't be updated and nothing is written."""
+        other = Protocol.objects.create(protocol_date=date(2024, 1, 8), group=self.group)
+        foreign = ProtocolItem.objects.create(protocol=other, name='Foreign', position=1)
+        
+        response = self._put([
+            {'name': 'New', 'position': 1},
+            {'id': foreign.id, 'name': 'Stolen', 'position': 2},
+        ])
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.protocol.items.count(), 3)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.name, 'Foreign')
+    
+    def test_update_deleting_items_needs_delete_right(self):
+        """Test leaving items out needs the delete right."""
+        guest = User.objects.create_user(username='guest', password='testpass123')
+        for permission in ('read', 'write'):
+            UserPermission.objects.create(
+                user=guest, group=self.group, resource='protocol', permission=permission
+            )
+        self.client.force_authenticate(user=guest)
+        
+        response = self._put([{'id': self.keep.id, 'name': 'Keep', 'position': 1}])
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.protocol.items.count(), 3)
+    
+    def _put_and_commit(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._put(items)
+    
+    async def test_update_publishes_events(self):
+        """Test inline item changes reach live subscribers once committed."""
+        broker = InProcessBroker()
+        subscription = await broker.subscribe(f'protocol:{self.protocol.id}')
+        with mock.patch('django_grp_api.events.get_broker', return_value=broker):
+            response = await sync_to_async(self._put_and_commit)([
+                {'id': self.keep.id, 'name': 'Keep', 'position': 1, 'value': 'A'},
+                {'id': self.change.id, 'name': 'Change', 'position': 2, 'value': 'B2'},
+                {'name': 'New', 'position': 3},
+            ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        events = [await subscription.get(timeout=1) for _ in range(3)]
+        self.assertIsNone(await subscription.get(timeout=0.01))
+        await subscription.close()
+        created, updated, deleted = events
+        self.assertEqual(created['type'], 'item.created')
+        self.assertEqual(created['data']['name'], 'New')
+        self.assertIsNotNone(created['data']['id'])
+        self.assertEqual(updated['type'], 'item.updated')
+        self.assertEqual(
+            updated['data'],
+            {'id': self.change.id, 'name': 'Change', 'position': 2, 'value': 'B2', 'version': 1},
+        )
+        self.assertEqual(deleted, {'type': 'item.deleted', 'data': {'id': self.drop.id}})
+
+
+class ProtocolArchiveTestCase(APITestCase):
+    """Test cases for archiving exported protocols."""
+    
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='member', password='testpass123', first_name='Erika', last_name='Muster'
+        )
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        self.old = [
+            self._protocol(date(2020, 1, day), status='exported', exported=True) for day in (1, 8, 15)
+        ]
+        self.old_draft = self._protocol(date(2020, 1, 22))
+        self.recent = self._protocol(date(2024, 1, 1), status='exported', exported=True)
+        self.item = ProtocolItem.objects.create(protocol=self.old[0], name='Agenda', position=1, value='A')
+        self.todo = ProtocolTodo.objects.create(
+            protocol=self.old[0], what='Call', who='Max', when=timezone.now()
+        )
+    
+    def _protocol(self, protocol_date, **kwargs):
+        return Protocol.objects.create(protocol_date=protocol_date, group=self.group, **kwargs)
+    
+    def test_archive_moves_old_exported_protocols(self):
+        """Test old exported protocols move with their rows and keep their ids."""
+        moved = archive_protocols(date(2021, 1, 1), batch_size=2)
+        
+        self.assertEqual(moved, {
+            'archivedprotocol': 3,
+            'archivedprotocolitem': 1,
+            'archivedprotocoltodo': 1,
+            'archivedprotocolpresence': 3,
+        })
+        self.assertEqual(
+            set(Protocol.objects.values_list('id', flat=True)), {self.old_draft.id, self.recent.id}
+        )
+        archived = ArchivedProtocol.objects.get(id=self.old[0].id)
+        self.assertEqual((archived.protocol_date, archived.status), (date(2020, 1, 1), 'exported'))
+        self.assertEqual(list(archived.items.values_list('id', 'value')), [(self.item.id, 'A')])
+        self.assertEqual(list(archived.todos.values_list('id', flat=True)), [self.todo.id])
+        self.assertEqual(list(archived.presence.values_list('user_id', flat=True)), [self.user.id])
+        self.assertFalse(ProtocolItem.objects.filter(id=self.item.id).exists())
+        self.assertEqual(newest_archived_date(), date(2020, 1, 15))
+        
+        # Nothing left to move.
+        self.assertEqual(archive_protocols(date(2021, 1, 1))['archivedprotocol'], 0)
+    
+    def test_newest_archived_date_cached_only_in_shared_cache(self):
+        """Test a process-local cache never keeps a boundary another process changed."""
+        self.assertIsNone(newest_archived_date())
+        # As run by the archive command in a process of its own, whose cache
+        # invalidation never reaches this one.
+        with mock.patch('django_grp_backend.archive.cache'):
+            archive_protocols(date(2021, 1, 1))
+        self.assertEqual(newest_archived_date(), date(2020, 1, 15))
+        
+        with self.settings(SHARED_CACHE=True):
+            newest_archived_date()
+            with self.assertNumQueries(0):
+                self.assertEqual(newest_archived_date(), date(2020, 1, 15))
+    
+    def test_archive_command(self):
+        """Test the management command honours --dry-run and --before."""
+        out = StringIO()
+        call_command('archive_protocols', '--before', '2021-01-01', '--dry-run', stdout=out)
+        self.assertIn('3 protocols', out.getvalue())
+        self.assertEqual(ArchivedProtocol.objects.count(), 0)
+        
+        call_command('archive_protocols', '--before', '2021-01-01', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(ArchivedProtocol.objects.count(), 3)
+        with self.assertRaises(CommandError):
+            call_command('archive_protocols', '--before', '2999-01-01')
+    
+    def test_archived_protocol_api(self):
+        """Test archived protocols can be read but not written, by members only."""
+        archive_protocols(date(2021, 1, 1))
+        self.client.force_authenticate(user=self.user)
+        
+        response = self.client.get('/api/v1/archive/protocol/', {'date_to': '2020-01-10'})
+        self.assertEqual([p['id'] for p in response.json()], [self.old[1].id, self.old[0].id])
+        self.assertEqual(response.json()[1]['item_count'], 1)
+        
+        response = self.client.get(f'/api/v1/archive/protocol/{self.old[0].id}/')
+        data = response.json()
+        self.assertTrue(data['archived'])
+        self.assertEqual([item['name'] for item in data['items']], ['Agenda'])
+        self.assertEqual([todo['what'] for todo in data['todos']], ['Call'])
+        self.assertEqual(data['presence'][0]['user_name'], 'Erika Muster')
+        
+        response = self.client.delete(f'/api/v1/archive/protocol/{self.old[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(f'/api/v1/archive/protocol/{self.old[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_protocol_list_includes_archive_for_old_dates(self):
+        """Test the protocol list appends archived protocols the date filter reaches."""
+        archive_protocols(date(2021, 1, 1))
+        self.client.force_authenticate(user=self.user)
+        
+        ids = [p['id'] for p in self.client.get('/api/v1/protocol/').json()]
+        self.assertEqual(sorted(ids), sorted([self.old_draft.id, self.recent.id]))
+        
+        response = self.client.get('/api/v1/protocol/', {'date_from': '2020-01-08'})
+        protocols = response.json()
+        self.assertEqual(
+            [(p['id'], p['archived']) for p in protocols[2:]],
+            [(self.old[1].id, True), (self.old[2].id, True)],
+        )
+        self.assertEqual(
+            {(p['id'], p['archived']) for p in protocols[:2]},
+            {(self.old_draft.id, False), (self.recent.id, False)},
+        )
+        
+        response = self.client.get('/api/v1/protocol/', {'date_from': '2020-01-16'})
+        self.assertEqual(len(response.json()), 2)
+        response = self.client.get('/api/v1/protocol/', {'date_from': 'gestern'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StoredFileTestCase(APITestCase):
+    """Test cases for deduplicated, reference-counted uploads."""
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.groups = [
+            Group.objects.create(name=f'Group {n}', address='Address', postalcode='12345', city='City')
+            for n in range(2)
+        ]
+        for group in self.groups:
+            group.group_members.add(self.user)
+        self.protocol = Protocol.objects.create(protocol_date=date(2020, 1, 1), group=self.groups[0])
+        self.client.force_authenticate(user=self.user)
+    
+    def _upload(self, url, field, content, name='file.pdf'):
+        return self.client.post(url, {field: SimpleUploadedFile(name, content)}, format='multipart')
+    
+    def _references(self, name):
+        return StoredFile.objects.filter(name=name).values_list('references', flat=True).first()
+    
+    def test_identical_uploads_are_stored_once(self):
+        """Test the same template uploaded to two groups is stored once under its hash."""
+        content = b'%PDF-1.4 template'
+        for group in self.groups:
+            response = self._upload(f'/api/v1/group/{group.id}/pdf_template/', 'pdf_template', content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        names = {group.pdf_template.name for group in Group.objects.filter(id__in=[g.id for g in self.groups])}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(name, f'docs/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertEqual(self._references(name), 2)
+        self.assertEqual(StoredFile.objects.get(name=name).size, len(content))
+        self.assertEqual(len(os.listdir(os.path.dirname(content_storage.path(name)))), 1)
+    
+    def test_replaced_file_is_deleted_with_last_reference(self):
+        """Test a blob is deleted once no field references it any more."""
+        url = f'/api/v1/protocol/{self.protocol.id}/exported_file/'
+        self._upload(url, 'exported_file', b'%PDF-1.7 first')
+        self._upload(url, 'exported_file', b'%PDF-1.7 first')
+        self.protocol.refresh_from_db()
+        first = self.protocol.exported_file.name
+        self.assertEqual(self._references(first), 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._upload(url, 'exported_file', b'%PDF-1.7 second')
+        self.assertIsNone(self._references(first))
+        self.assertFalse(content_storage.exists(first))
+        
+        self.protocol.refresh_from_db()
+        second = self.protocol.exported_file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.protocol.delete()
+        self.assertFalse(content_storage.exists(second))
+    
+    def test_blob_uploaded_again_while_released_is_kept(self):
+        """Test a blob referenced again before its release commits survives, and a deleted one is re-created."""
+        content = b'%PDF-1.4 shared'
+        urls = [f'/api/v1/group/{group.id}/pdf_template/' for group in self.groups]
+        self._upload(urls[0], 'pdf_template', content)
+        name = Group.objects.get(id=self.groups[0].id).pdf_template.name
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._upload(urls[0], 'pdf_template', b'%PDF-1.4 other')
+            self._upload(urls[1], 'pdf_template', content)
+        self.assertEqual(self._references(name), 1)
+        self.assertTrue(content_storage.exists(name))
+        
+        os.remove(content_storage.path(name))
+        self._upload(urls[0], 'pdf_template', content)
+        self.assertEqual(self._references(name), 2)
+        with content_storage.open(name) as file:
+            self.assertEqual(file.read(), content)
+    
+    def test_archived_protocols_keep_their_file(self):
+        """Test archiving moves the reference instead of dropping the file."""
+        self.protocol.exported_file.save('export.pdf', ContentFile(b'%PDF-1.7 export'))
+        Protocol.objects.filter(id=self.protocol.id).update(status='exported')
+        name = self.protocol.exported_file.name
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            archive_protocols(date(2021, 1, 1))
+        self.assertEqual(self._references(name), 1)
+        self.assertTrue(content_storage.exists(name))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            ArchivedProtocol.objects.get(id=self.protocol.id).delete()
+        self.assertFalse(content_storage.exists(name))
+    
+    def test_files_stored_before_deduplication_are_left_alone(self):
+        """Test files with pre-deduplication names are neither counted nor deleted."""
+        name = default_storage.save('exports/legacy.pdf', ContentFile(b'%PDF-1.7 legacy'))
+        Protocol.objects.filter(id=self.protocol.id).update(exported_file=name)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Protocol.objects.get(id=self.protocol.id).delete()
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertTrue(default_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), UPLOADS={'TEMP_DIR': tempfile.mkdtemp(), 'MAX_CHUNK_SIZE': 1024})
+class ChunkedUploadTestCase(APITestCase):
+    """Test cases for resumable chunked uploads."""
+    
+    content = b'%PDF-1.7 ' + bytes(range(256)) * 10
+    
+    def setUp(self):
+        """Set up test data."""
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.group = Group.objects.create(
+            name='Group', address='Address', postalcode='12345', city='City'
+        )
+        self.group.group_members.add(self.user)
+        UserPermission.objects.create(
+            user=self.reader, group=self.group, resource='protocol', permission='read'
+        )
+        self.protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=self.group)
+        self.client.force_authenticate(user=self.user)
+    
+    def _start(self, target='exported_file', object_id=None, **fields):
+        data = {
+            'target': target,
+            'object_id': object_id or self.protocol.id,
+            'filename': 'export.pdf',
+            'size': len(self.content),
+            'checksum': hashlib.sha256(self.content).hexdigest(),
+            **fields,
+        }
+        return self.client.post('/api/v1/upload/', data, format='json')
+    
+    def _put(self, session_id, start, end, body=None):
+        body = self.content[start:end] if body is None else body
+        return self.client.put(
+            f'/api/v1/upload/{session_id}/',
+            body,
+            content_type='application/octet-stream',
+            headers={'content-range': f'bytes {start}-{end - 1}/{len(self.content)}'},
+        )
+    
+    def _upload(self, **fields):
+        session_id = self._start(**fields).json()['id']
+        for start in range(0, len(self.content), 1024):
+            self._put(session_id, start, min(start + 1024, len(self.content)))
+        return session_id
+    
+    def test_chunked_upload_resumes_and_attaches_file(self):
+        """Test chunks are appended by offset, resent chunks conflict and finalize attaches the file."""
+        response = self._start()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_id = response.json()['id']
+        self.assertEqual(response.json()['offset'], 0)
+        
+        self.assertEqual(self._put(session_id, 0, 1000).json()['offset'], 1000)
+        # The response got lost and the chunk is sent again.
+        response = self._put(session_id, 0, 1000)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['offset'], 1000)
+        self.assertEqual(self.client.get(f'/api/v1/upload/{session_id}/').json()['offset'], 1000)
+        
+        response = self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        self._put(session_id, 1000, 2000)
+        self.assertEqual(self._put(session_id, 2000, len(self.content)).status_code, status.HTTP_200_OK)
+        response = self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], 'exported')
+        
+        self.protocol.refresh_from_db()
+        self.assertEqual(self.protocol.status, 'exported')
+        with self.protocol.exported_file.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertNotIn(f"{session_id.replace('-', '')}.part", os.listdir(get_upload_setting('TEMP_DIR')))
+    
+    def test_chunk_checks(self):
+        """Test malformed, oversized and out-of-range chunks are rejected."""
+        session_id = self._start().json()['id']
+        
+        response = self.client.put(
+            f'/api/v1/upload/{session_id}/', b'abc', content_type='application/octet-stream'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._put(session_id, 0, 2000).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self._put(session_id, 0, 10, b'short').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(
+            f'/api/v1/upload/{session_id}/',
+            b'x',
+            content_type='application/octet-stream',
+            headers={'content-range': f'bytes {len(self.content)}-{len(self.content)}/*'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f'/api/v1/upload/{session_id}/').json()['offset'], 0)
+    
+    def test_chunk_streamed_outside_transaction(self):
+        """Test chunks arrive without a lock and conflict if another one got in first."""
+        session_id = self._start().json()['id']
+        received = []
+        
+        @contextlib.contextmanager
+        def receive_racing(session, stream, length):
+            received.append(len(connection.atomic_blocks))
+            with receive_chunk(session, stream, length) as chunk:
+                # A resent copy of the same chunk completes meanwhile.
+                UploadSession.objects.filter(pk=session.pk).update(offset=1000)
+                yield chunk
+        
+        with mock.patch('django_grp_api.views.receive_chunk', receive_racing):
+            response = self._put(session_id, 0, 1000)
+        # Only the test case's own transaction.
+        self.assertEqual(received, [len(connection.atomic_blocks)])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['offset'], 1000)
+        self.assertEqual(
+            [name for name in os.listdir(get_upload_setting('TEMP_DIR')) if name.endswith('.chunk')], []
+        )
+    
+    def test_finalize_checks_file_outside_transaction(self):
+        """Test the file is checked without a lock while chunks, aborts and finalizing again conflict."""
+        session_id = self._upload()
+        seen = []
+        
+        def checksum_racing(session):
+            seen.append(len(connection.atomic_blocks))
+            seen.append(self.client.delete(f'/api/v1/upload/{session_id}/').status_code)
+            seen.append(self.client.post(f'/api/v1/upload/{session_id}/finalize/').status_code)
+            return file_checksum(session)
+        
+        with mock.patch('django_grp_api.views.file_checksum', checksum_racing):
+            response = self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Only the test case's own transaction.
+        self.assertEqual(
+            seen, [len(connection.atomic_blocks), status.HTTP_409_CONFLICT, status.HTTP_409_CONFLICT]
+        )
+        self.assertFalse(UploadSession.objects.exists())
+    
+    def test_failed_finalize_can_be_retried(self):
+        """Test a session is no longer finalizing once storing its file failed."""
+        session_id = self._upload()
+        
+        with mock.patch('django_grp_api.views.store_upload', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertFalse(self.client.get(f'/api/v1/upload/{session_id}/').json()['finalizing'])
+        response = self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_checksum_mismatch_discards_session(self):
+        """Test a file not matching its checksum is not attached."""
+        session_id = self._upload(checksum='0' * 64)
+        
+        response = self.client.post(f'/api/v1/upload/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+        self.protocol.refresh_from_db()
+        self.assertFalse(self.protocol.exported_file)
+    
+    def test_upload_access(self):
+        """Test uploads need write permission and sessions are private."""
+        self.client.force_authenticate(user=self.reader)
+        self.assertEqual(self._start().status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            self._start(target='pdf_template', object_id=self.group.id).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+        
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(
+            self._start(target='pdf_template', object_id=self.group.id, filename='a.doc').status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        session_id = self._start(target='pdf_template', object_id=self.group.id, filename='t.pdf').json()['id']
+        
+        self.client.force_authenticate(user=self.reader)
+        self.assertEqual(self.client.get(f'/api/v1/upload/{session_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.delete(f'/api/v1/upload/{session_id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+def _png(width, height):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _png_header(width, height):
+    """A PNG with an IHDR claiming ``width`` x ``height`` and no pixel data."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    chunk = b'IHDR' + ihdr
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + chunk + struct.pack('>I', zlib.crc32(chunk))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGES={'MAX_PIXELS': 10_000})
+class UploadValidationTestCase(APITestCase):
+    """Test cases for header-only image and PDF validation."""
+    
+    def test_validate_image_sniffs_format_and_size(self):
+        """Test images are checked by their header, not their extension."""
+        validate_image(SimpleUploadedFile('ok.png', _png(100, 100)))
+        
+        for name, content in [
+            ('png.jpg', _png(10, 10)),
+            ('text.png', b'<html></html>'),
+            ('big.png', _png(101, 100)),
+            ('script.svg', b'<svg/>'),
+        ]:
+            with self.subTest(name=name), self.assertRaises(ValidationError):
+                validate_image(SimpleUploadedFile(name, content))
+    
+    def test_oversized_images_are_never_decoded(self):
+        """Test a decompression bomb is rejected from its header alone."""
+        for width in (200, 100_000):
+            with self.subTest(width=width), mock.patch.object(Image.Image, 'load') as load:
+                with self.assertRaises(ValidationError):
+                    validate_image(SimpleUploadedFile('bomb.png', _png_header(width, width)))
+                load.assert_not_called()
+    
+    def test_validate_pdf_sniffs_header(self):
+        """Test PDFs need the %PDF- header within the first KiB."""
+        validate_pdf(SimpleUploadedFile('a.pdf', b'%PDF-1.7\n'))
+        validate_pdf(SimpleUploadedFile('b.pdf', b'\x00' * 100 + b'%PDF-1.4\n'))
+        for name, content in [
+            ('html.pdf', b'<html></html>'),
+            ('late.pdf', b' ' * 1024 + b'%PDF-1.4'),
+            ('doc.txt', b'%PDF-1.7\n'),
+        ]:
+            with self.subTest(name=name), self.assertRaises(ValidationError):
+                validate_pdf(SimpleUploadedFile(name, content))
+    
+    def test_upload_endpoints_reject_non_pdf_content(self):
+        """Test PDF template and exported file uploads check the content."""
+        user = User.objects.create_user(username='member', password='testpass123')
+        group = Group.objects.create(name='Group', address='Address', postalcode='12345', city='City')
+        group.group_members.add(user)
+        protocol = Protocol.objects.create(protocol_date=date(2024, 1, 1), group=group)
+        self.client.force_authenticate(user=user)
+        
+        response = self.client.post(
+            f'/api/v1/group/{group.id}/pdf_template/',
+            {'pdf_template': SimpleUploadedFile('template.pdf', b'<html></html>')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            f'/api/v1/protocol/{protocol.id}/exported_file/',
+            {'exported_file': SimpleUploadedFile('export.pdf', b'MZ\x90\x00')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        protocol.refresh_from_db()
+        self.assertEqual(protocol.status, 'draft')
+    
+    def test_rotate_rejects_oversized_image(self):
+        """Test rotating an image over the pixel budget fails without decoding it."""
+        user = User.objects.create_user(username='member', password='testpass123')
+        group = Group.objects.create(name='G', address='A', postalcode='12345', city='C')
+        group.group_members.add(user)
+        name = default_storage.save('images/big.png', ContentFile(_png(200, 200)))
+        # Bypasses Resident.save(), which would reject the picture itself.
+        resident = Resident.objects.create(first_name='A', last_name='B', moved_in_since=date(2020, 1, 1), group=group)
+        Resident.objects.filter(pk=resident.pk).update(picture=name)
+        self.client.force_authenticate(user=user)
+        
+        response = self.client.post(
+            '/api/v1/rotate_image/',
+            {'direction': 'left', 'image_url': default_storage.url(name)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_rotate_only_resident_pictures_of_visible_groups(self):
+        """Test foreign pictures and paths outside MEDIA_ROOT are not found."""
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        stranger = User.objects.create_user(username='stranger', password='testpass123')
+        group = Group.objects.create(name='G', address='A', postalcode='12345', city='C')
+        group.group_members.add(owner)
+        resident = Resident.objects.create(
+            first_name='A', last_name='B', moved_in_since=date(2020, 1, 1), group=group,
+            picture=SimpleUploadedFile('face.png', _png(20, 10)),
+        )
+        url = resident.picture.url
+        self.client.force_authenticate(user=stranger)
+        
+        for image_url in (url, '/media/../db.sqlite3', '/etc/passwd'):
+            with self.subTest(image_url=image_url):
+                response = self.client.post(
+                    '/api/v1/rotate_image/', {'direction': 'left', 'image_url': image_url}, format='json'
+                )
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+        self.client.force_authenticate(user=owner)
+        response = self.client.post('/api/v1/rotate_image/', {'direction': 'left', 'image_url': url}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        resident.refresh_from_db()
+        with Image.open(resident.picture.path) as img:
+            self.assertEqual(img.size, (10, 20))
@@ -2,11 +2,13 @@ import os
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import FileResponse, Http404
+from django.http import Http404
+
+from django_grp_backend.functions import file_response
 
 
 @login_required
-def serve_file(request, path):
+async def serve_file(request, path):
     """
     Serve media files with authentication check.
     
@@ -14,6 +16,8 @@ def serve_file(request, path):
     - User must be authenticated
     - File path must be within MEDIA_ROOT
     - File must exist
+
+    Async so downloads don't tie up a worker thread under ASGI.
     """
     file_path = os.path.join(settings.MEDIA_ROOT, path)
 
@@ -21,8 +25,8 @@ def serve_file(request, path):
     if not os.path.abspath(file_path).startswith(os.path.abspath(settings.MEDIA_ROOT)):
         raise Http404("Invalid file path")
 
-    if not os.path.exists(file_path):
+    if not os.path.isfile(file_path):
         raise Http404("File does not exist")
 
     # Serve the file
-    return FileResponse(open(file_path, "rb"))
+    return file_response(request, file_path)
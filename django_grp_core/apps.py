@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class DjangoGrpCoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "django_grp_core"
+
+    def ready(self):
+        from django_grp_core.timing import install_query_recorder
+
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,131 @@
+"""
+Primary/replica database routing.
+
+Replicas are configured in ``settings.py`` from ``REPLICA_DATABASE_*``
+environment variables and listed in ``settings.DATABASE_REPLICAS``. Reads go
+to a replica only while ``replica_reads`` is active, which
+``replica_routing_middleware`` enables for safe (GET/HEAD/OPTIONS) requests of
+clients that haven't written recently. Everything else - writes, reads in
+write requests, reads inside transactions - uses ``default``.
+"""
+
+import contextlib
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """Route reads in this block to replicas (if any are configured)."""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Send reads to a random replica while ``replica_reads`` is active."""
+
+    # Authentication state must be readable right after it's written
+    # (e.g. a token created by the login request).
+    primary_only_models = {"authtoken.token", "sessions.session"}
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if (
+            not replicas
+            or not _replica_reads.get()
+            or model._meta.label_lower in self.primary_only_models
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "DATABASE_REPLICAS", [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas copy the primary's schema.
+        if db in getattr(settings, "DATABASE_REPLICAS", []):
+            return False
+        return None
+
+
+def _pin_key(request):
+    """Cache key identifying the client by its credentials, or None if anonymous."""
+    credential = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credential:
+        return None
+    return "db-pin:" + hashlib.sha256(credential.encode()).hexdigest()
+
+
+def _pin_cache():
+    return caches[getattr(settings, "REPLICA_PIN_CACHE_ALIAS", "default")]
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Enable replica reads for safe requests, with read-your-writes stickiness.
+
+    After a client sends a write request, its reads stay on the primary for
+    ``REPLICA_STICKY_SECONDS`` so it never sees data older than its own
+    writes while replicas catch up. Clients are identified by their
+    Authorization header or session cookie; the pin lives in the
+    ``REPLICA_PIN_CACHE_ALIAS`` cache, which must be shared between workers.
+    """
+
+    def sticky_seconds():
+        return getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not getattr(settings, "DATABASE_REPLICAS", []):
+                return await get_response(request)
+            key = _pin_key(request)
+            if request.method in SAFE_METHODS:
+                pinned = key is not None and await _pin_cache().aget(key) is not None
+                with replica_reads(not pinned):
+                    return await get_response(request)
+            response = await get_response(request)
+            if key is not None:
+                await _pin_cache().aset(key, True, sticky_seconds())
+            return response
+
+    else:
+
+        def middleware(request):
+            if not getattr(settings, "DATABASE_REPLICAS", []):
+                return get_response(request)
+            key = _pin_key(request)
+            if request.method in SAFE_METHODS:
+                pinned = key is not None and _pin_cache().get(key) is not None
+                with replica_reads(not pinned):
+                    return get_response(request)
+            response = get_response(request)
+            if key is not None:
+                _pin_cache().set(key, True, sticky_seconds())
+            return response
+
+    return middleware
@@ -0,0 +1,401 @@
+"""
+In-process request metrics exposed in the Prometheus text format.
+
+``metrics_middleware`` records per route (URL name) and method:
+
+- ``grp_http_requests_total``             requests by status code
+- ``grp_http_request_duration_seconds``   latency histogram
+- ``grp_http_request_db_queries``         histogram of queries per request
+- ``grp_image_processing_seconds``        Pillow time of requests that use it
+
+Query counts and Pillow time come from the request timings collected by
+``django_grp_core.timing``, so the middleware has to run inside
+``server_timing_middleware``.
+
+Every worker process keeps its own registry. With ``METRICS["DIR"]`` set,
+workers periodically write a snapshot to
+``<DIR>/metrics-<host>-<pid>-<id>.json`` and ``render_metrics`` sums the
+snapshots of all workers, including those that exited, so counters stay
+monotonic across worker restarts. Snapshots of exited workers of the
+scraping host are folded into ``<DIR>/metrics-exited.json`` on every scrape,
+so the directory doesn't grow with each restart. Without it only the serving
+process is reported.
+"""
+
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from django_grp_core.timing import current_timings
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    # Directory shared by all workers; None keeps metrics per process.
+    "DIR": None,
+    # Seconds between two snapshot writes of one worker.
+    "FLUSH_INTERVAL": 5,
+    # Bearer token accepted at the metrics endpoint besides staff users.
+    "TOKEN": "",
+    "LATENCY_BUCKETS": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    "QUERY_BUCKETS": (0, 1, 2, 5, 10, 20, 50, 100, 200),
+    "IMAGE_BUCKETS": (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Sum of the snapshots of exited workers, see ``fold_exited_snapshots``.
+EXITED_FILE = "metrics-exited.json"
+
+# name -> (type, help)
+METRICS = {
+    "grp_http_requests_total": (
+        "counter",
+        "HTTP requests by route, method and status code.",
+    ),
+    "grp_http_request_duration_seconds": (
+        "histogram",
+        "HTTP request latency by route and method.",
+    ),
+    "grp_http_request_db_queries": (
+        "histogram",
+        "Database queries per HTTP request by route.",
+    ),
+    "grp_image_processing_seconds": (
+        "histogram",
+        "Pillow processing time per HTTP request by route.",
+    ),
+}
+
+
+def get_metrics_setting(name):
+    return getattr(settings, "METRICS", {}).get(name, METRICS_DEFAULTS[name])
+
+
+def _snapshot(counters, histograms):
+    return {
+        "counters": [
+            [name, list(labels), value] for (name, labels), value in counters.items()
+        ],
+        "histograms": [
+            [name, list(labels), buckets, list(counts), total, count]
+            for (name, labels), (buckets, counts, total, count) in histograms.items()
+        ],
+    }
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    """The content of ``path``, or None if it is gone or half-written."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by ``(name, labels)``."""
+
+    def __init__(self):
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.file_id = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> [buckets, bucket counts, sum, count]
+        self.histograms = {}
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [
+                    list(buckets),
+                    [0] * len(buckets),
+                    0.0,
+                    0,
+                ]
+            index = bisect.bisect_left(histogram[0], value)
+            if index < len(histogram[1]):
+                histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of all values."""
+        with self.lock:
+            return _snapshot(self.counters, self.histograms)
+
+    def path(self, directory):
+        return os.path.join(
+            directory, f"metrics-{self.host}-{self.pid}-{self.file_id}.json"
+        )
+
+    def flush(self):
+        """Write the snapshot of this process to the shared directory."""
+        directory = get_metrics_setting("DIR")
+        self.last_flush = time.monotonic()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        _write_json(self.path(directory), self.snapshot())
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= get_metrics_setting("FLUSH_INTERVAL"):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Could not write metrics snapshot")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def registry():
+    """The registry of this process; a forked worker starts with a fresh one."""
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                _registry = Registry()
+    return _registry
+
+
+@atexit.register
+def _flush_at_exit():
+    if _registry is not None and _registry.pid == os.getpid():
+        try:
+            _registry.flush()
+        except OSError:
+            pass
+
+
+def _merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, counts, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            if merged is None or merged[0] != buckets:
+                # Differing buckets (changed settings) can't be summed;
+                # only one of the definitions is reported.
+                histograms[key] = [buckets, list(counts), total, count]
+                continue
+            merged[1] = [a + b for a, b in zip(merged[1], counts)]
+            merged[2] += total
+            merged[3] += count
+    return counters, histograms
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _exited_snapshot_names(names, host):
+    """Snapshot files of workers of ``host`` that are no longer running."""
+    for name in names:
+        parts = name[len("metrics-") : -len(".json")].rsplit("-", 2)
+        if (
+            len(parts) == 3
+            and parts[0] == host
+            and parts[1].isdigit()
+            and not _process_exists(int(parts[1]))
+        ):
+            yield name
+
+
+def fold_exited_snapshots(directory, snapshots):
+    """
+    Add the ``snapshots`` (file name -> content) of exited workers of this
+    host to ``EXITED_FILE`` and delete their files. Returns ``snapshots``
+    as they are on disk afterwards.
+
+    Pids are only checked on their own host, as other hosts reuse them. The
+    folded file names are kept in ``EXITED_FILE`` until the files are gone,
+    so a scrape failing in between doesn't count them twice.
+    """
+    exited = snapshots.get(EXITED_FILE) or {"counters": [], "histograms": []}
+    folded = set(exited.get("folded", []))
+    names = list(_exited_snapshot_names(snapshots, socket.gethostname()))
+    if not names:
+        return snapshots
+    counters, histograms = _merge(
+        [exited] + [snapshots[name] for name in names if name not in folded]
+    )
+    exited = {**_snapshot(counters, histograms), "folded": names}
+    _write_json(os.path.join(directory, EXITED_FILE), exited)
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    snapshots = {
+        name: snapshot for name, snapshot in snapshots.items() if name not in names
+    }
+    snapshots[EXITED_FILE] = {**exited, "folded": []}
+    return snapshots
+
+
+def collect():
+    """Merged ``(counters, histograms)`` of all workers."""
+    own = registry()
+    directory = get_metrics_setting("DIR")
+    if not directory:
+        return _merge([own.snapshot()])
+
+    own.flush()
+    # One scrape at a time, so exited workers are folded exactly once.
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = {}
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            snapshot = _read_json(path)
+            # None if removed or written concurrently; skipped for this scrape.
+            if snapshot is not None:
+                snapshots[os.path.basename(path)] = snapshot
+        try:
+            snapshots = fold_exited_snapshots(directory, snapshots)
+        except OSError:
+            logger.exception("Could not fold metrics of exited workers")
+    folded = set(snapshots.get(EXITED_FILE, {}).get("folded", []))
+    return _merge(
+        snapshot for name, snapshot in snapshots.items() if name not in folded
+    )
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            continue
+        for (metric, labels), (buckets, counts, total, count) in sorted(
+            histograms.items()
+        ):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", repr(float(bound))),)
+                lines.append(f"{name}_bucket{_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def record_request(request, response, seconds):
+    """Add one finished request to the registry of this process."""
+    match = getattr(request, "resolver_match", None)
+    # URL names keep the label cardinality bounded, unlike raw paths.
+    route = (match.view_name or match.route) if match else "unmatched"
+    method = request.method
+
+    metrics = registry()
+    metrics.inc(
+        "grp_http_requests_total",
+        {"route": route, "method": method, "status": str(response.status_code)},
+    )
+    metrics.observe(
+        "grp_http_request_duration_seconds",
+        {"route": route, "method": method},
+        seconds,
+        get_metrics_setting("LATENCY_BUCKETS"),
+    )
+    timings = current_timings()
+    if timings is not None:
+        metrics.observe(
+            "grp_http_request_db_queries",
+            {"route": route},
+            timings.count("db"),
+            get_metrics_setting("QUERY_BUCKETS"),
+        )
+        if timings.count("pillow"):
+            metrics.observe(
+                "grp_image_processing_seconds",
+                {"route": route},
+                timings.phases["pillow"][1],
+                get_metrics_setting("IMAGE_BUCKETS"),
+            )
+    metrics.maybe_flush()
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Record count, status, latency, queries and Pillow time of each request."""
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            record_request(request, response, time.perf_counter() - start)
+            return response
+
+    else:
+
+        def middleware(request):
+            start = time.perf_counter()
+            response = get_response(request)
+            record_request(request, response, time.perf_counter() - start)
+            return response
+
+    return middleware
@@ -0,0 +1,337 @@
+import hashlib
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth import logout
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers, set_response_etag
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+COMPRESSION_DEFAULTS = {
+    # Responses shorter than this are sent as-is.
+    "MIN_LENGTH": 200,
+    # Content types that are already compressed. Entries ending in "/"
+    # match the whole major type (e.g. "video/").
+    "EXCLUDED_CONTENT_TYPES": [
+        "image/jpeg",
+        "image/png",
+        "image/gif",
+        "image/webp",
+        "image/avif",
+        "video/",
+        "audio/",
+        "application/pdf",
+        "application/zip",
+        "application/gzip",
+        "application/x-gzip",
+        "application/x-bzip2",
+        "application/x-xz",
+        "application/x-7z-compressed",
+        "application/zstd",
+        "font/woff",
+        "font/woff2",
+    ],
+    # Preferred encodings, best first. Unavailable codecs are skipped.
+    "ENCODINGS": ["br", "zstd", "gzip"],
+    # Compressed bodies of at least this size are cached by ETag.
+    "CACHE_MIN_LENGTH": 8192,
+    "CACHE_ALIAS": "default",
+    "CACHE_TIMEOUT": 3600,
+}
+
+
+def get_compression_setting(name):
+    return getattr(settings, "COMPRESSION", {}).get(name, COMPRESSION_DEFAULTS[name])
+
+
+class _ZlibStream:
+    def __init__(self):
+        self._obj = zlib.compressobj(wbits=31)
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _BrotliStream:
+    def __init__(self):
+        self._obj = brotli.Compressor()
+
+    def compress(self, chunk):
+        return self._obj.process(chunk) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self):
+        self._obj = zstandard.ZstdCompressor().compressobj()
+
+    def compress(self, chunk):
+        return self._obj.compress(chunk) + self._obj.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def _available_codecs():
+    codecs = {
+        "gzip": (
+            lambda data: compress_string(
+                data, max_random_bytes=CompressionMiddleware.max_random_bytes
+            ),
+            _ZlibStream,
+        ),
+    }
+    if brotli is not None:
+        codecs["br"] = (brotli.compress, _BrotliStream)
+    if zstandard is not None:
+        codecs["zstd"] = (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            _ZstdStream,
+        )
+    return codecs
+
+
+CODECS = _available_codecs()
+
+
+def parse_accept_encoding(header):
+    """Return a mapping of encoding -> q-value from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(header, preferred=None):
+    """
+    Pick the best available content coding for an Accept-Encoding header.
+
+    The client's q-values win; ties are broken by the server preference
+    order. Returns None if nothing acceptable is available.
+    """
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in preferred or get_compression_setting("ENCODINGS"):
+        if coding not in CODECS:
+            continue
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    for excluded in get_compression_setting("EXCLUDED_CONTENT_TYPES"):
+        if excluded.endswith("/"):
+            if media_type.startswith(excluded):
+                return False
+        elif media_type == excluded:
+            return False
+    return True
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Content-type aware replacement for ``GZipMiddleware``.
+
+    - Leaves already-compressed media (JPEG pictures, PDF exports, ...) alone.
+    - Negotiates brotli/zstd when the optional packages are installed and
+      falls back to gzip otherwise.
+    - Caches compressed bodies of large, cacheable responses keyed by their
+      strong ETag, so identical JSON payloads are compressed only once.
+    """
+
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        # It's not worth attempting to compress really short responses.
+        if not response.streaming and len(response.content) < get_compression_setting(
+            "MIN_LENGTH"
+        ):
+            return response
+
+        # Avoid compressing if we've already got a content-encoding.
+        if response.has_header("Content-Encoding"):
+            return response
+
+        if not is_compressible(response.get("Content-Type", "")):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        encoding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        compress, stream_class = CODECS[encoding]
+
+        if response.streaming:
+            response.streaming_content = self._compress_stream(response, stream_class)
+            # Delete the `Content-Length` header for streaming content, because
+            # we won't know the compressed size until we stream it.
+            del response.headers["Content-Length"]
+        else:
+            compressed_content = self._compress_content(response, encoding, compress)
+            # Return the compressed content only if it's actually shorter.
+            if compressed_content is None:
+                return response
+            response.content = compressed_content
+            response.headers["Content-Length"] = str(len(response.content))
+
+        # If there is a strong ETag, make it weak to fulfill the requirements
+        # of RFC 9110 Section 8.8.1 while also allowing conditional request
+        # matches on ETags.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+
+        return response
+
+    def _compress_content(self, response, encoding, compress):
+        """Compress a regular response body, going through the cache if possible."""
+        cache_key = None
+        if self._is_cacheable(response):
+            if not response.has_header("ETag"):
+                set_response_etag(response)
+            etag = response["ETag"]
+            if etag.startswith('"'):
+                digest = hashlib.md5(etag.encode(), usedforsecurity=False).hexdigest()
+                cache_key = f"compression:{encoding}:{digest}"
+                cached = caches[get_compression_setting("CACHE_ALIAS")].get(cache_key)
+                if cached is not None:
+                    return cached or None
+
+        compressed_content = compress(response.content)
+        if len(compressed_content) >= len(response.content):
+            compressed_content = b""
+
+        if cache_key is not None:
+            # An empty value remembers that compression didn't pay off.
+            caches[get_compression_setting("CACHE_ALIAS")].set(
+                cache_key,
+                compressed_content,
+                get_compression_setting("CACHE_TIMEOUT"),
+            )
+        return compressed_content or None
+
+    @staticmethod
+    def _is_cacheable(response):
+        if response.status_code != 200:
+            return False
+        if len(response.content) < get_compression_setting("CACHE_MIN_LENGTH"):
+            return False
+        cache_control = response.get("Cache-Control", "").lower()
+        return "no-store" not in cache_control
+
+    @staticmethod
+    def _compress_stream(response, stream_class):
+        # pull to lexical scope to capture fixed reference in case
+        # streaming_content is set again later.
+        original_iterator = response.streaming_content
+        stream = stream_class()
+
+        if response.is_async:
+
+            async def async_wrapper():
+                async for chunk in original_iterator:
+                    data = stream.compress(chunk)
+                    if data:
+                        yield data
+                yield stream.finish()
+
+            return async_wrapper()
+
+        def wrapper():
+            for chunk in original_iterator:
+                data = stream.compress(chunk)
+                if data:
+                    yield data
+            yield stream.finish()
+
+        return wrapper()
+
+
+AUTO_LOGOUT_DEFAULTS = {
+    "IDLE_TIME": timedelta(hours=1),
+    # The last-activity timestamp is only written back to the session once it
+    # moved by at least this much, so most requests don't save the session.
+    # Users may thus be logged out up to this much earlier than IDLE_TIME.
+    "ACTIVITY_GRANULARITY": timedelta(minutes=1),
+    "MESSAGE": None,
+}
+
+LAST_ACTIVITY_SESSION_KEY = "_last_activity"
+
+
+def get_auto_logout_setting(name):
+    return getattr(settings, "AUTO_LOGOUT", {}).get(name, AUTO_LOGOUT_DEFAULTS[name])
+
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else value
+
+
+class IdleTimeoutMiddleware(MiddlewareMixin):
+    """
+    Log session users out after ``AUTO_LOGOUT["IDLE_TIME"]`` without requests.
+
+    Replaces django_auto_logout, which stored a new timestamp - and thus
+    saved the session - on every request.
+    """
+
+    def process_request(self, request):
+        if not request.user.is_authenticated:
+            return
+        now = int(time.time())
+        last_activity = request.session.get(LAST_ACTIVITY_SESSION_KEY)
+
+        if last_activity is not None and now - last_activity > _seconds(
+            get_auto_logout_setting("IDLE_TIME")
+        ):
+            logout(request)
+            message = get_auto_logout_setting("MESSAGE")
+            if message:
+                messages.info(request, message)
+            return
+
+        if last_activity is None or now - last_activity >= _seconds(
+            get_auto_logout_setting("ACTIVITY_GRANULARITY")
+        ):
+            request.session[LAST_ACTIVITY_SESSION_KEY] = now
@@ -0,0 +1,168 @@
+"""
+Opt-in request profiling for staff users.
+
+A request carrying the ``X-Profile`` header or the ``_profile`` query
+parameter from a staff user runs under cProfile. The stats are stored as a
+``.prof`` (pstats) file in ``PROFILER["DIR"]`` and its name is returned in
+the ``X-Profile-Id`` response header; staff download it from
+``/api/v1/admin/profiles/<name>/`` and open it with ``python -m pstats``,
+snakeviz or flameprof. The oldest files are deleted once the directory holds
+more than ``MAX_FILES`` files or ``MAX_BYTES`` bytes.
+
+Requests without the switch only pay for one header and one query parameter
+lookup.
+"""
+
+import cProfile
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import slugify
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+PROFILER_DEFAULTS = {
+    # Outside the source tree, like partial uploads.
+    "DIR": os.path.join(tempfile.gettempdir(), "group-protocol-profiles"),
+    "MAX_FILES": 50,
+    "MAX_BYTES": 50 * 1024 * 1024,
+    "HEADER": "X-Profile",
+    "QUERY_PARAM": "_profile",
+}
+
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.prof$")
+
+
+def get_profiler_setting(name):
+    return getattr(settings, "PROFILER", {}).get(name, PROFILER_DEFAULTS[name])
+
+
+def profile_requested(request):
+    return bool(
+        request.headers.get(get_profiler_setting("HEADER"))
+        or request.GET.get(get_profiler_setting("QUERY_PARAM"))
+    )
+
+
+def _requesting_user(request):
+    """
+    Authenticate the request before the view does.
+
+    Token users are only known once DRF authenticates them inside the view,
+    but profiling has to start before it.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user
+    drf_request = Request(request)
+    for authenticator_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authenticator_class().authenticate(drf_request)
+        except APIException:
+            return AnonymousUser()
+        if result is not None:
+            return result[0]
+    return AnonymousUser()
+
+
+def list_profiles():
+    """Stored profiles as dicts with name, size and created (epoch), newest first."""
+    directory = get_profiler_setting("DIR")
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and PROFILE_NAME_RE.match(entry.name):
+            stat = entry.stat()
+            profiles.append(
+                {"name": entry.name, "size": stat.st_size, "created": stat.st_mtime}
+            )
+    return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+
+def profile_path(name):
+    """Path of a stored profile, or None if ``name`` is invalid or unknown."""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(get_profiler_setting("DIR"), name)
+    return path if os.path.isfile(path) else None
+
+
+def enforce_retention():
+    """Delete the oldest profiles until MAX_FILES and MAX_BYTES are respected."""
+    profiles = list_profiles()
+    total = sum(p["size"] for p in profiles)
+    max_files = get_profiler_setting("MAX_FILES")
+    max_bytes = get_profiler_setting("MAX_BYTES")
+    while profiles and (len(profiles) > max_files or total > max_bytes):
+        oldest = profiles.pop()
+        total -= oldest["size"]
+        try:
+            os.remove(os.path.join(get_profiler_setting("DIR"), oldest["name"]))
+        except FileNotFoundError:
+            pass
+
+
+def save_profile(profiler, request):
+    """Write the stats of ``profiler`` and return the file name."""
+    directory = get_profiler_setting("DIR")
+    os.makedirs(directory, exist_ok=True)
+    name = "{}-{}-{}-{}.prof".format(
+        time.strftime("%Y%m%d%H%M%S"),
+        request.method.lower(),
+        slugify(request.path.replace("/", "-"))[:60] or "root",
+        uuid.uuid4().hex[:8],
+    )
+    profiler.dump_stats(os.path.join(directory, name))
+    enforce_retention()
+    return name
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """Profile requests of staff users that ask for it."""
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not profile_requested(request):
+                return await get_response(request)
+            user = await sync_to_async(_requesting_user)(request)
+            if not user.is_staff:
+                return await get_response(request)
+            # Profiles the event loop thread only; work handed to
+            # sync_to_async threads shows up as waiting.
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = await get_response(request)
+            finally:
+                profiler.disable()
+            response["X-Profile-Id"] = await sync_to_async(save_profile)(
+                profiler, request
+            )
+            return response
+
+    else:
+
+        def middleware(request):
+            if not profile_requested(request) or not _requesting_user(request).is_staff:
+                return get_response(request)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+            response["X-Profile-Id"] = save_profile(profiler, request)
+            return response
+
+    return middleware
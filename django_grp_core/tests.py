@@ -1,3 +1,597 @@
-from django.test import TestCase
+import glob
+import gzip
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+from datetime import date
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.http import FileResponse, HttpResponse
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from django_grp_backend.models import Group, Protocol
+from django_grp_core import metrics, middleware
+from django_grp_core.db_router import (
+    PrimaryReplicaRouter,
+    replica_reads,
+    replica_routing_middleware,
+)
+from django_grp_core.middleware import (
+    LAST_ACTIVITY_SESSION_KEY,
+    CompressionMiddleware,
+    negotiate_encoding,
+)
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CompressionMiddlewareTestCase(TestCase):
+    """Test cases for the content-type aware compression middleware."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.payload = json.dumps(
+            [{"id": i, "name": f"Resident {i}"} for i in range(1000)]
+        ).encode()
+
+    def _process(self, response, accept_encoding="gzip"):
+        request = self.factory.get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda r: response)(request)
+
+    def test_json_is_gzipped(self):
+        """Test JSON responses are compressed when the client accepts gzip."""
+        response = self._process(
+            HttpResponse(self.payload, content_type="application/json")
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.payload)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_jpeg_is_not_compressed(self):
+        """Test already-compressed media types are passed through untouched."""
+        body = b"\xff\xd8\xff" + b"\x00" * 4096
+        response = self._process(HttpResponse(body, content_type="image/jpeg"))
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, body)
+
+    def test_streamed_pdf_is_not_compressed(self):
+        """Test streamed PDF downloads are not recompressed."""
+        response = FileResponse(iter([b"%PDF-1.7" + b"\x00" * 4096]))
+        response["Content-Type"] = "application/pdf"
+        response = self._process(response)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_no_accepted_encoding(self):
+        """Test responses are left alone when nothing acceptable is offered."""
+        response = self._process(
+            HttpResponse(self.payload, content_type="application/json"),
+            accept_encoding="gzip;q=0, identity",
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        """Test brotli wins over gzip when both are accepted equally."""
+        response = self._process(
+            HttpResponse(self.payload, content_type="application/json"),
+            accept_encoding="gzip, deflate, br",
+        )
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(middleware.brotli.decompress(response.content), self.payload)
+
+    def test_negotiation_respects_quality(self):
+        """Test the client's q-values take precedence over server preference."""
+        self.assertEqual(negotiate_encoding("br;q=0.1, gzip", ["br", "gzip"]), "gzip")
+        self.assertEqual(negotiate_encoding("*", ["gzip"]), "gzip")
+        self.assertIsNone(negotiate_encoding("identity", ["gzip"]))
+
+    def test_compressed_body_is_cached_by_etag(self):
+        """Test identical large bodies are compressed only once."""
+        gzip_codec = middleware.CODECS["gzip"]
+        with mock.patch.dict(
+            middleware.CODECS,
+            {"gzip": (mock.Mock(wraps=gzip_codec[0]), gzip_codec[1])},
+        ):
+            first = self._process(
+                HttpResponse(self.payload, content_type="application/json")
+            )
+            second = self._process(
+                HttpResponse(self.payload, content_type="application/json")
+            )
+            self.assertEqual(middleware.CODECS["gzip"][0].call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertTrue(second["ETag"].startswith('W/"'))
+
+    def test_no_store_responses_are_not_cached(self):
+        """Test responses marked no-store bypass the compression cache."""
+        response = HttpResponse(self.payload, content_type="application/json")
+        response["Cache-Control"] = "no-store"
+        response = self._process(response)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("ETag"))
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=["replica_0"], REPLICA_STICKY_SECONDS=5
+)
+class ReplicaRoutingTestCase(SimpleTestCase):
+    """Test cases for primary/replica routing with read-your-writes stickiness."""
+
+    # Not a TestCase: its per-test transaction would pin every read to the primary.
+    databases = {"default"}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+
+    def _read_db(self, method="get", token="abc"):
+        """Return the alias the router picks for a protocol read inside a request."""
+        chosen = []
+
+        def view(request):
+            chosen.append(self.router.db_for_read(Protocol))
+            return HttpResponse()
+
+        request = getattr(self.factory, method)(
+            "/", HTTP_AUTHORIZATION=f"Token {token}"
+        )
+        replica_routing_middleware(view)(request)
+        return chosen[0]
+
+    def test_reads_default_to_primary(self):
+        """Test reads outside of a request and all writes use the primary."""
+        self.assertEqual(self.router.db_for_read(Protocol), "default")
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Protocol), "default")
+
+    def test_replica_reads(self):
+        """Test replica reads skip auth models and open transactions."""
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Protocol), "replica_0")
+            self.assertEqual(self.router.db_for_read(Token), "default")
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Protocol), "default")
+
+    def test_safe_requests_read_from_replica(self):
+        """Test GET requests read from a replica and writes read from the primary."""
+        self.assertEqual(self.router.db_for_read(Protocol), "default")
+        self.assertEqual(self._read_db("get"), "replica_0")
+        self.assertEqual(self._read_db("post"), "default")
+
+    def test_client_is_pinned_after_write(self):
+        """Test a client reads its own writes from the primary for a while."""
+        self._read_db("post", token="writer")
+        self.assertEqual(self._read_db("get", token="writer"), "default")
+        self.assertEqual(self._read_db("get", token="other"), "replica_0")
+
+        cache.clear()  # the pin expired
+        self.assertEqual(self._read_db("get", token="writer"), "replica_0")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        """Test everything uses the primary when no replica is configured."""
+        self.assertEqual(self._read_db("get"), "default")
+
+    def test_replicas_need_shared_cache(self):
+        """Test replicas are refused when pins would only be seen by one worker."""
+        env = {
+            **os.environ,
+            "REPLICA_DATABASE_NAMES": "replica.sqlite3",
+            "REDIS_URL": "",
+        }
+        result = subprocess.run(
+            [sys.executable, "-c", "import django_group_protocol.settings"],
+            capture_output=True,
+            env=env,
+            text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("ImproperlyConfigured", result.stderr)
+
+
+@skipUnless("replica" in connections, "Needs the test settings' replica database.")
+@override_settings(
+    CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=["replica"], REPLICA_STICKY_SECONDS=5
+)
+class ReplicaReadTestCase(TransactionTestCase):
+    """Test cases for requests reading from a (lagging) replica database."""
+
+    # Not a TestCase: its per-test transaction would pin every read to the primary.
+    # Missing aliases would fail the runner's checks even though it's skipped.
+    databases = {"default", "replica"} & set(connections)
+
+    def setUp(self):
+        cache.clear()
+        self.writer = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.group = Group.objects.create(
+            name="Group", address="-", postalcode="-", city="-"
+        )
+        self.protocol = Protocol.objects.create(
+            protocol_date=date(2024, 1, 1), group=self.group
+        )
+        # The replica is in sync up to here.
+        for obj in (self.writer, self.reader, self.group, self.protocol):
+            obj.save(using="replica")
+        for db in ("default", "replica"):
+            Group.group_members.through.objects.using(db).bulk_create(
+                Group.group_members.through(group_id=self.group.id, user_id=user.id)
+                for user in (self.writer, self.reader)
+            )
+        self.clients = {}
+        for user in (self.writer, self.reader):
+            client = APIClient()
+            client.credentials(
+                HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}"
+            )
+            self.clients[user.username] = client
+
+    def _protocol_dates(self, username):
+        response = self.clients[username].get("/api/v1/protocol/")
+        self.assertEqual(response.status_code, 200)
+        return sorted(protocol["protocol_date"] for protocol in response.json())
+
+    def test_reads_go_to_replica_until_client_writes(self):
+        """Test GETs read the replica and a writing client reads the primary after."""
+        with CaptureQueriesContext(connections["replica"]) as replica_queries:
+            self.assertEqual(self._protocol_dates("writer"), ["2024-01-01"])
+        self.assertTrue(replica_queries.captured_queries)
+
+        response = self.clients["writer"].post(
+            "/api/v1/protocol/",
+            {"protocol_date": "2024-02-01", "group": self.group.id},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(
+            Protocol.objects.using("replica").filter(id=response.json()["id"]).exists()
+        )
+
+        # The writer is pinned to the primary and sees its protocol, the
+        # others still read the replica, which hasn't caught up.
+        self.assertEqual(self._protocol_dates("writer"), ["2024-01-01", "2024-02-01"])
+        self.assertEqual(self._protocol_dates("reader"), ["2024-01-01"])
+
+        cache.clear()  # the pin expired
+        self.assertEqual(self._protocol_dates("writer"), ["2024-01-01"])
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    SESSION_ENGINE="django.contrib.sessions.backends.cached_db",
+    AUTO_LOGOUT={"IDLE_TIME": 3600, "ACTIVITY_GRANULARITY": 60},
+)
+class IdleTimeoutMiddlewareTestCase(TestCase):
+    """Test cases for the idle logout middleware."""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username="staff", password="secret", is_staff=True)
+        self.now = 1_700_000_000
+        patcher = mock.patch("django_grp_core.middleware.time")
+        self.time = patcher.start()
+        self.time.time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.client.login(username="staff", password="secret")
+        self.client.get("/admin/")
+
+    def _session_writes(self, queries):
+        return [
+            query["sql"]
+            for query in queries
+            if "django_session" in query["sql"]
+            and query["sql"].lstrip().upper().startswith(("UPDATE", "INSERT"))
+        ]
+
+    def test_get_traffic_does_not_write_session(self):
+        """Test GET requests within the granularity don't save the session."""
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                self.now += 10
+                self.assertEqual(self.client.get("/admin/").status_code, 200)
+        self.assertEqual(self._session_writes(queries), [])
+
+    def test_activity_is_persisted_after_granularity(self):
+        """Test the timestamp is saved once it moved by the granularity."""
+        self.now += 61
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/admin/")
+        self.assertEqual(len(self._session_writes(queries)), 1)
+        self.assertEqual(self.client.session[LAST_ACTIVITY_SESSION_KEY], self.now)
+
+    def test_idle_user_is_logged_out(self):
+        """Test users are logged out after the idle time."""
+        self.now += 3601
+        response = self.client.get("/admin/")
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ServerTimingTestCase(TestCase):
+    """Test cases for request timing and the Server-Timing header."""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.member = User.objects.create_user(username="member")
+        self.group = Group.objects.create(
+            name="Group", address="Address", postalcode="12345", city="City"
+        )
+        self.group.group_members.add(self.member)
+        self.protocol = Protocol.objects.create(
+            protocol_date=date(2024, 1, 1), group=self.group
+        )
+
+    def _headers(self, user):
+        return {"authorization": f"Token {Token.objects.create(user=user).key}"}
+
+    def test_staff_get_server_timing(self):
+        """Test staff responses carry db, serialize and view timings."""
+        response = self.client.get(
+            "/api/v1/user/me/", headers=self._headers(self.staff)
+        )
+        self.assertEqual(response.status_code, 200)
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("serialize;dur=", timing)
+        self.assertIn("view;dur=", timing)
+
+    def test_members_get_no_server_timing(self):
+        """Test the header is not exposed to non-staff users."""
+        response = self.client.get(
+            "/api/v1/user/me/", headers=self._headers(self.member)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    async def test_async_view_queries_are_counted(self):
+        """Test queries run by async views in worker threads are recorded."""
+        headers = await sync_to_async(self._headers)(self.staff)
+        response = await AsyncClient().get(
+            f"/api/v1/protocol/{self.protocol.id}/exported_file/", headers=headers
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertRegex(response["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+    @override_settings(REQUEST_TIMING={"SLOW_MS": 10_000, "MAX_QUERIES": 1})
+    def test_requests_over_threshold_are_logged(self):
+        """Test requests exceeding the query threshold are logged."""
+        with self.assertLogs("django_grp_core.timing", "WARNING") as logs:
+            self.client.get("/api/v1/user/me/", headers=self._headers(self.member))
+        self.assertIn("GET /api/v1/user/me/", logs.output[0])
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    """Test cases for opt-in request profiling."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings_override = override_settings(
+            PROFILER={"DIR": self.directory, "MAX_FILES": 2}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.member = User.objects.create_user(username="member")
+        self.staff_headers = {
+            "authorization": f"Token {Token.objects.create(user=self.staff).key}"
+        }
+        self.member_headers = {
+            "authorization": f"Token {Token.objects.create(user=self.member).key}"
+        }
+
+    def test_staff_request_is_profiled(self):
+        """Test the X-Profile header stores a loadable pstats file."""
+        response = self.client.get(
+            "/api/v1/user/me/", headers={**self.staff_headers, "x-profile": "1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        path = os.path.join(self.directory, response["X-Profile-Id"])
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_query_parameter_switch(self):
+        """Test the _profile query parameter also enables profiling."""
+        response = self.client.get(
+            "/api/v1/user/me/?_profile=1", headers=self.staff_headers
+        )
+        self.assertTrue(response.has_header("X-Profile-Id"))
+
+    def test_non_staff_and_unrequested_are_not_profiled(self):
+        """Test nothing is profiled for members or without the switch."""
+        response = self.client.get(
+            "/api/v1/user/me/", headers={**self.member_headers, "x-profile": "1"}
+        )
+        self.assertFalse(response.has_header("X-Profile-Id"))
+        response = self.client.get("/api/v1/user/me/", headers=self.staff_headers)
+        self.assertFalse(response.has_header("X-Profile-Id"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_retention(self):
+        """Test only the newest MAX_FILES profiles are kept."""
+        names = []
+        for _ in range(3):
+            response = self.client.get(
+                "/api/v1/user/me/", headers={**self.staff_headers, "x-profile": "1"}
+            )
+            names.append(response["X-Profile-Id"])
+            # Distinct modification times for ordering.
+            os.utime(os.path.join(self.directory, names[-1]), (len(names), len(names)))
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(names[1:]))
+
+    def test_download(self):
+        """Test staff can list and download profiles, members cannot."""
+        name = self.client.get(
+            "/api/v1/user/me/", headers={**self.staff_headers, "x-profile": "1"}
+        )["X-Profile-Id"]
+
+        response = self.client.get(
+            "/api/v1/admin/profiles/", headers=self.staff_headers
+        )
+        self.assertEqual([p["name"] for p in response.json()], [name])
+        response = self.client.get(
+            f"/api/v1/admin/profiles/{name}/", headers=self.staff_headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response["Content-Disposition"])
+
+        response = self.client.get(
+            f"/api/v1/admin/profiles/{name}/", headers=self.member_headers
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            "/api/v1/admin/profiles/..%2Fsettings.py/", headers=self.staff_headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsTestCase(TestCase):
+    """Test cases for the Prometheus metrics registry and endpoint."""
+
+    def setUp(self):
+        metrics._registry = None
+        self.addCleanup(setattr, metrics, "_registry", None)
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.member = User.objects.create_user(username="member")
+        self.staff_headers = {
+            "authorization": f"Token {Token.objects.create(user=self.staff).key}"
+        }
+
+    def _scrape(self, headers=None):
+        response = self.client.get(
+            "/api/v1/admin/metrics/", headers=headers or self.staff_headers
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_recorded(self):
+        """Test counts, latency and query histograms are recorded per route."""
+        for _ in range(2):
+            self.client.get("/api/v1/user/me/", headers=self.staff_headers)
+        self.client.get("/api/v1/user/me/")
+
+        text = self._scrape()
+        self.assertIn(
+            'grp_http_requests_total{method="GET",route="user-me",status="200"} 2',
+            text,
+        )
+        self.assertIn(
+            'grp_http_requests_total{method="GET",route="user-me",status="401"} 1',
+            text,
+        )
+        self.assertIn(
+            'grp_http_request_duration_seconds_bucket{method="GET",route="user-me",'
+            'le="+Inf"} 3',
+            text,
+        )
+        self.assertRegex(
+            text, r'grp_http_request_db_queries_sum\{route="user-me"\} [1-9]'
+        )
+        self.assertIn("# TYPE grp_image_processing_seconds histogram", text)
+
+    def test_access(self):
+        """Test the endpoint is open to staff and the scrape token only."""
+        member_headers = {
+            "authorization": f"Token {Token.objects.create(user=self.member).key}"
+        }
+        response = self.client.get("/api/v1/admin/metrics/", headers=member_headers)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            "/api/v1/admin/metrics/", headers={"authorization": "Bearer secret"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+        with override_settings(METRICS={"TOKEN": "secret"}):
+            text = self._scrape({"authorization": "Bearer secret"})
+        self.assertIn("# TYPE grp_http_requests_total counter", text)
+
+    def test_workers_are_aggregated(self):
+        """Test snapshots of other workers in METRICS_DIR are summed."""
+        directory = tempfile.mkdtemp()
+        with override_settings(METRICS={"DIR": directory}):
+            other_worker = metrics.Registry()
+            other_worker.file_id = "other"
+            other_worker.inc(
+                "grp_http_requests_total",
+                {"route": "user-me", "method": "GET", "status": "200"},
+                5,
+            )
+            other_worker.observe(
+                "grp_http_request_db_queries", {"route": "test"}, 3, (1, 5)
+            )
+            other_worker.flush()
+
+            self.client.get("/api/v1/user/me/", headers=self.staff_headers)
+            metrics.registry().observe(
+                "grp_http_request_db_queries", {"route": "test"}, 1, (1, 5)
+            )
+            text = self._scrape()
+
+        self.assertEqual(len(glob.glob(os.path.join(directory, "*.json"))), 2)
+        self.assertIn(
+            'grp_http_requests_total{method="GET",route="user-me",status="200"} 6',
+            text,
+        )
+        self.assertIn(
+            'grp_http_request_db_queries_bucket{route="test",le="1.0"} 1', text
+        )
+        self.assertIn(
+            'grp_http_request_db_queries_bucket{route="test",le="5.0"} 2', text
+        )
+        self.assertIn('grp_http_request_db_queries_count{route="test"} 2', text)
+
+    def test_exited_workers_are_folded(self):
+        """Test snapshots of exited workers are merged into one file, counts kept."""
+        directory = tempfile.mkdtemp()
+        exited_pid = subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"],
+            capture_output=True,
+            check=True,
+        ).stdout
+        with override_settings(METRICS={"DIR": directory}):
+            for file_id in ("a", "b"):
+                exited_worker = metrics.Registry()
+                exited_worker.pid, exited_worker.file_id = int(exited_pid), file_id
+                exited_worker.inc("grp_http_requests_total", {"route": "x"}, 2)
+                exited_worker.flush()
+
+            for _ in range(2):
+                text = self._scrape()
+                self.assertIn('grp_http_requests_total{route="x"} 4', text)
+
+        self.assertCountEqual(
+            [os.path.basename(path) for path in glob.glob(f"{directory}/*.json")],
+            [metrics.EXITED_FILE, os.path.basename(metrics.registry().path(directory))],
+        )
+
+    def test_forked_worker_starts_fresh(self):
+        """Test a process with another pid does not inherit parent counts."""
+        parent = metrics.registry()
+        parent.inc("grp_http_requests_total", {"route": "x"})
+        with mock.patch("django_grp_core.metrics.os.getpid", return_value=-1):
+            child = metrics.registry()
+        self.assertIsNot(child, parent)
+        self.assertEqual(child.counters, {})
@@ -0,0 +1,168 @@
+"""
+Per-request timing: database queries, serialization, Pillow and total view time.
+
+``server_timing_middleware`` collects the timings of each request, adds them
+as a ``Server-Timing`` header for staff users and logs requests that exceed
+``REQUEST_TIMING["SLOW_MS"]`` or ``REQUEST_TIMING["MAX_QUERIES"]``.
+
+Queries are recorded by an execute wrapper installed on every database
+connection, serialization by ``TimedJSONRenderer`` (the default DRF JSON
+renderer, see ``REST_FRAMEWORK`` in settings); other code can record its own
+phases with ``timed(name)``. All of it is a no-op outside of a timed request.
+"""
+
+import contextlib
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMING_DEFAULTS = {
+    # Requests slower than this (total view time, ms) are logged.
+    "SLOW_MS": 1000,
+    # Requests running more queries than this are logged.
+    "MAX_QUERIES": 50,
+}
+
+
+def get_request_timing_setting(name):
+    return getattr(settings, "REQUEST_TIMING", {}).get(
+        name, REQUEST_TIMING_DEFAULTS[name]
+    )
+
+
+class RequestTimings:
+    """Accumulated ``name -> [count, seconds]`` of one request."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds):
+        phase = self.phases.setdefault(name, [0, 0.0])
+        phase[0] += 1
+        phase[1] += seconds
+
+    def count(self, name):
+        return self.phases.get(name, [0, 0.0])[0]
+
+    def ms(self, name):
+        return self.phases.get(name, [0, 0.0])[1] * 1000
+
+    def header(self):
+        """Format the phases as a Server-Timing header value."""
+        metrics = []
+        for name, (count, seconds) in self.phases.items():
+            metric = f"{name};dur={seconds * 1000:.1f}"
+            if name == "db":
+                metric += f';desc="{count} queries"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+def current_timings():
+    """The timings of the request being handled, or None."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Add the duration of the block to phase ``name`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding every query to the "db" phase."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", time.perf_counter() - start)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """``connection_created`` receiver installing ``record_query``."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSON renderer adding the time it takes to the "serialize" phase."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed("serialize"):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def _finish(request, response, timings, start):
+    timings.add("view", time.perf_counter() - start)
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        response["Server-Timing"] = timings.header()
+
+    view_ms = timings.ms("view")
+    queries = timings.count("db")
+    if view_ms > get_request_timing_setting("SLOW_MS") or queries > (
+        get_request_timing_setting("MAX_QUERIES")
+    ):
+        logger.warning(
+            "Slow request %s %s: %d ms, %d queries (%d ms), serialize %d ms",
+            request.method,
+            request.path,
+            view_ms,
+            queries,
+            timings.ms("db"),
+            timings.ms("serialize"),
+            extra={"timings": timings.phases, "status_code": response.status_code},
+        )
+    return response
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Time each request and report it via Server-Timing (staff) and the log."""
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, timings, start)
+
+    else:
+
+        def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, timings, start)
+
+    return middleware
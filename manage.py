@@ -6,7 +6,11 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_group_protocol.settings")
+    settings_module = "django_group_protocol.settings"
+    if sys.argv[1:2] == ["test"]:
+        # Adds the databases only tests use.
+        settings_module = "django_group_protocol.test_settings"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: